@@ -1,17 +1,114 @@
 from flask import Flask
 from flask_cors import CORS
+from dotenv import load_dotenv
 import os
 
+# 加载环境变量
+load_dotenv()
+
 # 创建Flask应用实例
 app = Flask(__name__)
 
 # 配置CORS，允许跨域请求
 CORS(app)
 
-# 设置上传文件夹（使用应用根目录的相对路径）
-app.config['UPLOAD_FOLDER'] = 'uploads'
+# 项目根目录：下面的相对路径（包括环境变量中的）都按项目根目录解析，不受启动服务时工作目录的影响
+BASE_DIR = os.path.dirname(app.root_path)
+
+
+def project_path(path):
+    """
+    :param path: 配置的文件或目录路径，空字符串表示关闭
+    :return: 绝对路径，相对路径按项目根目录解析；空字符串原样返回
+    """
+    return os.path.join(BASE_DIR, path) if path else path
+
+
+# 设置上传文件夹
+app.config['UPLOAD_FOLDER'] = project_path(os.environ.get('UPLOAD_FOLDER', 'uploads'))
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
 
+# 图片分析的工作分辨率（长边像素数），0表示使用原始分辨率（默认）
+# 缩小分析可以降低大图的分析耗时，建议不小于800，更小时比工作分辨率更细的纹理会影响复杂度判断
+app.config['ANALYSIS_WORKING_SIZE'] = int(os.environ.get('ANALYSIS_WORKING_SIZE', 0))
+
+# 场景分析结果缓存：内存中最多保留的条目数（0表示关闭），以及可选的磁盘缓存目录和其中最多保留的文件数量
+app.config['ANALYSIS_CACHE_SIZE'] = int(os.environ.get('ANALYSIS_CACHE_SIZE', 256))
+app.config['ANALYSIS_CACHE_DIR'] = project_path(os.environ.get('ANALYSIS_CACHE_DIR', ''))
+app.config['ANALYSIS_CACHE_MAX_FILES'] = int(os.environ.get('ANALYSIS_CACHE_MAX_FILES', 10000))
+
+# AI生成图片本地存储：保存目录（为空表示直接返回DashScope的临时链接）、缩略图长边像素数、最多保留的图片数量和下载超时（秒）
+app.config['IMAGE_STORE_DIR'] = project_path(os.environ.get('IMAGE_STORE_DIR', os.path.join('cache', 'images')))
+app.config['IMAGE_THUMBNAIL_SIZE'] = int(os.environ.get('IMAGE_THUMBNAIL_SIZE', 384))
+app.config['IMAGE_STORE_MAX_FILES'] = int(os.environ.get('IMAGE_STORE_MAX_FILES', 3000))
+app.config['IMAGE_FETCH_TIMEOUT'] = float(os.environ.get('IMAGE_FETCH_TIMEOUT', 30))
+
+# AI生成结果缓存：SQLite文件路径（为空表示关闭）、有效期（秒）和最多保留的条目数
+# 图片保存在本地时缓存结果不受DashScope临时链接有效期（24小时）的限制
+app.config['GENERATION_CACHE_PATH'] = project_path(
+    os.environ.get('GENERATION_CACHE_PATH', os.path.join('cache', 'generation.sqlite3'))
+)
+app.config['GENERATION_CACHE_TTL'] = int(os.environ.get(
+    'GENERATION_CACHE_TTL', 604800 if app.config['IMAGE_STORE_DIR'] else 43200
+))
+app.config['GENERATION_CACHE_SIZE'] = int(os.environ.get('GENERATION_CACHE_SIZE', 1000))
+
+# 关键词图片搜索缓存：新鲜期和陈旧期（秒，陈旧期内先返回旧结果并在后台刷新）、内存条目数和磁盘目录
+app.config['SEARCH_CACHE_TTL'] = int(os.environ.get('SEARCH_CACHE_TTL', 3600))
+app.config['SEARCH_CACHE_STALE_TTL'] = int(os.environ.get('SEARCH_CACHE_STALE_TTL', 86400))
+app.config['SEARCH_CACHE_SIZE'] = int(os.environ.get('SEARCH_CACHE_SIZE', 2048))
+app.config['SEARCH_CACHE_DIR'] = project_path(os.environ.get('SEARCH_CACHE_DIR', os.path.join('cache', 'search')))
+
+# 上传DashScope前缩小和重新编码图片：长边最大像素数（0表示不缩小）、格式（jpeg、webp或original原样上传）和编码质量
+app.config['DASHSCOPE_IMAGE_MAX_SIZE'] = int(os.environ.get('DASHSCOPE_IMAGE_MAX_SIZE', 1536))
+app.config['DASHSCOPE_IMAGE_FORMAT'] = os.environ.get('DASHSCOPE_IMAGE_FORMAT', 'jpeg').lower()
+app.config['DASHSCOPE_IMAGE_QUALITY'] = int(os.environ.get('DASHSCOPE_IMAGE_QUALITY', 85))
+
+# DashScope调用限流（每个进程）：同时进行的最大请求数、最多排队的请求数、最长排队时间（秒），
+# 以及每秒请求数（0表示不限制速率）和令牌桶容量；超出容量的请求不再等待，直接返回分析结果和拍摄建议
+app.config['DASHSCOPE_MAX_CONCURRENCY'] = int(os.environ.get('DASHSCOPE_MAX_CONCURRENCY', 8))
+app.config['DASHSCOPE_MAX_QUEUE'] = int(os.environ.get('DASHSCOPE_MAX_QUEUE', 32))
+app.config['DASHSCOPE_QUEUE_TIMEOUT'] = float(os.environ.get('DASHSCOPE_QUEUE_TIMEOUT', 10))
+app.config['DASHSCOPE_RATE_LIMIT'] = float(os.environ.get('DASHSCOPE_RATE_LIMIT', 0))
+app.config['DASHSCOPE_RATE_BURST'] = int(os.environ.get('DASHSCOPE_RATE_BURST', 5))
+
+# DashScope熔断：连续失败（请求异常、超时、429或5xx）达到次数后熔断（0表示关闭），冷却时间（秒）内直接跳过AI生成
+app.config['DASHSCOPE_BREAKER_THRESHOLD'] = int(os.environ.get('DASHSCOPE_BREAKER_THRESHOLD', 5))
+app.config['DASHSCOPE_BREAKER_COOLDOWN'] = float(os.environ.get('DASHSCOPE_BREAKER_COOLDOWN', 30))
+
+# 推荐请求的截止时间（秒）：排队和DashScope请求都不会超过该时间，到期时返回已完成的分析和建议（0表示不限制）
+app.config['REQUEST_DEADLINE'] = float(os.environ.get('REQUEST_DEADLINE', 60))
+
+# 推荐流程中并发执行各步骤的线程数量
+app.config['PIPELINE_WORKERS'] = int(os.environ.get('PIPELINE_WORKERS', 8))
+
+# 批量推荐：分析图片的进程数量（0表示使用CPU核数）和每批最多图片数量
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', 0))
+app.config['BATCH_MAX_IMAGES'] = int(os.environ.get('BATCH_MAX_IMAGES', 50))
+
+# 异步推荐任务：后台线程数量、已完成任务的保留时间（秒）和SSE心跳间隔（秒）
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 4))
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', 600))
+app.config['JOB_HEARTBEAT_INTERVAL'] = int(os.environ.get('JOB_HEARTBEAT_INTERVAL', 15))
+# 多个工作进程共享任务状态的SQLite文件路径（为空表示只在本进程中保存，多进程部署时必须设置）
+app.config['JOB_STORE_PATH'] = project_path(os.environ.get('JOB_STORE_PATH', ''))
+
+# 异步服务（run_async.py）：执行场景分析和拍摄建议的线程数量（0表示使用CPU核数）
+app.config['ASYNC_ANALYSIS_WORKERS'] = int(os.environ.get('ASYNC_ANALYSIS_WORKERS', 0))
+
+# 是否将/api/recommend的上传图片保存到上传文件夹（默认只在内存中处理）
+app.config['PERSIST_UPLOADS'] = os.environ.get('PERSIST_UPLOADS', 'false').lower() in ('1', 'true', 'yes')
+
+# 是否在/api/recommend的响应中添加Server-Timing头，浏览器开发者工具中可以看到各步骤耗时
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+
+# 请求剖析（默认关闭）：随机抽样剖析/api/recommend的比例（0到1）、通过请求头X-Profile-Token触发剖析的令牌、
+# 保存剖析结果的目录和最多保留的结果数量
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN', '')
+app.config['PROFILE_DIR'] = project_path(os.environ.get('PROFILE_DIR', os.path.join('cache', 'profiles')))
+app.config['PROFILE_MAX_FILES'] = int(os.environ.get('PROFILE_MAX_FILES', 50))
+
 # 确保上传文件夹存在
 UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
 if not os.path.exists(UPLOAD_FOLDER):
@@ -0,0 +1,241 @@
+"""
+基于asyncio（aiohttp）的推荐服务，与Flask应用共用分析、建议、生成和搜索模块
+
+等待DashScope和搜索引擎响应时不占用线程，一个进程可以同时处理大量进行中的推荐请求；
+场景分析和拍摄建议是CPU计算，放到线程池中执行。
+
+启动方式参见run_async.py。
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from app import app
+from app.routes import (
+    image_analyzer, style_matcher, image_searcher, advice_generator, ai_image_generator,
+    analysis_cache, generation_cache, search_cache, image_store
+)
+from app.utils.image_store import MEDIA_MAX_AGE
+from app.utils.metrics import (
+    REGISTRY, HTTP_REQUESTS, HTTP_REQUEST_DURATION, HTTP_IN_FLIGHT, observe_stages, server_timing
+)
+from app.utils.recommend_pipeline import StageTimer
+from app.utils.upstream import UpstreamTimeoutError, UpstreamUnavailableError
+
+# 执行CPU计算的线程池
+EXECUTOR_KEY = web.AppKey('executor', ThreadPoolExecutor)
+
+
+def create_async_app(analysis_workers=None):
+    """
+    创建异步服务应用
+    :param analysis_workers: 执行场景分析和拍摄建议的线程数量，默认使用配置ASYNC_ANALYSIS_WORKERS
+    :return: aiohttp.web.Application
+    """
+    analysis_workers = analysis_workers or app.config['ASYNC_ANALYSIS_WORKERS'] or os.cpu_count() or 1
+
+    application = web.Application(client_max_size=app.config['MAX_CONTENT_LENGTH'],
+                                  middlewares=[request_metrics])
+    application[EXECUTOR_KEY] = ThreadPoolExecutor(max_workers=analysis_workers, thread_name_prefix='async-analysis')
+    application.router.add_get('/api/styles', get_styles)
+    application.router.add_get('/api/cache/stats', get_cache_stats)
+    application.router.add_get('/metrics', get_metrics)
+    application.router.add_get('/media/{name}', get_media)
+    application.router.add_post('/api/recommend', recommend_pose)
+    application.router.add_get('/api/search', search_images)
+    application.on_cleanup.append(_cleanup)
+    return application
+
+
+async def _cleanup(application):
+    await image_searcher.aclose()
+    application[EXECUTOR_KEY].shutdown(wait=False)
+
+
+# 记录每个请求的状态码、耗时和正在处理的请求数量，接口名称与Flask应用一致
+@web.middleware
+async def request_metrics(request, handler):
+    match_info = request.match_info
+    endpoint = 'unmatched' if match_info.http_exception is not None else match_info.handler.__name__
+    started = time.perf_counter()
+    status = 500
+    HTTP_IN_FLIGHT.inc(endpoint=endpoint)
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint)
+
+
+# Prometheus格式的运行指标，缓存命中统计由Flask路由模块注册
+async def get_metrics(request):
+    return web.Response(body=REGISTRY.render().encode('utf-8'),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+# 本地保存的AI生成图片和缩略图，FileResponse支持条件请求和Range请求
+async def get_media(request):
+    name = request.match_info['name']
+    path = image_store.path(name) if image_store is not None else None
+    if path is None:
+        return web.json_response({'error': 'Image not found'}, status=404)
+    return web.FileResponse(path, headers={'Cache-Control': f'public, max-age={MEDIA_MAX_AGE}, immutable'})
+
+
+# 获取可用风格列表
+async def get_styles(request):
+    return web.json_response({'styles': style_matcher.get_available_styles()})
+
+
+# 获取缓存统计
+async def get_cache_stats(request):
+    stats = {'analysis': analysis_cache.stats(), 'search': search_cache.stats()}
+    if generation_cache is not None:
+        stats['generation'] = generation_cache.stats()
+    return web.json_response(stats)
+
+
+# 姿势推荐，返回结果与Flask应用的/api/recommend一致
+async def recommend_pose(request):
+    try:
+        timer = StageTimer()
+        executor = request.app[EXECUTOR_KEY]
+        image_bytes, style = await timer.run_async('save', _read_recommend_request(request, executor))
+        if image_bytes is None:
+            return web.json_response({'error': 'Missing image or style parameter'}, status=400)
+
+        result = await _run_recommend(executor, image_bytes, style, num_images=3, timer=timer,
+                                      deadline=_request_deadline())
+        observe_stages(result['timings'])
+
+        headers = {}
+        if app.config['SERVER_TIMING']:
+            headers['Server-Timing'] = server_timing(result['timings'])
+        return web.json_response(result, headers=headers)
+
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def _read_recommend_request(request, executor):
+    """
+    读取推荐请求中的图片和风格
+    :param request: aiohttp请求
+    :param executor: 读取上传文件的线程池
+    :return: (图片字节数据, 风格)，参数缺失时图片字节数据为None
+    """
+    data = await request.post()
+    image_file = data.get('image')
+    style = data.get('style')
+    if not isinstance(image_file, web.FileField) or not style:
+        return None, style
+
+    # request.post()把上传文件写入临时文件，读取是阻塞的文件操作，放到线程池中不占用事件循环
+    image_bytes = await asyncio.get_running_loop().run_in_executor(executor, image_file.file.read)
+    return image_bytes, style
+
+
+def _request_deadline():
+    if app.config['REQUEST_DEADLINE'] <= 0:
+        return None
+    return time.monotonic() + app.config['REQUEST_DEADLINE']
+
+
+async def _run_recommend(executor, image_bytes, style, num_images=3, timer=None, deadline=None):
+    """
+    与RecommendPipeline.run相同的步骤和重叠方式，CPU计算在线程池中执行，等待上游时不占用线程
+    :param executor: 执行CPU计算的线程池
+    :param image_bytes: 图片字节数据
+    :param style: 风格
+    :param num_images: AI生成参考图片数量
+    :param timer: 已记录读取请求耗时的StageTimer，None表示从现在开始计时
+    :param deadline: 请求的截止时间（time.monotonic()），到期时不再等待AI生成，None表示不限制
+    :return: 推荐结果字典，包含各步骤耗时timings
+    """
+    loop = asyncio.get_running_loop()
+    timer = timer or StageTimer()
+
+    # 生成缓存键所需的图片哈希与场景分析同时计算
+    prepared_task = asyncio.ensure_future(timer.run_async('prepare', loop.run_in_executor(
+        executor, ai_image_generator.prepare_hashed, image_bytes
+    )))
+
+    try:
+        # 1. 分析图片（相同图片直接使用缓存结果）
+        scene_features = await timer.run_async('analyze', loop.run_in_executor(
+            executor, analysis_cache.get_or_compute, image_bytes, image_analyzer.analyze_bytes
+        ))
+
+        # 2. 风格匹配
+        timer.run('match', style_matcher.match_style, style)
+    except Exception:
+        prepared_task.cancel()
+        raise
+
+    # 3. AI生成参考图片，分析完成后立即开始
+    async def generate():
+        try:
+            # 熔断时不必等待图片准备完成
+            ai_image_generator.ensure_available()
+            prepared = await prepared_task
+            return await ai_image_generator.generate_images_from_image_async(
+                prepared, scene_features, style, num_images=num_images, executor=executor, deadline=deadline
+            ), None
+        except UpstreamUnavailableError as e:
+            return [], e.to_dict()
+
+    generate_task = asyncio.ensure_future(timer.run_async('generate', generate()))
+
+    # 4. 等待上游生成的同时生成拍摄建议
+    advice = await timer.run_async('advice', loop.run_in_executor(
+        executor, advice_generator.generate_advice, scene_features, style
+    ))
+    try:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        ai_reference_images, ai_error = await asyncio.wait_for(generate_task, timeout)
+    except asyncio.TimeoutError:
+        ai_reference_images = []
+        ai_error = UpstreamTimeoutError('Request deadline exceeded while generating AI reference images').to_dict()
+
+    return {
+        'scene_features': scene_features,
+        'style': style,
+        'ai_reference_images': ai_reference_images,
+        'ai_error': ai_error,
+        'advice': advice,
+        'timings': timer.finish()
+    }
+
+
+# 根据场景特征和风格搜索参考图片
+async def search_images(request):
+    params = request.query
+    style = params.get('style')
+    scene_features = {
+        'scene_type': params.get('scene_type'),
+        'light_type': params.get('light_type'),
+        'colors': {'dominant_color': params.get('dominant_color')}
+    }
+
+    if not style or None in (scene_features['scene_type'], scene_features['light_type'],
+                             scene_features['colors']['dominant_color']):
+        return web.json_response({'error': 'Missing scene_type, light_type, dominant_color or style parameter'},
+                                 status=400)
+
+    try:
+        limit = int(params.get('limit', 5))
+    except ValueError:
+        return web.json_response({'error': 'Invalid limit parameter'}, status=400)
+
+    keywords = image_analyzer.generate_search_keywords(scene_features, style)
+    images = await image_searcher.search_images_async(keywords, limit=limit)
+    return web.json_response({'keywords': keywords, 'images': images})
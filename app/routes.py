@@ -1,19 +1,162 @@
-from flask import request, jsonify, render_template
+from flask import (
+    g, request, jsonify, make_response, render_template, send_file, Response, stream_with_context, url_for
+)
 from app import app
 from app.utils.image_analyzer import ImageAnalyzer
 from app.utils.style_matcher import StyleMatcher
 from app.utils.image_searcher import ImageSearcher
 from app.utils.advice_generator import AdviceGenerator
-from app.utils.ai_image_generator import AIImageGenerator
+from app.utils.ai_image_generator import AIImageGenerator, UploadEncoder
+from app.utils.analysis_cache import AnalysisCache
+from app.utils.generation_cache import GenerationCache
+from app.utils.image_store import ImageStore, MEDIA_MAX_AGE
+from app.utils.search_cache import SearchCache
+from app.utils.job_manager import JobManager, FINISHED_STATUSES
+from app.utils.recommend_pipeline import RecommendPipeline, StageTimer
+from app.utils.batch_analyzer import BatchAnalyzer
+from app.utils.request_profiler import RequestProfiler
+from app.utils.upstream import CircuitBreaker, UpstreamLimiter, UpstreamUnavailableError
+from app.utils.metrics import (
+    REGISTRY, HTTP_REQUESTS, HTTP_REQUEST_DURATION, HTTP_IN_FLIGHT, cache_collector, observe_stages, server_timing
+)
+import json
 import os
+import time
 from werkzeug.utils import secure_filename
 
 # 初始化各个模块
-image_analyzer = ImageAnalyzer()
+image_analyzer = ImageAnalyzer(working_size=app.config['ANALYSIS_WORKING_SIZE'])
 style_matcher = StyleMatcher()
-image_searcher = ImageSearcher()
+search_cache = SearchCache(
+    ttl=app.config['SEARCH_CACHE_TTL'],
+    stale_ttl=app.config['SEARCH_CACHE_STALE_TTL'],
+    max_entries=app.config['SEARCH_CACHE_SIZE'],
+    cache_dir=app.config['SEARCH_CACHE_DIR']
+)
+image_searcher = ImageSearcher(cache=search_cache)
 advice_generator = AdviceGenerator()
-ai_image_generator = AIImageGenerator()
+image_store = None
+if app.config['IMAGE_STORE_DIR']:
+    image_store = ImageStore(
+        app.config['IMAGE_STORE_DIR'],
+        thumbnail_size=app.config['IMAGE_THUMBNAIL_SIZE'],
+        fetch_timeout=app.config['IMAGE_FETCH_TIMEOUT'],
+        max_files=app.config['IMAGE_STORE_MAX_FILES']
+    )
+generation_cache = None
+if app.config['GENERATION_CACHE_PATH']:
+    generation_cache = GenerationCache(
+        app.config['GENERATION_CACHE_PATH'],
+        ttl=app.config['GENERATION_CACHE_TTL'],
+        max_entries=app.config['GENERATION_CACHE_SIZE'],
+        image_store=image_store
+    )
+upload_encoder = UploadEncoder(
+    max_size=app.config['DASHSCOPE_IMAGE_MAX_SIZE'],
+    image_format=app.config['DASHSCOPE_IMAGE_FORMAT'],
+    quality=app.config['DASHSCOPE_IMAGE_QUALITY']
+)
+dashscope_limiter = UpstreamLimiter(
+    'dashscope',
+    max_concurrent=app.config['DASHSCOPE_MAX_CONCURRENCY'],
+    max_queue=app.config['DASHSCOPE_MAX_QUEUE'],
+    queue_timeout=app.config['DASHSCOPE_QUEUE_TIMEOUT'],
+    rate=app.config['DASHSCOPE_RATE_LIMIT'],
+    burst=app.config['DASHSCOPE_RATE_BURST']
+)
+dashscope_breaker = CircuitBreaker(
+    'dashscope',
+    failure_threshold=app.config['DASHSCOPE_BREAKER_THRESHOLD'],
+    reset_timeout=app.config['DASHSCOPE_BREAKER_COOLDOWN']
+)
+ai_image_generator = AIImageGenerator(
+    cache=generation_cache,
+    encoder=upload_encoder,
+    limiter=dashscope_limiter,
+    breaker=dashscope_breaker,
+    store=image_store
+)
+analysis_cache = AnalysisCache(
+    max_entries=app.config['ANALYSIS_CACHE_SIZE'],
+    cache_dir=app.config['ANALYSIS_CACHE_DIR'],
+    namespace=f"w{app.config['ANALYSIS_WORKING_SIZE']}-",
+    max_files=app.config['ANALYSIS_CACHE_MAX_FILES']
+)
+recommend_pipeline = RecommendPipeline(
+    image_analyzer,
+    analysis_cache,
+    style_matcher,
+    advice_generator,
+    ai_image_generator,
+    max_workers=app.config['PIPELINE_WORKERS']
+)
+batch_analyzer = BatchAnalyzer(
+    max_workers=app.config['BATCH_WORKERS'],
+    working_size=app.config['ANALYSIS_WORKING_SIZE']
+)
+job_manager = JobManager(
+    max_workers=app.config['JOB_WORKERS'],
+    ttl=app.config['JOB_TTL'],
+    store_path=app.config['JOB_STORE_PATH']
+)
+request_profiler = RequestProfiler(
+    app.config['PROFILE_DIR'],
+    sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+    token=app.config['PROFILE_TOKEN'],
+    max_profiles=app.config['PROFILE_MAX_FILES']
+)
+# 导出指标时读取各缓存的命中统计，生成缓存可能在运行中被替换，每次从生成器上读取
+REGISTRY.register_collector(cache_collector(lambda: {
+    'analysis': analysis_cache,
+    'search': search_cache,
+    'generation': ai_image_generator.cache
+}))
+
+# 记录每个请求的状态码、耗时和正在处理的请求数量
+@app.before_request
+def _start_request_metrics():
+    g.metrics_endpoint = request.endpoint or 'unmatched'
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+@app.after_request
+def _record_request_metrics(response):
+    endpoint = g.get('metrics_endpoint')
+    if endpoint is not None:
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - g.metrics_started, endpoint=endpoint)
+    return response
+
+# 请求出错时after_request可能不会执行，在请求上下文结束时减少正在处理的请求数量
+@app.teardown_request
+def _finish_request_metrics(exc=None):
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is not None:
+        HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+
+def _stream_response(body, **kwargs):
+    """
+    创建流式响应。视图函数返回后请求上下文就结束了，响应内容此时还没有生成，
+    因此请求指标改为在服务器关闭响应（发送完成或客户端断开）时记录，耗时和正在处理的请求数量都包含生成响应内容的时间
+    :param body: 产生响应内容的生成器
+    :param kwargs: 传给Response的其他参数
+    :return: Response
+    """
+    response = Response(body, **kwargs)
+    # 取走接口名后请求钩子不再记录本次请求
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is None:
+        return response
+    started = g.metrics_started
+    method = request.method
+    
+    @response.call_on_close
+    def _record_stream_metrics():
+        HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=method, status=response.status_code)
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint)
+    
+    return response
 
 # 主页路由
 @app.route('/')
@@ -26,6 +169,29 @@ def get_styles():
     styles = style_matcher.get_available_styles()
     return jsonify({'styles': styles})
 
+# 获取场景分析缓存统计
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    stats = {'analysis': analysis_cache.stats(), 'search': search_cache.stats()}
+    if generation_cache is not None:
+        stats['generation'] = generation_cache.stats()
+    return jsonify(stats)
+
+# Prometheus格式的运行指标
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# 本地保存的AI生成图片和缩略图：文件名包含内容哈希，内容不会改变，支持条件请求和Range请求
+@app.route('/media/<name>', methods=['GET'])
+def get_media(name):
+    path = image_store.path(name) if image_store is not None else None
+    if path is None:
+        return jsonify({'error': 'Image not found'}), 404
+    response = send_file(path, conditional=True, etag=name, max_age=MEDIA_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
 # 上传图片路由
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
@@ -42,49 +208,274 @@ def upload_image():
         file.save(filepath)
         return jsonify({'filename': filename, 'filepath': filepath})
 
+def _request_deadline():
+    """
+    :return: 当前请求的截止时间（time.monotonic()），未配置REQUEST_DEADLINE时为None
+    """
+    if app.config['REQUEST_DEADLINE'] <= 0:
+        return None
+    return time.monotonic() + app.config['REQUEST_DEADLINE']
+
+def _read_recommend_request():
+    """
+    读取推荐请求中的图片和风格
+    :return: (图片字节数据, 风格, 错误响应)，参数有误时错误响应不为None
+    """
+    # 获取请求数据
+    data = request.form
+    image_file = request.files.get('image')
+    style = data.get('style')
+    
+    if not image_file or not style:
+        return None, None, (jsonify({'error': 'Missing image or style parameter'}), 400)
+    
+    # 读取上传的图片数据，后续分析和生成共用同一份内存数据
+    image_bytes = image_file.read()
+    
+    # 仅在开启持久化时保存上传的图片
+    if app.config['PERSIST_UPLOADS']:
+        filename = secure_filename(image_file.filename)
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        with open(filepath, 'wb') as f:
+            f.write(image_bytes)
+    
+    return image_bytes, style, None
+
+def _analyze_and_advise(image_bytes, style):
+    """
+    完成推荐中不依赖外部服务的步骤：场景分析、风格匹配和拍摄建议
+    :param image_bytes: 图片字节数据
+    :param style: 风格
+    :return: (场景特征, 拍摄建议)
+    """
+    # 1. 分析图片（相同图片直接使用缓存结果）
+    scene_features = analysis_cache.get_or_compute(image_bytes, image_analyzer.analyze_bytes)
+    
+    # 2. 风格匹配
+    style_features = style_matcher.match_style(style)
+    
+    # 3. 生成拍摄建议
+    advice = advice_generator.generate_advice(scene_features, style)
+    
+    return scene_features, advice
+
 # 姿势推荐主路由
 @app.route('/api/recommend', methods=['POST'])
 def recommend_pose():
+    # 请求头携带剖析令牌或被抽样时，用cProfile记录本次请求，响应头X-Profile-Id为结果的请求ID
+    request_id = request_profiler.select(request.headers)
+    if request_id is None:
+        return _recommend_pose()
+    
+    result, profiled = request_profiler.run(request_id, _recommend_pose)
+    response = make_response(result)
+    if profiled:
+        response.headers['X-Profile-Id'] = request_id
+    return response
+
+def _recommend_pose():
     try:
-        # 获取请求数据
-        data = request.form
-        image_file = request.files.get('image')
-        style = data.get('style')
-        
-        if not image_file or not style:
-            return jsonify({'error': 'Missing image or style parameter'}), 400
-        
-        # 保存上传的图片
-        filename = secure_filename(image_file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        image_file.save(filepath)
-        
-        # 1. 分析图片
-        scene_features = image_analyzer.analyze(filepath)
+        deadline = _request_deadline()
+        timer = StageTimer()
+        image_bytes, style, error = timer.run('save', _read_recommend_request)
+        if error:
+            return error
         
-        # 2. 风格匹配
-        style_features = style_matcher.match_style(style)
+        # 分析、建议和AI生成参考图片并发执行，结果中包含各步骤耗时
+        result = recommend_pipeline.run(image_bytes, style, num_images=3, timer=timer, deadline=deadline)
+        observe_stages(result['timings'])
         
-        # 3. 生成拍摄建议
-        advice = advice_generator.generate_advice(scene_features, style)
+        response = jsonify(result)
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = server_timing(result['timings'])
+        return response
         
-        # 4. AI生成参考图片
-        ai_reference_images = ai_image_generator.generate_images_from_image(
-            filepath, 
-            scene_features, 
-            style, 
-            num_images=3
-        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# 流式姿势推荐：以NDJSON逐行返回，第一行是场景分析和拍摄建议，之后每生成一张AI参考图片返回一行
+@app.route('/api/recommend/stream', methods=['POST'])
+def stream_recommend_pose():
+    try:
+        deadline = _request_deadline()
+        timer = StageTimer()
+        image_bytes, style, error = timer.run('save', _read_recommend_request)
+        if error:
+            return error
+
+        result, events = recommend_pipeline.stream(image_bytes, style, num_images=3, timer=timer, deadline=deadline)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    def generate():
+        yield json.dumps(dict(result, type='analysis'), ensure_ascii=False) + '\n'
+        for event in events:
+            if event['type'] == 'done':
+                observe_stages(event['timings'])
+            yield json.dumps(event, ensure_ascii=False) + '\n'
+
+    # 关闭代理服务器的缓冲，每张图片生成后立即发送给客户端
+    return _stream_response(
+        generate(),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# 获取请求的剖析结果（折叠调用栈），需要在请求头X-Profile-Token中提供剖析令牌
+@app.route('/api/profiles/<request_id>', methods=['GET'])
+def get_profile(request_id):
+    if not request_profiler.authorized(request.headers):
+        return jsonify({'error': 'Profiling token required'}), 403
+    collapsed = request_profiler.load(request_id)
+    if collapsed is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(collapsed, content_type='text/plain; charset=utf-8')
+
+# 批量姿势推荐：一次上传多张图片，按完成顺序以NDJSON逐行返回场景分析和拍摄建议
+@app.route('/api/recommend/batch', methods=['POST'])
+def recommend_batch():
+    image_files = request.files.getlist('images')
+    styles = request.form.getlist('style')
+    
+    if not image_files or not styles:
+        return jsonify({'error': 'Missing images or style parameter'}), 400
+    
+    # 只提供一个风格时所有图片共用，否则每张图片对应一个风格
+    if len(styles) == 1:
+        styles = styles * len(image_files)
+    if len(styles) != len(image_files):
+        return jsonify({'error': 'Number of styles must be 1 or match number of images'}), 400
+    
+    if len(image_files) > app.config['BATCH_MAX_IMAGES']:
+        return jsonify({'error': f"Too many images, at most {app.config['BATCH_MAX_IMAGES']} per batch"}), 400
+    
+    available_styles = style_matcher.get_available_styles()
+    for style in set(styles):
+        if style not in available_styles:
+            return jsonify({'error': f"Unknown style: {style}"}), 400
+    
+    # 请求结束后无法再读取上传文件，先读入内存
+    filenames = [image_file.filename for image_file in image_files]
+    items = [(index, image_file.read(), style) for index, (image_file, style) in enumerate(zip(image_files, styles))]
+    
+    def generate():
+        for result in batch_analyzer.imap_unordered(items):
+            index = result.pop('key')
+            result['index'] = index
+            result['filename'] = filenames[index]
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+    
+    return _stream_response(generate(), mimetype='application/x-ndjson')
+
+def _job_payload(job):
+    """
+    将任务状态转换为响应数据，任务结果字段与/api/recommend的返回结果一致
+    :param job: 任务状态字典
+    :return: 响应字典
+    """
+    payload = dict(job['result'])
+    payload.update({
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'error': job['error'],
+        'status_url': url_for('get_recommend_job', job_id=job['job_id']),
+        'events_url': url_for('stream_recommend_job', job_id=job['job_id'])
+    })
+    return payload
+
+# 异步姿势推荐：立即返回场景分析和拍摄建议，AI参考图片在后台生成
+@app.route('/api/recommend/jobs', methods=['POST'])
+def create_recommend_job():
+    try:
+        deadline = _request_deadline()
+        image_bytes, style, error = _read_recommend_request()
+        if error:
+            return error
         
-        # 返回结果
-        result = {
+        scene_features, advice = _analyze_and_advise(image_bytes, style)
+        initial_result = {
             'scene_features': scene_features,
             'style': style,
-            'ai_reference_images': ai_reference_images,
+            'ai_reference_images': None,
+            'ai_error': None,
             'advice': advice
         }
         
-        return jsonify(result)
+        # 4. 与RecommendPipeline相同，在请求线程中查询生成缓存并获取DashScope调用机会，
+        # 超出调用容量时任务立即结束，不在后台线程池的队列中无限等待
+        prepared = ai_image_generator.prepare_hashed(image_bytes)
+        generate, reservation = None, None
+        try:
+            cached = ai_image_generator.cached_images(prepared, scene_features, style, num_images=3)
+            if cached is not None:
+                initial_result['ai_reference_images'] = cached
+            else:
+                reservation = ai_image_generator.reserve(deadline)
+                
+                # 在后台生成AI参考图片，返回前归还调用机会
+                def generate():
+                    try:
+                        images = ai_image_generator.generate_images_from_image(
+                            prepared,
+                            scene_features,
+                            style,
+                            num_images=3,
+                            deadline=deadline,
+                            reservation=reservation
+                        )
+                    except UpstreamUnavailableError as e:
+                        return {'ai_reference_images': [], 'ai_error': e.to_dict()}
+                    return {'ai_reference_images': images, 'ai_error': None}
+        except UpstreamUnavailableError as e:
+            initial_result.update({'ai_reference_images': [], 'ai_error': e.to_dict()})
+        
+        try:
+            job_id = job_manager.submit(initial_result, generate)
+        except BaseException:
+            if reservation is not None:
+                reservation.release()
+            raise
+        
+        return jsonify(_job_payload(job_manager.get(job_id))), 202
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+# 查询异步推荐任务状态
+@app.route('/api/recommend/jobs/<job_id>', methods=['GET'])
+def get_recommend_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_job_payload(job))
+
+# 以Server-Sent Events推送异步推荐任务状态，任务完成后结束
+@app.route('/api/recommend/jobs/<job_id>/events', methods=['GET'])
+def stream_recommend_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate(current):
+        while True:
+            yield f"event: status\ndata: {json.dumps(_job_payload(current), ensure_ascii=False)}\n\n"
+            if current['status'] in FINISHED_STATUSES:
+                return
+            
+            version = current['version']
+            while True:
+                latest = job_manager.wait(job_id, version, timeout=app.config['JOB_HEARTBEAT_INTERVAL'])
+                if latest is None:
+                    return
+                if latest['version'] != version:
+                    current = latest
+                    break
+                # 保持连接，避免被代理服务器断开
+                yield ': keep-alive\n\n'
+    
+    # 生成_job_payload中的链接需要请求上下文
+    return _stream_response(
+        stream_with_context(generate(job)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
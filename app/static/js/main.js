@@ -164,27 +164,146 @@ async function getRecommendations() {
         formData.append('image', selectedImage);
         formData.append('style', selectedStyle);
         
-        // 发送请求
-        const response = await fetch('/api/recommend', {
-            method: 'POST',
-            body: formData
-        });
+        // 支持读取流式响应的浏览器逐张显示AI参考图片，否则创建异步推荐任务
+        if (window.ReadableStream && window.TextDecoder) {
+            await streamRecommendations(formData);
+        } else {
+            await createRecommendJob(formData);
+        }
+    } catch (error) {
+        console.error('获取推荐失败:', error);
+        alert('获取推荐失败，请稍后重试');
+        hideLoading();
+    }
+}
+
+// 流式获取推荐：先显示分析结果和建议，每生成一张AI参考图片立即显示
+async function streamRecommendations(formData) {
+    const response = await fetch('/api/recommend/stream', {
+        method: 'POST',
+        body: formData
+    });
+    
+    if (!response.ok || !response.body) {
+        throw new Error('请求失败');
+    }
+    
+    // 响应每行是一个JSON事件，一次读取的数据可能包含多行或不完整的一行
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let imageCount = 0;
+    let finished = false;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
         
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        
+        lines.filter(line => line.trim()).forEach(line => {
+            const event = JSON.parse(line);
+            if (event.type === 'analysis') {
+                displayResults({ ...event, ai_reference_images: null });
+            } else if (event.type === 'image') {
+                // 第一张图片替换生成中的提示
+                if (imageCount === 0) {
+                    aiImageGrid.innerHTML = '';
+                }
+                appendAIImage(event.image);
+                imageCount++;
+            } else if (event.type === 'done') {
+                finished = true;
+                if (imageCount === 0) {
+                    updateAIImageGrid({ ai_reference_images: [], ai_error: event.ai_error });
+                }
+            }
+        });
+    }
+    
+    // 连接提前断开时不再显示生成中
+    if (!finished && imageCount === 0) {
+        updateAIImageGrid({ ai_reference_images: [] });
+    }
+}
+
+// 创建异步推荐任务，场景分析和拍摄建议会立即返回，AI参考图片生成后再更新
+async function createRecommendJob(formData) {
+    const response = await fetch('/api/recommend/jobs', {
+        method: 'POST',
+        body: formData
+    });
+    
+    if (!response.ok) {
+        throw new Error('请求失败');
+    }
+    
+    const data = await response.json();
+    displayResults(data);
+    watchRecommendJob(data);
+}
+
+// 跟踪异步推荐任务，AI参考图片生成完成后更新页面
+function watchRecommendJob(job) {
+    if (isJobFinished(job)) {
+        return;
+    }
+    
+    // 不支持Server-Sent Events的浏览器改为轮询
+    if (!window.EventSource) {
+        pollRecommendJob(job.status_url);
+        return;
+    }
+    
+    const source = new EventSource(job.events_url);
+    source.addEventListener('status', (e) => {
+        const data = JSON.parse(e.data);
+        if (isJobFinished(data)) {
+            source.close();
+            showJobImages(data);
+        }
+    });
+    source.onerror = () => {
+        // 连接中断时改为轮询
+        source.close();
+        pollRecommendJob(job.status_url);
+    };
+}
+
+// 轮询异步推荐任务状态
+async function pollRecommendJob(statusUrl) {
+    try {
+        const response = await fetch(statusUrl);
         if (!response.ok) {
             throw new Error('请求失败');
         }
         
         const data = await response.json();
-        
-        // 显示结果
-        displayResults(data);
+        if (isJobFinished(data)) {
+            showJobImages(data);
+        } else {
+            setTimeout(() => pollRecommendJob(statusUrl), 1000);
+        }
     } catch (error) {
-        console.error('获取推荐失败:', error);
-        alert('获取推荐失败，请稍后重试');
-        hideLoading();
+        console.error('获取AI参考图片失败:', error);
+        updateAIImageGrid({ ai_reference_images: [] });
     }
 }
 
+// 显示任务结束后的AI参考图片（任务失败时显示为空）
+function showJobImages(job) {
+    updateAIImageGrid({ ai_reference_images: job.ai_reference_images || [], ai_error: job.ai_error });
+}
+
+// 判断任务是否已结束
+function isJobFinished(job) {
+    return job.status === 'done' || job.status === 'failed';
+}
+
 // 显示加载状态
 function showLoading() {
     initial.style.display = 'none';
@@ -285,40 +404,51 @@ function updatePoseAdvice(data) {
 function updateAIImageGrid(data) {
     aiImageGrid.innerHTML = '';
     
-    // 获取模态框元素
-    const imagePreviewModal = new bootstrap.Modal(document.getElementById('imagePreviewModal'));
-    const modalImage = document.getElementById('modalImage');
+    // AI参考图片仍在后台生成
+    if (data.ai_reference_images === null) {
+        aiImageGrid.innerHTML = `
+            <div class="no-ai-images text-center py-4">
+                <div class="spinner-border" role="status"></div>
+                <p class="mt-2">AI参考图片生成中...</p>
+            </div>
+        `;
+        return;
+    }
     
     // 检查是否有AI生成的图片
     if (data.ai_reference_images && data.ai_reference_images.length > 0) {
-        data.ai_reference_images.forEach(image => {
-            const imageContainer = document.createElement('div');
-            imageContainer.className = 'reference-image';
-            imageContainer.innerHTML = `
-                <img src="${image.url}" alt="AI生成参考图片" loading="lazy" class="cursor-pointer">
-                <div class="image-source">AI生成</div>
-            `;
-            
-            // 添加点击事件，打开模态框查看大图
-            const imgElement = imageContainer.querySelector('img');
-            imgElement.addEventListener('click', () => {
-                modalImage.src = image.url;
-                imagePreviewModal.show();
-            });
-            
-            aiImageGrid.appendChild(imageContainer);
-        });
+        data.ai_reference_images.forEach(appendAIImage);
     } else {
-        // 如果没有AI生成的图片，显示提示信息
+        // 如果没有AI生成的图片，显示提示信息（AI生成服务繁忙时提示稍后重试）
+        const message = data.ai_error ? 'AI生成服务繁忙，请稍后重试' : '暂无AI生成的参考图片';
         aiImageGrid.innerHTML = `
             <div class="no-ai-images text-center py-4">
                 <i class="bi bi-robot" style="font-size: 3rem; color: #ccc;"></i>
-                <p class="mt-2">暂无AI生成的参考图片</p>
+                <p class="mt-2">${message}</p>
             </div>
         `;
     }
 }
 
+// 添加一张AI生成参考图片
+function appendAIImage(image) {
+    const imageContainer = document.createElement('div');
+    imageContainer.className = 'reference-image';
+    imageContainer.innerHTML = `
+        <img src="${image.thumbnail || image.url}" alt="AI生成参考图片" loading="lazy" class="cursor-pointer">
+        <div class="image-source">AI生成</div>
+    `;
+    
+    // 列表中显示缩略图，点击后打开模态框查看原图
+    const imgElement = imageContainer.querySelector('img');
+    imgElement.addEventListener('click', () => {
+        document.getElementById('modalImage').src = image.url;
+        bootstrap.Modal.getOrCreateInstance(document.getElementById('imagePreviewModal')).show();
+    });
+    
+    aiImageGrid.appendChild(imageContainer);
+}
+
 // 更新拍摄建议
 function updateAdvice(data) {
     adviceList.innerHTML = '';
@@ -1,14 +1,182 @@
+import asyncio
+import base64
+import hashlib
 import json
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 from dotenv import load_dotenv
-from dashscope import MultiModalConversation
+from dashscope import AioMultiModalConversation, MultiModalConversation
 import dashscope
+import cv2
+import requests
+from app.utils.image_analyzer import ImageAnalyzer
+from app.utils.metrics import UPSTREAM_DURATION, UPSTREAM_RESPONSES
+from app.utils.upstream import UpstreamTimeoutError, UpstreamUnavailableError, remaining_time
 
 # 加载环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# 常见图片格式的文件头及MIME类型，无法重新编码时按实际格式标注
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp")
+]
+
+# 重新编码支持的格式：(OpenCV扩展名, 质量参数, MIME类型)
+UPLOAD_FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, "image/jpeg"),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, "image/webp")
+}
+
+
+def sniff_mime_type(data):
+    """
+    根据文件头判断图片的MIME类型
+    :param data: 图片字节数据
+    :return: MIME类型，无法识别时为application/octet-stream
+    """
+    head = bytes(data[:16])
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        if head[8:12] in (b"avif", b"avis"):
+            return "image/avif"
+        return "image/heic"
+    return "application/octet-stream"
+
+
+class UploadEncoder:
+    def __init__(self, max_size=1536, image_format="jpeg", quality=85):
+        """
+        上传DashScope前缩小并重新编码图片：生成结果的分辨率约为百万像素，更大的输入只会增加上传时间；
+        重新编码同时去除EXIF等元数据（方向已在解码时应用）
+        :param max_size: 长边的最大像素数，0或None表示不缩小
+        :param image_format: jpeg、webp，或original表示原样上传
+        :param quality: 编码质量（1-100）
+        """
+        if image_format != "original" and image_format not in UPLOAD_FORMATS:
+            raise ValueError(f"Unsupported upload format: {image_format}")
+        self.max_size = max_size or 0
+        self.image_format = image_format
+        self.quality = quality
+        self._reader = ImageAnalyzer(working_size=max_size or None)
+    
+    @property
+    def settings(self):
+        """
+        影响编码结果的参数，与原始图片的哈希一起组成生成缓存键
+        """
+        return f"{self.image_format}:{self.max_size}:{self.quality}"
+    
+    def encode(self, data):
+        """
+        :param data: 原始图片字节数据
+        :return: (上传的图片字节数据, MIME类型)，无法解码的格式（如HEIC）原样返回并标注实际类型
+        """
+        if self.image_format == "original":
+            return data, sniff_mime_type(data)
+        
+        # 按目标分辨率缩小解码，大图不会先解码出完整尺寸
+        image, _ = self._reader.read_scaled(data)
+        if image is None:
+            return data, sniff_mime_type(data)
+        
+        extension, quality_flag, mime_type = UPLOAD_FORMATS[self.image_format]
+        ok, buffer = cv2.imencode(extension, image, [quality_flag, self.quality])
+        if not ok:
+            return data, sniff_mime_type(data)
+        return buffer.tobytes(), mime_type
+
+
+class PreparedImage:
+    """
+    已读取的输入图片，上传数据的编码、base64编码和内容哈希只计算一次
+    缓存键只需要原始图片的哈希，缩小和重新编码在第一次需要上传数据时才进行，命中生成缓存的请求不会解码图片；
+    生成data URL后不再保留编码后的字节数据，除原始图片外只保留data URL一份拷贝
+    """
+    def __init__(self, data, encoder=None):
+        """
+        :param data: 原始图片字节数据
+        :param encoder: UploadEncoder实例，None表示原样上传
+        """
+        self.data = data
+        self._encoder = encoder
+        self._payload = None
+        self._mime_type = None
+        self._data_url = None
+        self._sha256 = None
+    
+    @property
+    def payload(self):
+        """
+        实际上传的图片字节数据，已生成data URL时从data URL解码
+        """
+        if self._payload is None and self._data_url is not None:
+            return base64.b64decode(self._data_url.split(",", 1)[1])
+        if self._payload is None:
+            if self._encoder is None:
+                self._payload, self._mime_type = self.data, sniff_mime_type(self.data)
+            else:
+                self._payload, self._mime_type = self._encoder.encode(self.data)
+        return self._payload
+    
+    @property
+    def mime_type(self):
+        if self._mime_type is None:
+            self.payload
+        return self._mime_type
+    
+    @property
+    def data_url(self):
+        if self._data_url is None:
+            base64_image = base64.b64encode(self.payload).decode("ascii")
+            self._data_url = f"data:{self.mime_type};base64,{base64_image}"
+            # data URL已得到，释放编码后的字节数据（原样上传时即原始图片，不占用额外内存）
+            self._payload = None
+        return self._data_url
+    
+    @property
+    def sha256(self):
+        # 哈希原始图片和编码参数，不需要先编码；编码参数变化后不会复用旧的生成结果
+        if self._sha256 is None:
+            digest = hashlib.sha256(self.data)
+            digest.update(b"\0" + (self._encoder.settings if self._encoder else "original").encode("ascii"))
+            self._sha256 = digest.hexdigest()
+        return self._sha256
+    
+    def encode(self):
+        """
+        完成缩小、重新编码和base64编码，缓存未命中需要调用DashScope时使用
+        :return: self
+        """
+        self.data_url
+        return self
+
 class AIImageGenerator:
-    def __init__(self):
+    def __init__(self, cache=None, encoder=None, limiter=None, breaker=None, store=None):
+        """
+        :param cache: GenerationCache实例，用于复用相同请求的生成结果（可选）
+        :param encoder: 上传前缩小和重新编码图片的UploadEncoder，默认使用UploadEncoder()
+        :param limiter: 限制同时调用DashScope数量和速率的UpstreamLimiter（可选）
+        :param breaker: DashScope连续失败时熔断的CircuitBreaker（可选）
+        :param store: 保存生成图片和缩略图的ImageStore，None表示直接返回DashScope的临时链接
+        """
+        self.cache = cache
+        self.encoder = encoder or UploadEncoder()
+        self.limiter = limiter
+        self.breaker = breaker
+        self.store = store
+        
         # 初始化阿里云DashScope API配置
         self.api_key = os.environ.get("DASHSCOPE_API_KEY", "")
         self.model = "qwen-image-edit-plus"
@@ -45,65 +213,405 @@ class AIImageGenerator:
         
         return prompt
     
-    def generate_images_from_image(self, image_path, scene_features, style, num_images=3):
+    def generate_images_from_image(self, image, scene_features, style, num_images=3, deadline=None, reservation=None):
         """
         基于输入图片生成AI参考姿势推荐图片
-        :param image_path: 输入图片路径
+        :param image: 输入图片路径、图片字节数据或PreparedImage
         :param scene_features: 场景特征字典
         :param style: 风格
         :param num_images: 生成图片数量
+        :param deadline: 请求的截止时间（time.monotonic()），排队和DashScope请求都不会超过该时间，None表示不限制
+        :param reservation: reserve()提前获取的调用机会，调用DashScope时不再排队，返回前归还
         :return: 生成的图片URL列表
+        :raises UpstreamUnavailableError: 超出DashScope调用容量、熔断中或截止时间已到
         """
         try:
             # 生成提示词
             prompt = self._generate_prompt(scene_features, style)
             
-            # 调用DashScope API生成AI姿势推荐图片
-            images = self._call_dashscope_api(image_path, prompt, num_images)
+            prepared = self.prepare_image(image)
             
-            return images
-        except Exception as e:
-            print(f"AI image generation from image error: {e}")
+            # 未配置缓存时直接调用DashScope API生成AI姿势推荐图片
+            if self.cache is None:
+                return self._call_upstream(prepared, prompt, num_images, deadline, reservation)
+            
+            # 相同图片、提示词、模型和数量的请求复用缓存结果，并发的相同请求只调用一次API
+            key = self.cache.make_key(prepared.data, prompt, self.model, num_images, image_hash=prepared.sha256)
+            # 合并到其他请求时最多等到本请求的截止时间；已过截止时间时仍可以命中缓存
+            return self.cache.get_or_generate(
+                key,
+                lambda: self._call_upstream(prepared, prompt, num_images, deadline, reservation),
+                timeout=None if deadline is None else max(0.0, deadline - time.monotonic())
+            )
+        except UpstreamUnavailableError:
+            # 上游不可用时由调用方降级处理，不等同于生成失败
+            raise
+        except Exception:
+            logger.exception("AI image generation from image failed")
             # 如果API调用失败，返回空列表
             return []
+        finally:
+            # 命中缓存或合并到其他请求时没有用到提前获取的调用机会
+            if reservation is not None:
+                reservation.release()
+    
+    def cached_images(self, image, scene_features, style, num_images=3):
+        """
+        查询生成缓存，不调用DashScope
+        :param image: 输入图片路径、图片字节数据或PreparedImage
+        :param scene_features: 场景特征字典
+        :param style: 风格
+        :param num_images: 生成图片数量
+        :return: 缓存的图片列表，未配置缓存或未命中时为None
+        """
+        if self.cache is None:
+            return None
+        prepared = self.prepare_image(image)
+        prompt = self._generate_prompt(scene_features, style)
+        # 未命中时随后由generate_images_from_image计入统计
+        return self.cache.get(
+            self.cache.make_key(prepared.data, prompt, self.model, num_images, image_hash=prepared.sha256),
+            count_miss=False
+        )
+    
+    def reserve(self, deadline=None):
+        """
+        在提交后台生成任务前，在调用方线程中获取DashScope调用机会
+        :param deadline: 请求的截止时间（time.monotonic()），None表示不限制
+        :return: Reservation，未配置限流器时为None
+        :raises UpstreamUnavailableError: 熔断中、超出容量或截止时间已到
+        """
+        self.ensure_available()
+        if self.limiter is None:
+            return None
+        return self.limiter.reserve(timeout=remaining_time(deadline, "dashscope"))
+    
+    async def generate_images_from_image_async(self, image, scene_features, style, num_images=3, executor=None,
+                                               deadline=None):
+        """
+        generate_images_from_image的异步版本，等待DashScope返回时不占用线程
+        :param image: 输入图片路径、图片字节数据或PreparedImage
+        :param scene_features: 场景特征字典
+        :param style: 风格
+        :param num_images: 生成图片数量
+        :param executor: 执行图片编码和缓存读写的线程池，None表示使用事件循环的默认线程池
+        :param deadline: 请求的截止时间（time.monotonic()），None表示不限制
+        :return: 生成的图片URL列表
+        :raises UpstreamUnavailableError: 超出DashScope调用容量、熔断中或截止时间已到
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            prompt = self._generate_prompt(scene_features, style)
+            # 读取文件和计算缓存键所需的哈希都是阻塞操作，放到线程池中执行
+            prepared = await loop.run_in_executor(executor, self.prepare_hashed, image)
+            
+            if self.cache is None:
+                await loop.run_in_executor(executor, prepared.encode)
+                return await self._call_upstream_async(prepared, prompt, num_images, deadline)
+            
+            async def generate():
+                # 缓存未命中时才缩小和重新编码图片
+                await loop.run_in_executor(executor, prepared.encode)
+                return await self._call_upstream_async(prepared, prompt, num_images, deadline)
+            
+            # 与同步版本相同的缓存键和合并方式，并发的相同请求只调用一次API，等待时间不超过本请求的截止时间
+            key = self.cache.make_key(prepared.data, prompt, self.model, num_images, image_hash=prepared.sha256)
+            return await self.cache.get_or_generate_async(
+                key,
+                generate,
+                executor=executor,
+                timeout=None if deadline is None else max(0.0, deadline - time.monotonic())
+            )
+        except UpstreamUnavailableError:
+            raise
+        except Exception:
+            logger.exception("AI image generation from image failed")
+            return []
+    
+    def iter_images_from_image(self, image, scene_features, style, num_images=3, executor=None, deadline=None):
+        """
+        逐张生成AI参考图片：同时发起num_images个单张生成请求，每张图片生成后立即返回，不必等待最慢的一张
+        每个请求都经过熔断器和限流器，占用的并发名额是一次多张生成的num_images倍
+        :param image: 输入图片路径、图片字节数据或PreparedImage
+        :param scene_features: 场景特征字典
+        :param style: 风格
+        :param num_images: 生成图片数量
+        :param executor: 执行单张生成请求的线程池，None表示临时创建
+        :param deadline: 请求的截止时间（time.monotonic()），None表示不限制
+        :return: 按生成完成顺序产生图片字典的生成器
+        :raises UpstreamUnavailableError: 上游不可用且没有生成任何图片
+        """
+        try:
+            prompt = self._generate_prompt(scene_features, style)
+            prepared = self.prepare_image(image)
+            
+            # 与generate_images_from_image共用缓存键，任一方式生成的结果另一方式都可以直接使用
+            key = None
+            if self.cache is not None:
+                key = self.cache.make_key(prepared.data, prompt, self.model, num_images, image_hash=prepared.sha256)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    yield from cached
+                    return
+            
+            # 编码一次后由各单张请求共用，不在多个线程中重复编码
+            prepared.encode()
+            images, unavailable = [], None
+            own_executor = executor is None
+            if own_executor:
+                executor = ThreadPoolExecutor(max_workers=num_images, thread_name_prefix="ai-image")
+            submitted = []
+            try:
+                # 在当前线程中逐个获取调用机会后再提交，超出容量的请求不会在线程池的队列中等待
+                for _ in range(num_images):
+                    try:
+                        reservation = self.reserve(deadline)
+                    except UpstreamUnavailableError as e:
+                        unavailable = unavailable or e
+                        break
+                    try:
+                        future = executor.submit(self._call_upstream, prepared, prompt, 1, deadline, reservation)
+                    except BaseException:
+                        if reservation is not None:
+                            reservation.release()
+                        raise
+                    submitted.append((future, reservation))
+                
+                futures = [future for future, _ in submitted]
+                for future in as_completed(futures, timeout=remaining_time(deadline, "dashscope")):
+                    try:
+                        result = future.result()
+                    except UpstreamUnavailableError as e:
+                        unavailable = unavailable or e
+                        continue
+                    except Exception:
+                        logger.exception("AI image generation from image failed")
+                        continue
+                    for generated in result:
+                        images.append(generated)
+                        yield generated
+            except (FutureTimeoutError, UpstreamTimeoutError):
+                unavailable = unavailable or UpstreamTimeoutError(
+                    "Request deadline exceeded while generating AI reference images"
+                )
+            finally:
+                # 客户端断开或截止时间已到时，尚未开始的请求不再发出，归还其调用机会
+                for future, reservation in submitted:
+                    if future.cancel() and reservation is not None:
+                        reservation.release()
+                if own_executor:
+                    executor.shutdown(wait=False)
+            
+            # 只缓存完整的结果，部分失败时下次重新生成
+            if key is not None and len(images) == num_images:
+                self.cache.put(key, images)
+            if not images and unavailable is not None:
+                raise unavailable
+        except UpstreamUnavailableError:
+            raise
+        except Exception:
+            logger.exception("AI image generation from image failed")
+    
+    def ensure_available(self):
+        """
+        检查DashScope是否处于熔断中，在准备图片等耗时步骤之前快速失败
+        :raises CircuitOpenError: 熔断中
+        """
+        if self.breaker is not None:
+            self.breaker.check()
+    
+    def prepare_image(self, image):
+        """
+        读取输入图片，得到可复用编码结果的PreparedImage
+        :param image: 图片路径、图片字节数据或PreparedImage
+        :return: PreparedImage
+        """
+        if isinstance(image, PreparedImage):
+            return image
+        if isinstance(image, (bytes, bytearray)):
+            return PreparedImage(image, self.encoder)
+        with open(image, "rb") as f:
+            return PreparedImage(f.read(), self.encoder)
+    
+    def prepare_hashed(self, image):
+        """
+        读取输入图片并计算缓存键所需的哈希，不解码和重新编码图片
+        :param image: 图片路径、图片字节数据或PreparedImage
+        :return: PreparedImage
+        """
+        prepared = self.prepare_image(image)
+        prepared.sha256
+        return prepared
+    
+    def _call_upstream(self, prepared, prompt, num_images, deadline=None, reservation=None):
+        """
+        经过熔断器和限流器调用DashScope API，配置了图片存储时将生成的图片保存到本地
+        :param deadline: 截止时间（time.monotonic()），None表示不限制
+        :param reservation: 提前获取的调用机会，None表示在当前线程中排队获取
+        :raises UpstreamUnavailableError: 熔断中、超出容量或截止时间已到
+        """
+        try:
+            # 熔断时立即失败，不进入排队
+            self.ensure_available()
+            if reservation is None and self.limiter is not None:
+                reservation = self.limiter.reserve(timeout=remaining_time(deadline, "dashscope"))
+            images = self._call_guarded(prepared, prompt, num_images, deadline)
+        finally:
+            if reservation is not None:
+                reservation.release()
+        # 下载图片不占用DashScope的并发名额
+        if self.store is None or not images:
+            return images
+        return self.store.mirror(images)
+    
+    def _call_guarded(self, prepared, prompt, num_images, deadline):
+        # 先检查截止时间并完成编码，再占用熔断器半开状态下唯一的试探机会
+        timeout = remaining_time(deadline, "dashscope")
+        prepared.encode()
+        trial = self.breaker.before_call() if self.breaker is not None else None
+        try:
+            return self._call_dashscope_api(prepared, prompt, num_images, timeout=timeout)
+        except BaseException:
+            # 到达上游的请求已记录成功或失败，这里只归还没有到达上游的试探机会
+            if trial is not None:
+                self.breaker.release_trial(trial)
+            raise
+    
+    async def _call_upstream_async(self, prepared, prompt, num_images, deadline=None):
+        """
+        _call_upstream的异步版本，排队时不占用线程
+        """
+        self.ensure_available()
+        if self.limiter is None:
+            images = await self._call_guarded_async(prepared, prompt, num_images, deadline)
+        else:
+            async with self.limiter.slot_async(timeout=remaining_time(deadline, "dashscope")):
+                images = await self._call_guarded_async(prepared, prompt, num_images, deadline)
+        if self.store is None or not images:
+            return images
+        return await asyncio.get_running_loop().run_in_executor(None, self.store.mirror, images)
+    
+    async def _call_guarded_async(self, prepared, prompt, num_images, deadline):
+        timeout = remaining_time(deadline, "dashscope")
+        # 调用方已在线程池中完成编码，这里只是确认，不会阻塞事件循环
+        prepared.encode()
+        trial = self.breaker.before_call() if self.breaker is not None else None
+        try:
+            return await self._call_dashscope_api_async(prepared, prompt, num_images, timeout=timeout)
+        except BaseException:
+            # 包括等待上游时被wait_for取消的情况
+            if trial is not None:
+                self.breaker.release_trial(trial)
+            raise
     
-    def _call_dashscope_api(self, image_path, prompt, num_images=3):
+    def _call_dashscope_api(self, image, prompt, num_images=3, timeout=None):
         """
         调用阿里云DashScope API生成AI姿势推荐图片
-        :param image_path: 输入图片路径
+        :param image: 输入图片路径、图片字节数据或PreparedImage
         :param prompt: 提示词
         :param num_images: 生成图片数量
+        :param timeout: 请求超时时间（秒），None表示使用SDK的默认值
         :return: 生成的图片URL列表
+        :raises UpstreamTimeoutError: 请求超时
         """
-        # 读取图片并编码为base64
-        import base64
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-            base64_image = base64.b64encode(image_data).decode("utf-8")
+        # 读取图片，缩小重新编码后转为base64（已准备好的图片直接复用编码结果）
+        prepared = self.prepare_image(image)
+        
+        # 调用DashScope API
+        started = time.perf_counter()
+        try:
+            response = MultiModalConversation.call(
+                api_key=self.api_key,
+                model=self.model,
+                messages=self._build_messages(prepared, prompt),
+                stream=False,
+                n=num_images,
+                watermark=False,
+                negative_prompt=" ",
+                prompt_extend=True,
+                **self._timeout_kwargs(timeout)
+            )
+        except Exception as e:
+            self._observe_upstream("error", started)
+            if isinstance(e, (requests.Timeout, TimeoutError)):
+                raise UpstreamTimeoutError(f"DashScope request timed out after {timeout}s") from e
+            raise
+        self._observe_upstream(response.status_code, started)
         
-        # 构建messages
-        messages = [
+        return self._parse_response(response, prompt)
+    
+    async def _call_dashscope_api_async(self, image, prompt, num_images=3, timeout=None):
+        """
+        异步调用阿里云DashScope API生成AI姿势推荐图片，参数与返回值同_call_dashscope_api
+        """
+        prepared = self.prepare_image(image)
+        
+        started = time.perf_counter()
+        try:
+            response = await AioMultiModalConversation.call(
+                api_key=self.api_key,
+                model=self.model,
+                messages=self._build_messages(prepared, prompt),
+                stream=False,
+                n=num_images,
+                watermark=False,
+                negative_prompt=" ",
+                prompt_extend=True,
+                **self._timeout_kwargs(timeout)
+            )
+        except Exception as e:
+            self._observe_upstream("error", started)
+            if isinstance(e, (requests.Timeout, TimeoutError)):
+                raise UpstreamTimeoutError(f"DashScope request timed out after {timeout}s") from e
+            raise
+        self._observe_upstream(response.status_code, started)
+        
+        return self._parse_response(response, prompt)
+    
+    def _timeout_kwargs(self, timeout):
+        if timeout is None:
+            return {}
+        return {"request_timeout": timeout}
+    
+    def _observe_upstream(self, status, started):
+        """
+        记录一次DashScope请求的状态码和耗时，并更新熔断器
+        :param status: HTTP状态码，请求异常（包括超时）时为"error"
+        :param started: 请求开始时的time.perf_counter()
+        """
+        UPSTREAM_RESPONSES.inc(upstream="dashscope", status=status)
+        UPSTREAM_DURATION.observe(time.perf_counter() - started, upstream="dashscope")
+        if self.breaker is not None:
+            # 请求异常、限流和服务端错误说明上游异常，参数错误等其他状态码不影响熔断
+            if status == "error" or status == 429 or status >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+    
+    def _build_messages(self, prepared, prompt):
+        """
+        构建DashScope请求的messages
+        :param prepared: PreparedImage
+        :param prompt: 提示词
+        :return: messages列表
+        """
+        return [
             {
                 "role": "user",
                 "content": [
-                    {"image": f"data:image/jpeg;base64,{base64_image}"},
+                    {"image": prepared.data_url},
                     {"text": prompt}
                 ]
             }
         ]
-        
-        # 调用DashScope API
-        response = MultiModalConversation.call(
-            api_key=self.api_key,
-            model=self.model,
-            messages=messages,
-            stream=False,
-            n=num_images,
-            watermark=False,
-            negative_prompt=" ",
-            prompt_extend=True
-        )
-        
+    
+    def _parse_response(self, response, prompt):
+        """
+        解析DashScope响应
+        :param response: DashScope响应
+        :param prompt: 提示词
+        :return: 生成的图片URL列表，请求失败时为空列表
+        """
         images = []
         
         if response.status_code == 200:
@@ -118,9 +626,10 @@ class AIImageGenerator:
                         "prompt": prompt
                     })
         else:
-            print(f"HTTP返回码：{response.status_code}")
-            print(f"错误码：{response.code}")
-            print(f"错误信息：{response.message}")
-            print("请参考文档： `https://help.aliyun.com/zh/model-studio/developer-reference/error-code` ")
+            # 错误码说明参考文档：https://help.aliyun.com/zh/model-studio/developer-reference/error-code
+            logger.warning(
+                "DashScope request failed: status=%s code=%s message=%s request_id=%s",
+                response.status_code, response.code, response.message, getattr(response, "request_id", None)
+            )
         
         return images
@@ -0,0 +1,214 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# JSON没有元组类型，写入磁盘时标记元组（如image_size），读取时还原，磁盘命中的结果与内存中的完全一致
+_TUPLE_TAG = '__tuple__'
+
+# 磁盘缓存文件格式的版本，格式变化后不再读取旧文件
+_DISK_FORMAT = 'v2'
+
+
+def _tag_tuples(value):
+    if isinstance(value, tuple):
+        return {_TUPLE_TAG: [_tag_tuples(item) for item in value]}
+    if isinstance(value, list):
+        return [_tag_tuples(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _tag_tuples(item) for key, item in value.items()}
+    return value
+
+
+def _restore_tuples(obj):
+    if len(obj) == 1 and _TUPLE_TAG in obj:
+        return tuple(obj[_TUPLE_TAG])
+    return obj
+
+
+class AnalysisCache:
+    def __init__(self, max_entries=256, cache_dir=None, namespace='', max_files=10000):
+        """
+        以图片内容哈希为键的场景分析结果缓存
+        :param max_entries: 内存中最多保留的结果数量（LRU淘汰）
+        :param cache_dir: 磁盘缓存目录，None表示只使用内存缓存
+        :param namespace: 键前缀，用于区分不同分析配置（如工作分辨率）的结果
+        :param max_files: 磁盘缓存最多保留的文件数量，超过时删除最早写入的文件，0表示不限制
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir or None
+        self.namespace = namespace
+        self.max_files = max_files
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        # 磁盘缓存文件数量的估计值，首次写入时统计，超过上限时重新统计并清理
+        self._disk_files = None
+
+        # 命中统计
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir and not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def make_key(self, image_bytes):
+        """
+        根据图片内容生成缓存键
+        :param image_bytes: 图片字节数据
+        :return: 缓存键
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return f'{self.namespace}{digest}'
+
+    def get(self, key):
+        """
+        查询缓存，内存未命中时查询磁盘缓存
+        :param key: 缓存键
+        :return: 缓存的分析结果，未命中返回None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._entries[key])
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, value)
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        """
+        写入缓存
+        :param key: 缓存键
+        :param value: 分析结果
+        """
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store(key, value)
+        self._write_disk(key, value)
+
+    def get_or_compute(self, image_bytes, compute):
+        """
+        查询图片的分析结果，未命中时调用compute计算并写入缓存
+        :param image_bytes: 图片字节数据
+        :param compute: 计算函数，接收图片字节数据，返回分析结果
+        :return: 分析结果
+        """
+        key = self.make_key(image_bytes)
+        value = self.get(key)
+        if value is None:
+            value = compute(image_bytes)
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        """
+        获取缓存统计信息
+        :return: 统计字典
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'disk_enabled': self.cache_dir is not None
+            }
+
+    def clear(self):
+        """
+        清空内存缓存和统计（不删除磁盘缓存）
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+
+    def _store(self, key, value):
+        # 调用方需持有锁
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[-64:-62], f'{key}.{_DISK_FORMAT}.json')
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f, object_hook=_restore_tuples)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，避免并发读取到不完整的文件
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(_tag_tuples(value), f, ensure_ascii=False, default=float)
+            os.replace(tmp_path, path)
+            self._prune_disk()
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Analysis cache write error: %s", e)
+
+    def _list_disk_files(self):
+        """
+        :return: 磁盘缓存文件的(修改时间, 路径)列表
+        """
+        entries = []
+        for directory, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    def _prune_disk(self):
+        if self.max_files <= 0:
+            return
+        with self._prune_lock:
+            if self._disk_files is None:
+                self._disk_files = len(self._list_disk_files())
+            else:
+                self._disk_files += 1
+            if self._disk_files <= self.max_files:
+                return
+
+            # 清理到上限的90%，之后的多次写入不必再遍历目录
+            entries = sorted(self._list_disk_files())
+            keep = self.max_files * 9 // 10
+            for _, path in entries[:max(0, len(entries) - keep)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._disk_files = min(len(entries), keep)
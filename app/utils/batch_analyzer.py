@@ -0,0 +1,99 @@
+import os
+import threading
+from concurrent import futures
+
+from app.utils.advice_generator import AdviceGenerator
+from app.utils.image_analyzer import ImageAnalyzer
+
+# 工作进程中的分析器实例，由_init_worker创建，每个进程只创建一次
+_image_analyzer = None
+_advice_generator = None
+
+
+def _init_worker(working_size):
+    global _image_analyzer, _advice_generator
+    _image_analyzer = ImageAnalyzer(working_size=working_size)
+    _advice_generator = AdviceGenerator()
+
+
+def analyze_item(key, image, style):
+    """
+    在工作进程中分析一张图片并生成拍摄建议
+    :param key: 调用方用于对应结果的标识（如序号或文件路径）
+    :param image: 图片路径或图片字节数据
+    :param style: 风格
+    :return: 结果字典，失败时包含error字段
+    """
+    try:
+        if isinstance(image, (bytes, bytearray)):
+            scene_features = _image_analyzer.analyze_bytes(image)
+        else:
+            scene_features = _image_analyzer.analyze(image)
+        advice = _advice_generator.generate_advice(scene_features, style)
+        return {'key': key, 'style': style, 'scene_features': scene_features, 'advice': advice}
+    except Exception as e:
+        return {'key': key, 'style': style, 'error': str(e)}
+
+
+class BatchAnalyzer:
+    def __init__(self, max_workers=None, working_size=None, max_pending=None):
+        """
+        使用多进程批量分析图片并生成拍摄建议
+        :param max_workers: 工作进程数量，默认为CPU核数
+        :param working_size: 图片分析的工作分辨率，参见ImageAnalyzer
+        :param max_pending: 同时提交到进程池的最大任务数，用于限制内存占用，默认为进程数的2倍
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.working_size = working_size
+        self.max_pending = max_pending or self.max_workers * 2
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # 首次使用时才创建进程池，避免导入模块时启动子进程
+        with self._lock:
+            if self._executor is None:
+                self._executor = futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(self.working_size,)
+                )
+            return self._executor
+
+    def imap_unordered(self, items):
+        """
+        批量分析图片，按完成顺序逐个返回结果
+        :param items: 可迭代的(key, 图片路径或字节数据, 风格)元组
+        :return: 结果字典的生成器，结果格式参见analyze_item
+        """
+        executor = self._get_executor()
+        pending = set()
+        items = iter(items)
+        exhausted = False
+
+        while pending or not exhausted:
+            # 补充任务，保持进程池中最多max_pending个任务
+            while not exhausted and len(pending) < self.max_pending:
+                try:
+                    key, image, style = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(analyze_item, key, image, style))
+
+            if not pending:
+                break
+
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    def shutdown(self, wait=True):
+        """
+        关闭进程池
+        :param wait: 是否等待正在执行的任务完成
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
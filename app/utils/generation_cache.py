@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app.utils.upstream import UpstreamTimeoutError
+
+
+class _Flight:
+    """
+    一次正在进行的生成调用，相同请求的其他线程等待它的结果
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GenerationCache:
+    def __init__(self, cache_path, ttl=43200, max_entries=1000, image_store=None):
+        """
+        AI生成结果的持久化缓存，相同的并发请求只会调用一次上游API
+        :param cache_path: SQLite数据库文件路径，':memory:'表示只在内存中缓存
+        :param ttl: 结果有效期（秒），DashScope返回的图片链接会过期，未配置图片存储时有效期应小于链接有效期
+        :param max_entries: 最多保留的结果数量，超出时淘汰最久未使用的结果
+        :param image_store: 保存生成图片的ImageStore，配置后只有图片都保存在本地的结果才会命中
+        """
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.image_store = image_store
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        # 异步调用正在进行的生成，键为(事件循环, 缓存键)，值为等待结果的Future，只在所属的事件循环中访问
+        self._async_in_flight = {}
+
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.missing = 0
+        self.evictions = 0
+        self.collapsed = 0
+
+        directory = os.path.dirname(cache_path) if cache_path != ':memory:' else ''
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._connection = None
+        self._connection_pid = None
+        self._connect()
+
+    @property
+    def _conn(self):
+        # 预加载应用时在主进程中打开的连接不能在fork出的工作进程中继续使用，在工作进程中重新打开
+        if self._connection_pid != os.getpid() and self.cache_path != ':memory:':
+            self._connect()
+        return self._connection
+
+    def _connect(self):
+        self._connection = sqlite3.connect(self.cache_path, timeout=5, check_same_thread=False)
+        self._connection_pid = os.getpid()
+        if self.cache_path != ':memory:':
+            # 多个工作进程共用同一个缓存文件，WAL模式下读写互不阻塞
+            self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS generations ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS generations_accessed ON generations (accessed)')
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(image_bytes, prompt, model, num_images, image_hash=None):
+        """
+        根据图片内容、提示词、模型和生成数量生成缓存键
+        :param image_bytes: 输入图片字节数据
+        :param prompt: 提示词
+        :param model: 模型名称
+        :param num_images: 生成图片数量
+        :param image_hash: 已计算好的图片SHA-256哈希（可选）
+        :return: 缓存键
+        """
+        if image_hash is None:
+            image_hash = hashlib.sha256(image_bytes).hexdigest()
+        payload = json.dumps([image_hash, prompt, model, num_images], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key, count_miss=True):
+        """
+        查询缓存
+        :param key: 缓存键
+        :param count_miss: 未命中时是否计入统计，未命中后还会调用get_or_generate的预先查询传False，每个请求只计一次
+        :return: 缓存的图片列表，未命中或已过期返回None
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                if count_miss:
+                    self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        写入缓存，并按数量淘汰最久未使用的结果
+        :param key: 缓存键
+        :param value: 图片列表
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO generations (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            count = self._conn.execute('SELECT COUNT(*) FROM generations').fetchone()[0]
+            if count > self.max_entries:
+                cursor = self._conn.execute(
+                    'DELETE FROM generations WHERE key IN '
+                    '(SELECT key FROM generations ORDER BY accessed ASC LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+                self.evictions += cursor.rowcount
+            self._conn.commit()
+
+    def get_or_generate(self, key, generate, timeout=None):
+        """
+        查询缓存，未命中时调用generate生成；相同键的并发调用合并为一次生成
+        :param key: 缓存键
+        :param generate: 生成函数，返回图片列表
+        :param timeout: 等待其他线程中相同调用的最长时间（秒），None表示一直等待
+        :return: 图片列表
+        :raises UpstreamTimeoutError: 等待相同调用超时，正在进行的调用不受影响
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._in_flight[key] = _Flight()
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            # 等待正在进行的相同调用完成，不超过本请求自己的截止时间
+            if not flight.event.wait(timeout):
+                raise UpstreamTimeoutError('Request deadline exceeded while waiting for an identical generation')
+            if flight.error is not None:
+                raise flight.error
+            return list(flight.result)
+
+        try:
+            value = generate()
+            # 空结果表示生成失败，不写入缓存
+            if value:
+                self.put(key, value)
+            flight.result = value
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.event.set()
+
+    async def get_or_generate_async(self, key, generate, executor=None, timeout=None):
+        """
+        get_or_generate的异步版本：SQLite读写在线程池中执行，同一事件循环中相同键的并发调用合并为一次生成
+        :param key: 缓存键
+        :param generate: 无参数的协程函数，返回图片列表
+        :param executor: 执行缓存读写的线程池，None表示使用事件循环的默认线程池
+        :param timeout: 等待相同调用的最长时间（秒），None表示一直等待
+        :return: 图片列表
+        :raises UpstreamTimeoutError: 等待相同调用超时，或正在进行的相同调用被取消
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        flight = self._async_in_flight.get(flight_key)
+        if flight is not None:
+            with self._lock:
+                self.collapsed += 1
+            try:
+                # shield：本请求超时不会取消其他请求正在等待的生成
+                return list(await asyncio.wait_for(asyncio.shield(flight), timeout))
+            except asyncio.TimeoutError:
+                raise UpstreamTimeoutError(
+                    'Request deadline exceeded while waiting for an identical generation'
+                ) from None
+
+        flight = self._async_in_flight[flight_key] = loop.create_future()
+        try:
+            value = await loop.run_in_executor(executor, self.get, key)
+            if value is None:
+                value = await generate()
+                # 空结果表示生成失败，不写入缓存
+                if value:
+                    await loop.run_in_executor(executor, self.put, key, value)
+            flight.set_result(value)
+            return value
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        except BaseException:
+            # 发起生成的请求被取消时，等待的请求按超时处理，不把取消传递给它们
+            flight.set_exception(UpstreamTimeoutError('Identical generation was cancelled'))
+            raise
+        finally:
+            del self._async_in_flight[flight_key]
+            # 没有等待的请求时异常不需要被读取，避免事件循环记录“异常未被读取”
+            if flight.done() and not flight.cancelled():
+                flight.exception()
+
+    def stats(self):
+        """
+        获取缓存统计信息
+        :return: 统计字典
+        """
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM generations').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'missing': self.missing,
+                'evictions': self.evictions,
+                'collapsed': self.collapsed,
+                'in_flight': len(self._in_flight),
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _lookup(self, key):
+        # 调用方需持有锁
+        row = self._conn.execute('SELECT value, created FROM generations WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        value, created = row
+        now = time.time()
+        if now - created > self.ttl:
+            self._conn.execute('DELETE FROM generations WHERE key = ?', (key,))
+            self._conn.commit()
+            self.expired += 1
+            return None
+
+        value = json.loads(value)
+        # 图片未能保存到本地（仍是会过期的原链接）或本地文件已被清理时重新生成
+        if self.image_store is not None and not self.image_store.contains(value):
+            self._conn.execute('DELETE FROM generations WHERE key = ?', (key,))
+            self._conn.commit()
+            self.missing += 1
+            return None
+
+        self._conn.execute('UPDATE generations SET accessed = ? WHERE key = ?', (now, key))
+        self._conn.commit()
+        return value
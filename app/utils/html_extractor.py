@@ -0,0 +1,57 @@
+from html.parser import HTMLParser
+
+
+class _LimitReached(Exception):
+    pass
+
+
+class ImageTagExtractor(HTMLParser):
+    def __init__(self, css_class, limit):
+        """
+        流式扫描HTML中指定class的img标签，不构建文档树，找到limit个后立即停止
+        :param css_class: img标签需要包含的class
+        :param limit: 最多提取的img标签数量
+        """
+        super().__init__()
+        self.css_class = css_class
+        self.limit = limit
+        self.urls = []
+        self.matched = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'img':
+            return
+
+        attrs = dict(attrs)
+        if self.css_class not in (attrs.get('class') or '').split():
+            return
+
+        # 与原来的BeautifulSoup实现一致：先取前limit个标签，再过滤无效的URL
+        self.matched += 1
+        img_url = attrs.get('src') or attrs.get('data-src')
+        if img_url and img_url.startswith('http'):
+            self.urls.append(img_url)
+        if self.matched >= self.limit:
+            raise _LimitReached()
+
+
+def extract_image_urls(html, css_class, limit=5, chunk_size=16384):
+    """
+    从搜索结果页中提取指定class的img标签的图片URL
+    :param html: 页面HTML文本
+    :param css_class: img标签需要包含的class
+    :param limit: 最多检查的img标签数量
+    :param chunk_size: 每次送入解析器的字符数，找到足够的标签后不再解析剩余部分
+    :return: 图片URL列表
+    """
+    if limit <= 0:
+        return []
+
+    extractor = ImageTagExtractor(css_class, limit)
+    try:
+        for start in range(0, len(html), chunk_size):
+            extractor.feed(html[start:start + chunk_size])
+        extractor.close()
+    except _LimitReached:
+        pass
+    return extractor.urls
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DeadlineExceeded(requests.Timeout):
+    """
+    整个调用（包括重试）超过了截止时间
+    """
+
+
+class HttpClient:
+    # 可以重试的HTTP状态码
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_connections=10, pool_maxsize=4, max_retries=2, backoff_factor=0.3,
+                 connect_timeout=3.05, read_timeout=10, deadline=15):
+        """
+        共享连接池的HTTP客户端，支持有限次数的退避重试和单次调用的截止时间
+        :param pool_connections: 缓存连接池的主机数量
+        :param pool_maxsize: 每个主机保留的最大空闲连接数，并发超出时临时建立新连接，用完后关闭
+        :param max_retries: 连接失败、超时或可重试状态码时的最大重试次数
+        :param backoff_factor: 退避系数，第n次重试前等待backoff_factor * 2^(n-1)秒
+        :param connect_timeout: 建立连接的超时时间（秒）
+        :param read_timeout: 读取响应的超时时间（秒）
+        :param deadline: 默认的单次调用截止时间（秒），包括所有重试和等待
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+
+        # 重试由get自己处理，以便遵守截止时间；
+        # requests不向urllib3传递等待空闲连接的超时时间，阻塞等待会不受截止时间限制，因此连接池满时不等待
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                              pool_block=False, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def get(self, url, deadline=None, **kwargs):
+        """
+        发送GET请求
+        :param url: 请求URL
+        :param deadline: 本次调用的截止时间（秒），默认使用构造时的设置
+        :param kwargs: 传给requests的其他参数（headers、params等）
+        :return: requests.Response，重试用尽后返回最后一次的响应
+        """
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.deadline)
+        attempt = 0
+
+        while True:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                self._count('failures')
+                raise DeadlineExceeded(f"Deadline exceeded for {url}")
+
+            self._count('requests')
+            timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+            try:
+                response = self.session.get(url, timeout=timeout, **kwargs)
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    self._count('failures')
+                    raise
+                response = None
+                error = e
+
+            # 退避等待会超过截止时间时不再重试
+            delay = self.backoff_factor * (2 ** attempt)
+            if time.monotonic() + delay >= deadline_at:
+                if response is not None:
+                    return response
+                self._count('failures')
+                raise error
+
+            time.sleep(delay)
+            attempt += 1
+            self._count('retries')
+
+    def stats(self):
+        """
+        获取请求统计信息
+        :return: 统计字典
+        """
+        with self._lock:
+            return {'requests': self.requests, 'retries': self.retries, 'failures': self.failures}
+
+    def close(self):
+        """
+        关闭连接池
+        """
+        self.session.close()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
@@ -1,13 +1,77 @@
 import cv2
 import numpy as np
 from PIL import Image
+import io
+import math
 import os
 
+# OpenCV解码时可直接缩小的倍数及对应的读取标志（从大到小）
+REDUCED_READ_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+]
+
+# 批量边缘检测时图片之间插入的边缘行数
+BATCH_EDGE_PADDING = 2
+
+# EXIF中表示图片方向的标签
+EXIF_ORIENTATION_TAG = 274
+
+# 缩小分析时边缘密度随分辨率变化的幂指数范围：
+# 1表示细线条（边缘像素占比与分辨率成反比），0表示纹理（占比不随分辨率变化），
+# 负数表示细节在缩小时逐渐消失（如像素级噪点），原始分辨率下的密度比工作分辨率下更高
+EDGE_SCALING_EXPONENT_RANGE = (-2.0, 1.0)
+
+
+def _edge_density(gray):
+    """
+    :param gray: 灰度图片
+    :return: Canny边缘像素占比
+    """
+    edges = cv2.Canny(gray, 100, 200)
+    return np.sum(edges > 0) / (gray.shape[0] * gray.shape[1])
+
+
+def _half_size(gray):
+    """
+    :param gray: 灰度图片
+    :return: 长宽各缩小一半的灰度图片
+    """
+    height, width = gray.shape[:2]
+    return cv2.resize(gray, (max(1, width // 2), max(1, height // 2)), interpolation=cv2.INTER_AREA)
+
+
+def _extrapolate_edge_density(density, half_density, scale):
+    """
+    将缩小后测得的边缘密度换算回原始分辨率。
+    不同内容的边缘密度随分辨率的变化规律不同，无法用固定比例换算：
+    由工作分辨率和其一半分辨率下的两次测量估计局部幂指数，再按该指数外推到原始分辨率
+    :param density: 工作分辨率下的边缘密度
+    :param half_density: 工作分辨率一半时的边缘密度
+    :param scale: 工作分辨率与原始分辨率的长边之比（小于1）
+    :return: 估计的原始分辨率下的边缘密度
+    """
+    if density <= 0:
+        return 0.0
+    low, high = EDGE_SCALING_EXPONENT_RANGE
+    # 一半分辨率下边缘完全消失时，细节接近工作分辨率的极限，按最快的消失速度外推
+    exponent = low if half_density <= 0 else min(high, max(low, math.log2(half_density / density)))
+    return min(1.0, density * scale ** exponent)
+
+
 class ImageAnalyzer:
-    def __init__(self):
+    def __init__(self, working_size=None):
+        """
+        :param working_size: 分析时图片长边的最大像素数，None或0表示使用原始分辨率。
+                             边缘密度由两种分辨率的测量外推得到，小于800时比工作分辨率更细的纹理已无法恢复，
+                             复杂度判断可能与原始分辨率不一致
+        """
         # 初始化模型和参数
         self.scene_categories = ['indoor', 'outdoor', 'nature', 'city', 'beach', 'mountain', 'forest', 'urban']
         self.light_categories = ['bright', 'dim', 'soft', 'harsh']
+        self.color_categories = ['warm', 'fresh', 'cool', 'vibrant']
+        self.working_size = working_size or None
     
     def analyze(self, image_path):
         """
@@ -16,28 +80,257 @@ class ImageAnalyzer:
         :return: 场景特征字典
         """
         # 读取图片
-        image = cv2.imread(image_path)
+        image, original_size = self._read_image(image_path)
         if image is None:
             raise Exception(f"Failed to read image: {image_path}")
         
-        # 转换为RGB格式
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return self.analyze_image(image, original_size)
+    
+    def analyze_bytes(self, image_bytes):
+        """
+        分析内存中的图片数据（如上传请求体），无需写入磁盘
+        :param image_bytes: 图片文件的字节数据
+        :return: 场景特征字典
+        """
+        image, original_size = self._read_image(image_bytes)
+        if image is None:
+            raise Exception("Failed to decode image data")
         
-        # 图片预处理
-        image_resized = cv2.resize(image_rgb, (224, 224))
+        return self.analyze_image(image, original_size)
+    
+    def read_scaled(self, image_source):
+        """
+        读取图片并缩放到长边不超过工作分辨率，EXIF方向已应用
+        :param image_source: 图片路径或图片字节数据
+        :return: (BGR图片, 原始尺寸(height, width))，解码失败时均为None
+        """
+        image, original_size = self._read_image(image_source)
+        if image is None:
+            return None, None
+        return self._fit_working_size(image), original_size
+    
+    def _read_image(self, image_source):
+        """
+        读取图片，设置了工作分辨率时在解码阶段直接缩小
+        :param image_source: 图片路径或图片字节数据
+        :return: (BGR图片, 原始尺寸(height, width))
+        """
+        if not self.working_size:
+            image = self._decode(image_source, cv2.IMREAD_COLOR)
+            return image, (image.shape[:2] if image is not None else None)
+        
+        # 只读取文件头获取原始尺寸，不解码像素
+        try:
+            header_source = io.BytesIO(image_source) if isinstance(image_source, (bytes, bytearray)) else image_source
+            with Image.open(header_source) as header:
+                width, height = header.size
+                # OpenCV解码时会按EXIF方向旋转，尺寸需要对应交换
+                if header.getexif().get(EXIF_ORIENTATION_TAG) in (5, 6, 7, 8):
+                    width, height = height, width
+        except Exception:
+            image = self._decode(image_source, cv2.IMREAD_COLOR)
+            return image, (image.shape[:2] if image is not None else None)
+        
+        image = self._decode(image_source, self._reduced_read_flag(max(height, width)))
+        return image, (height, width)
+    
+    def _decode(self, image_source, flag):
+        """
+        按读取标志解码图片
+        :param image_source: 图片路径或图片字节数据
+        :param flag: cv2读取标志
+        :return: BGR图片，解码失败时为None
+        """
+        if isinstance(image_source, (bytes, bytearray)):
+            buffer = np.frombuffer(image_source, dtype=np.uint8)
+            if buffer.size == 0:
+                return None
+            return cv2.imdecode(buffer, flag)
+        return cv2.imread(image_source, flag)
+    
+    def _reduced_read_flag(self, long_edge):
+        """
+        选择解码后长边仍不小于工作分辨率的最大缩小倍数
+        :param long_edge: 原始图片的长边像素数
+        :return: cv2.imread的读取标志
+        """
+        for factor, flag in REDUCED_READ_FLAGS:
+            if long_edge // factor >= self.working_size:
+                return flag
+        return cv2.IMREAD_COLOR
+    
+    def _fit_working_size(self, image):
+        """
+        将图片缩放到长边不超过工作分辨率
+        :param image: BGR图片
+        :return: 缩放后的图片
+        """
+        height, width = image.shape[:2]
+        long_edge = max(height, width)
+        if not self.working_size or long_edge <= self.working_size:
+            return image
+        
+        scale = self.working_size / long_edge
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    
+    def analyze_image(self, image, original_size=None):
+        """
+        分析已解码的BGR图片，提取场景特征
+        :param image: BGR格式的图片数组
+        :param original_size: 缩小解码前的原始尺寸(height, width)，默认为图片本身的尺寸
+        :return: 场景特征字典
+        """
+        if original_size is None:
+            original_size = image.shape[:2]
+        
+        # 设置了工作分辨率时，统计特征在缩小后的图片上计算
+        image = self._fit_working_size(image)
+        
+        # 每种颜色空间只转换一次，供各特征提取步骤共享
+        features = self._extract_features(image)
+        
+        # 缩小比例，内容分析时用于将边缘密度换算回原始分辨率
+        features['edge_scale'] = max(image.shape[:2]) / max(original_size)
         
         # 1. 场景分类（简化实现，实际可使用预训练模型）
-        scene_type = self._classify_scene(image)
+        scene_type = self._classify_scene(image, features)
         
         # 2. 光线分析
-        light_type = self._analyze_light(image)
+        light_type = self._analyze_light(image, features)
         
         # 3. 色彩分析
-        color_features = self._analyze_color(image)
+        color_features = self._analyze_color(image, features)
         
         # 4. 内容分析（简化实现）
-        content_features = self._analyze_content(image)
+        content_features = self._analyze_content(image, features)
+        
+        return self._build_scene_features(scene_type, light_type, color_features, content_features, original_size)
+    
+    def analyze_batch(self, images, size=(256, 256)):
+        """
+        批量分析图片：统一缩放到相同尺寸后堆叠为一个数组，用少量数组运算完成所有统计
+        :param images: 图片列表，元素可以是BGR图片数组、图片路径或图片字节数据
+        :param size: 批量分析的工作尺寸(width, height)
+        :return: 场景特征字典列表，与analyze的返回格式一致
+        """
+        if len(images) == 0:
+            return []
+        
+        width, height = size
+        batch = np.empty((len(images), height, width, 3), dtype=np.uint8)
+        original_sizes = []
+        for i, image in enumerate(images):
+            if isinstance(image, np.ndarray):
+                original_size = image.shape[:2]
+            else:
+                source = image
+                image, original_size = self._read_image(source)
+                if image is None:
+                    raise Exception(f"Failed to read image: {source if isinstance(source, str) else '<bytes>'}")
+            batch[i] = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            original_sizes.append(original_size)
+        
+        count = len(images)
+        pixels = height * width
+        
+        # 整个批次纵向拼成一张图，每种颜色空间只调用一次转换
+        tall = batch.reshape(count * height, width, 3)
+        gray = cv2.cvtColor(tall, cv2.COLOR_BGR2GRAY).reshape(count, pixels)
+        hsv = cv2.cvtColor(tall, cv2.COLOR_BGR2HSV).reshape(count, pixels, 3)
+        
+        # 3通道数组按轴归约在numpy中是跨步访问，逐张调用cv2.mean反而更快
+        bgr_means = np.array([cv2.mean(image)[:3] for image in batch])
+        hsv_means = np.array([cv2.mean(image)[:3] for image in hsv.reshape(count, height, width, 3)])
+        
+        # 灰度均值和标准差由像素和与平方和计算
+        gray_sums = gray.sum(axis=1, dtype=np.int64)
+        gray_square_sums = np.square(gray, dtype=np.uint16).sum(axis=1, dtype=np.int64)
+        gray_means = gray_sums / pixels
+        gray_stds = np.sqrt(np.maximum(gray_square_sums * pixels - gray_sums ** 2, 0)) / pixels
+        
+        # 与_analyze_content相同，在工作尺寸和其一半尺寸下分别测量边缘密度后换算回原始分辨率
+        gray_images = gray.reshape(count, height, width)
+        half_images = np.array([_half_size(image) for image in gray_images])
+        edge_densities = np.array([
+            _extrapolate_edge_density(density, half_density, max(height, width) / max(original_size))
+            if max(height, width) < max(original_size) else density
+            for density, half_density, original_size in zip(
+                self._batch_edge_densities(gray_images), self._batch_edge_densities(half_images), original_sizes
+            )
+        ])
+        
+        # 与_classify_scene、_analyze_light、_analyze_color相同的阈值判断
+        blue_means, green_means, red_means = bgr_means[:, 0], bgr_means[:, 1], bgr_means[:, 2]
+        scene_types = np.select(
+            [
+                (green_means > 120) & (blue_means > 100),
+                (blue_means > 130) & (green_means > 80),
+                blue_means > 130,
+                (red_means > 100) & (green_means < 100)
+            ],
+            ['nature', 'beach', 'outdoor', 'city'],
+            default='indoor'
+        )
+        light_types = np.select(
+            [
+                (gray_means > 150) & (gray_stds > 80),
+                gray_means > 150,
+                gray_stds < 50
+            ],
+            ['bright', 'soft', 'dim'],
+            default='harsh'
+        )
+        hue_means = hsv_means[:, 0]
+        dominant_colors = np.select(
+            [hue_means < 30, hue_means < 90, hue_means < 150],
+            ['warm', 'fresh', 'cool'],
+            default='vibrant'
+        )
+        complexities = np.where(edge_densities > 0.1, 'high', 'low')
+        
+        results = []
+        for i in range(count):
+            color_features = {
+                'dominant_color': str(dominant_colors[i]),
+                'hue_mean': hsv_means[i, 0],
+                'saturation_mean': hsv_means[i, 1],
+                'brightness_mean': hsv_means[i, 2]
+            }
+            content_features = {
+                'complexity': str(complexities[i]),
+                'edge_density': edge_densities[i]
+            }
+            results.append(self._build_scene_features(
+                str(scene_types[i]), str(light_types[i]), color_features, content_features, original_sizes[i]
+            ))
         
+        return results
+    
+    def _batch_edge_densities(self, gray_images):
+        """
+        对尺寸相同的一组灰度图片一次完成边缘检测
+        :param gray_images: 形状为(数量, 高, 宽)的灰度图片数组
+        :return: 每张图片的边缘像素占比
+        """
+        count, height, width = gray_images.shape
+        # 图片之间插入复制的边缘行后再做边缘检测，避免相邻图片的交界处产生边缘
+        pad = BATCH_EDGE_PADDING
+        padded = np.pad(gray_images, ((0, 0), (pad, pad), (0, 0)), mode='edge')
+        edges = cv2.Canny(padded.reshape(count * (height + 2 * pad), width), 100, 200)
+        edges = edges.reshape(count, height + 2 * pad, width)[:, pad:pad + height]
+        return (edges > 0).reshape(count, height * width).sum(axis=1) / (height * width)
+    
+    def _build_scene_features(self, scene_type, light_type, color_features, content_features, original_size):
+        """
+        根据各项分析结果整合场景特征
+        :param scene_type: 场景类型
+        :param light_type: 光线类型
+        :param color_features: 色彩特征
+        :param content_features: 内容特征
+        :param original_size: 原始图片尺寸(height, width)
+        :return: 场景特征字典
+        """
         # 5. 详细场景描述
         scene_description = self._generate_scene_description(scene_type, light_type, color_features, content_features)
         
@@ -52,7 +345,7 @@ class ImageAnalyzer:
             'light_type': light_type,
             'colors': color_features,
             'content': content_features,
-            'image_size': image.shape[:2],  # (height, width)
+            'image_size': tuple(original_size),  # (height, width)
             'detailed_analysis': {
                 'scene_summary': f'这是一张{color_features["dominant_color"]}色调的{scene_type}场景照片，光线{light_type}，场景复杂度{content_features["complexity"]}',
                 'lighting_summary': self._get_lighting_summary(light_type),
@@ -274,24 +567,51 @@ class ImageAnalyzer:
         
         return f'场景复杂度{complexity}，边缘密度{edge_density:.2f}，{("适合复杂构图" if complexity == "high" else "适合简洁构图")}'
     
-    def _classify_scene(self, image):
+    def _extract_features(self, image):
+        """
+        一次性完成颜色空间转换和全图统计，供各特征提取步骤共享
+        :param image: BGR格式的图片
+        :return: 共享特征字典
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        
+        return {
+            # 场景分类使用的BGR通道均值
+            'blue_mean': np.mean(image[:, :, 0]),
+            'green_mean': np.mean(image[:, :, 1]),
+            'red_mean': np.mean(image[:, :, 2]),
+            # 光线分析使用的灰度均值和标准差
+            'gray_mean': np.mean(gray),
+            'gray_std': np.std(gray),
+            # 色彩分析使用的HSV通道均值
+            'hue_mean': np.mean(hsv[:, :, 0]),
+            'saturation_mean': np.mean(hsv[:, :, 1]),
+            'value_mean': np.mean(hsv[:, :, 2]),
+            # 内容分析使用的灰度图
+            'gray': gray
+        }
+    
+    def _classify_scene(self, image, features=None):
         """
         简化的场景分类，实际可使用预训练模型
         :param image: 图片
+        :param features: _extract_features返回的共享特征（可选）
         :return: 场景类型
         """
         # 这里使用简化的实现，根据图片的颜色和对比度来判断
         # 实际项目中应该使用预训练的CNN模型
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        if features is None:
+            features = self._extract_features(image)
         
-        # 计算绿色通道的平均值（自然场景通常有较高的绿色值）
-        green_mean = np.mean(image[:, :, 1])
+        # 绿色通道的平均值（自然场景通常有较高的绿色值）
+        green_mean = features['green_mean']
         
-        # 计算蓝色通道的平均值（天空/水域通常有较高的蓝色值）
-        blue_mean = np.mean(image[:, :, 0])
+        # 蓝色通道的平均值（天空/水域通常有较高的蓝色值）
+        blue_mean = features['blue_mean']
         
-        # 计算红色通道的平均值（城市建筑可能有较高的红色值）
-        red_mean = np.mean(image[:, :, 2])
+        # 红色通道的平均值（城市建筑可能有较高的红色值）
+        red_mean = features['red_mean']
         
         # 简化的场景判断逻辑
         if green_mean > 120 and blue_mean > 100:
@@ -303,39 +623,41 @@ class ImageAnalyzer:
         else:
             return 'indoor'
     
-    def _analyze_light(self, image):
+    def _analyze_light(self, image, features=None):
         """
         分析图片的光线条件
         :param image: 图片
+        :param features: _extract_features返回的共享特征（可选）
         :return: 光线类型
         """
-        # 转换为灰度图
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if features is None:
+            features = self._extract_features(image)
         
-        # 计算平均亮度
-        mean_brightness = np.mean(gray)
+        # 平均亮度
+        mean_brightness = features['gray_mean']
         
-        # 计算对比度
-        contrast = np.std(gray)
+        # 对比度
+        contrast = features['gray_std']
         
         if mean_brightness > 150:
             return 'bright' if contrast > 80 else 'soft'
         else:
             return 'dim' if contrast < 50 else 'harsh'
     
-    def _analyze_color(self, image):
+    def _analyze_color(self, image, features=None):
         """
         分析图片的色彩特征
         :param image: 图片
+        :param features: _extract_features返回的共享特征（可选）
         :return: 色彩特征
         """
-        # 转换为HSV颜色空间
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        if features is None:
+            features = self._extract_features(image)
         
-        # 计算各通道的平均值
-        h_mean = np.mean(hsv[:, :, 0])
-        s_mean = np.mean(hsv[:, :, 1])
-        v_mean = np.mean(hsv[:, :, 2])
+        # HSV各通道的平均值
+        h_mean = features['hue_mean']
+        s_mean = features['saturation_mean']
+        v_mean = features['value_mean']
         
         # 简单的色彩分类
         dominant_color = ""
@@ -355,17 +677,23 @@ class ImageAnalyzer:
             'brightness_mean': v_mean
         }
     
-    def _analyze_content(self, image):
+    def _analyze_content(self, image, features=None):
         """
         简化的内容分析
         :param image: 图片
+        :param features: _extract_features返回的共享特征（可选）
         :return: 内容特征
         """
+        if features is None:
+            features = self._extract_features(image)
+        
         # 这里使用简化的实现，实际可使用目标检测模型
         # 计算边缘密度（边缘多的场景可能更复杂）
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 100, 200)
-        edge_density = np.sum(edges > 0) / (image.shape[0] * image.shape[1])
+        gray = features['gray']
+        edge_density = _edge_density(gray)
+        scale = features.get('edge_scale', 1.0)
+        if scale < 1.0:
+            edge_density = _extrapolate_edge_density(edge_density, _edge_density(_half_size(gray)), scale)
         
         return {
             'complexity': 'high' if edge_density > 0.1 else 'low',
@@ -1,9 +1,33 @@
-import requests
-from bs4 import BeautifulSoup
+from concurrent import futures
+import asyncio
 import random
+import threading
+import time
+import aiohttp
+from app.utils.html_extractor import extract_image_urls
+from app.utils.http_client import HttpClient
 
 class ImageSearcher:
-    def __init__(self):
+    def __init__(self, http_client=None, deadline=10, hedged=False, max_workers=8, cache=None):
+        """
+        :param http_client: 共享的HttpClient，默认创建新的连接池
+        :param deadline: 单次搜索的截止时间（秒），包括重试和切换搜索引擎
+        :param hedged: 是否同时向所有来源发起搜索，收集到足够结果即返回
+        :param max_workers: 并发搜索的线程数量
+        :param cache: 搜索结果缓存（SearchCache），None表示不缓存
+        """
+        # 所有搜索共用一个连接池，复用TCP+TLS连接
+        self.http_client = http_client or HttpClient()
+        self.deadline = deadline
+        self.hedged = hedged
+        self.max_workers = max_workers
+        self.cache = cache
+        self._executor = None
+        self._refresh_executor = None
+        self._executor_lock = threading.Lock()
+        self._aio_session = None
+        self._aio_loop = None
+        
         # 初始化搜索引擎URL和headers
         self.search_engines = [
             'https://www.bing.com/images/search?q={}',
@@ -29,6 +53,24 @@ class ImageSearcher:
         # 将关键词列表转换为字符串
         search_query = ' '.join(keywords)
         
+        if self.cache is None:
+            return self._search(search_query, limit)
+        
+        # 关键词组合有限，缓存结果；陈旧结果先返回，由线程池在后台刷新
+        key = self.cache.make_key(search_query, limit)
+        return self.cache.get_or_fetch(key, lambda: self._search(search_query, limit),
+                                       refresh_executor=self._get_refresh_executor())
+    
+    def _search(self, search_query, limit=5):
+        """
+        不经过缓存直接搜索图片
+        :param search_query: 搜索查询
+        :param limit: 返回结果数量
+        :return: 图片URL列表
+        """
+        if self.hedged:
+            return self._search_hedged(search_query, limit)
+        
         # 尝试使用Unsplash API（如果有API密钥）
         if self.unsplash_api_key:
             try:
@@ -49,6 +91,17 @@ class ImageSearcher:
         :param limit: 返回结果数量
         :return: 图片URL列表
         """
+        params, headers = self._unsplash_request(query, limit)
+        response = self.http_client.get(self.unsplash_api_url, deadline=self.deadline, headers=headers, params=params)
+        response.raise_for_status()
+        
+        return self._parse_unsplash_results(response.json())
+    
+    def _unsplash_request(self, query, limit):
+        """
+        构建Unsplash API请求的参数和请求头
+        :return: (params, headers)
+        """
         params = {
             'query': query,
             'per_page': limit,
@@ -60,10 +113,14 @@ class ImageSearcher:
             'Accept-Version': 'v1'
         }
         
-        response = requests.get(self.unsplash_api_url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        data = response.json()
+        return params, headers
+    
+    def _parse_unsplash_results(self, data):
+        """
+        解析Unsplash API的响应数据
+        :param data: 响应JSON
+        :return: 图片URL列表
+        """
         images = []
         
         for result in data.get('results', []):
@@ -83,79 +140,261 @@ class ImageSearcher:
         :param limit: 返回结果数量
         :return: 图片URL列表
         """
-        # 随机选择一个搜索引擎
-        search_url = random.choice(self.search_engines).format(query.replace(' ', '+'))
+        # 随机顺序尝试各个搜索引擎，前一个失败时切换到下一个，总耗时不超过截止时间
+        engines = random.sample(self.search_engines, len(self.search_engines))
+        deadline_at = time.monotonic() + self.deadline
         
-        try:
-            # 发送请求
-            response = requests.get(search_url, headers=self.headers, timeout=10)
-            response.raise_for_status()
-            
-            # 解析HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # 提取图片URL
-            images = []
+        for engine in engines:
+            search_url = engine.format(query.replace(' ', '+'))
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
             
-            # 根据不同搜索引擎的HTML结构提取图片
-            if 'bing' in search_url:
-                images = self._extract_bing_images(soup, limit)
-            elif 'duckduckgo' in search_url:
-                images = self._extract_duckduckgo_images(soup, limit)
-            
-            return images
-            
-        except Exception as e:
-            print(f"Web search error: {e}")
-            return []
+            try:
+                return self._search_engine(search_url, limit, remaining)
+            except Exception as e:
+                print(f"Web search error: {e}")
+        
+        return []
     
-    def _extract_bing_images(self, soup, limit=5):
+    def _search_engine(self, search_url, limit, deadline):
         """
-        从Bing图片搜索结果中提取图片URL
-        :param soup: BeautifulSoup对象
+        请求一个搜索引擎并解析结果页
+        :param search_url: 搜索URL
         :param limit: 返回结果数量
+        :param deadline: 截止时间（秒）
         :return: 图片URL列表
         """
-        images = []
+        # 发送请求
+        response = self.http_client.get(search_url, deadline=deadline, headers=self.headers)
+        response.raise_for_status()
         
-        # Bing图片搜索结果的HTML结构
-        img_elements = soup.find_all('img', class_='mimg')
+        return self._extract_images(search_url, response.text, limit)
+    
+    def _extract_images(self, search_url, html, limit):
+        """
+        根据不同搜索引擎的HTML结构提取图片
+        :param search_url: 搜索URL
+        :param html: 搜索结果页HTML
+        :param limit: 返回结果数量
+        :return: 图片URL列表
+        """
+        if 'bing' in search_url:
+            return self._extract_bing_images(html, limit)
+        elif 'duckduckgo' in search_url:
+            return self._extract_duckduckgo_images(html, limit)
+        return []
+    
+    def _search_hedged(self, query, limit=5):
+        """
+        同时向Unsplash和各搜索引擎发起搜索，按完成顺序合并去重，
+        收集到limit张图片或到达截止时间后立即返回
+        :param query: 搜索查询
+        :param limit: 返回结果数量
+        :return: 图片URL列表
+        """
+        executor = self._get_executor()
+        deadline_at = time.monotonic() + self.deadline
         
-        for img in img_elements[:limit]:
-            img_url = img.get('src') or img.get('data-src')
-            if img_url and img_url.startswith('http'):
-                images.append({
-                    'url': img_url,
-                    'thumbnail': img_url,
-                    'source': 'bing',
-                    'photographer': 'Unknown'
-                })
+        pending = []
+        if self.unsplash_api_key:
+            pending.append(executor.submit(self._search_unsplash, query, limit))
+        for engine in self.search_engines:
+            search_url = engine.format(query.replace(' ', '+'))
+            pending.append(executor.submit(self._search_engine, search_url, limit, self.deadline))
         
-        return images
+        images = []
+        seen_urls = set()
+        try:
+            for future in futures.as_completed(pending, timeout=max(deadline_at - time.monotonic(), 0)):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"Hedged search error: {e}")
+                    continue
+                
+                for image in results:
+                    if image['url'] not in seen_urls:
+                        seen_urls.add(image['url'])
+                        images.append(image)
+                if len(images) >= limit:
+                    break
+        except futures.TimeoutError:
+            print(f"Hedged search deadline exceeded, returning {len(images)} images")
+        finally:
+            # 取消尚未开始的请求；已发出的请求受同一截止时间限制，结果直接丢弃
+            for future in pending:
+                future.cancel()
+        
+        return images[:limit]
+    
+    def _get_executor(self):
+        # 首次使用并发搜索时才创建线程池
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                            thread_name_prefix='image-search')
+            return self._executor
     
-    def _extract_duckduckgo_images(self, soup, limit=5):
+    def _get_refresh_executor(self):
+        # 后台刷新使用单独的线程池，避免与并发搜索的子任务争抢线程
+        with self._executor_lock:
+            if self._refresh_executor is None:
+                self._refresh_executor = futures.ThreadPoolExecutor(max_workers=2,
+                                                                    thread_name_prefix='image-search-refresh')
+            return self._refresh_executor
+    
+    async def search_images_async(self, keywords, limit=5):
         """
-        从DuckDuckGo图片搜索结果中提取图片URL
-        :param soup: BeautifulSoup对象
+        search_images的异步版本，使用aiohttp发送请求，等待搜索引擎响应时不占用线程
+        :param keywords: 搜索关键词列表
         :param limit: 返回结果数量
         :return: 图片URL列表
         """
+        search_query = ' '.join(keywords)
+        
+        if self.cache is None:
+            return await self._search_async(search_query, limit)
+        
+        key = self.cache.make_key(search_query, limit)
+        return await self.cache.get_or_fetch_async(key, lambda: self._search_async(search_query, limit))
+    
+    async def _search_async(self, search_query, limit=5):
+        if self.hedged:
+            return await self._search_hedged_async(search_query, limit)
+        
+        if self.unsplash_api_key:
+            try:
+                images = await asyncio.wait_for(self._search_unsplash_async(search_query, limit), self.deadline)
+                if images:
+                    return images
+            except Exception as e:
+                print(f"Unsplash API error: {e}")
+        
+        # 随机顺序尝试各个搜索引擎，总耗时不超过截止时间
+        engines = random.sample(self.search_engines, len(self.search_engines))
+        deadline_at = time.monotonic() + self.deadline
+        
+        for engine in engines:
+            search_url = engine.format(search_query.replace(' ', '+'))
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            
+            try:
+                return await asyncio.wait_for(self._search_engine_async(search_url, limit), remaining)
+            except Exception as e:
+                print(f"Web search error: {e!r}")
+        
+        return []
+    
+    async def _search_hedged_async(self, query, limit=5):
+        """
+        _search_hedged的异步版本，收集到足够结果后取消其余仍在进行的请求
+        """
+        sources = [self._search_engine_async(engine.format(query.replace(' ', '+')), limit)
+                   for engine in self.search_engines]
+        if self.unsplash_api_key:
+            sources.insert(0, self._search_unsplash_async(query, limit))
+        tasks = [asyncio.ensure_future(source) for source in sources]
+        
+        deadline_at = time.monotonic() + self.deadline
+        pending = set(tasks)
         images = []
+        seen_urls = set()
+        try:
+            while pending and len(images) < limit:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    print(f"Hedged search deadline exceeded, returning {len(images)} images")
+                    break
+                
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                # 同时完成的结果按来源顺序合并
+                for task in (task for task in tasks if task in done):
+                    try:
+                        results = task.result()
+                    except Exception as e:
+                        print(f"Hedged search error: {e!r}")
+                        continue
+                    
+                    for image in results:
+                        if image['url'] not in seen_urls:
+                            seen_urls.add(image['url'])
+                            images.append(image)
+        finally:
+            # 与线程版本不同，协程可以直接取消，已发出的请求会被中断
+            for task in tasks:
+                task.cancel()
         
+        return images[:limit]
+    
+    async def _search_unsplash_async(self, query, limit=5):
+        params, headers = self._unsplash_request(query, limit)
+        session = self._get_aio_session()
+        async with session.get(self.unsplash_api_url, headers=headers, params=params) as response:
+            response.raise_for_status()
+            return self._parse_unsplash_results(await response.json())
+    
+    async def _search_engine_async(self, search_url, limit):
+        session = self._get_aio_session()
+        async with session.get(search_url, headers=self.headers) as response:
+            response.raise_for_status()
+            html = await response.text()
+        return self._extract_images(search_url, html, limit)
+    
+    def _get_aio_session(self):
+        # aiohttp会话绑定在创建它的事件循环上，首次在事件循环中搜索时创建
+        loop = asyncio.get_running_loop()
+        if self._aio_session is None or self._aio_session.closed or self._aio_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.max_workers * 8)
+            self._aio_session = aiohttp.ClientSession(connector=connector)
+            self._aio_loop = loop
+        return self._aio_session
+    
+    async def aclose(self):
+        """
+        关闭异步搜索使用的aiohttp会话
+        """
+        if self._aio_session is not None:
+            await self._aio_session.close()
+            self._aio_session = None
+    
+    def _extract_bing_images(self, html, limit=5):
+        """
+        从Bing图片搜索结果中提取图片URL
+        :param html: 搜索结果页HTML
+        :param limit: 返回结果数量
+        :return: 图片URL列表
+        """
+        # Bing图片搜索结果的HTML结构，流式扫描，找到足够的图片后不再解析剩余部分
+        return [
+            {
+                'url': img_url,
+                'thumbnail': img_url,
+                'source': 'bing',
+                'photographer': 'Unknown'
+            }
+            for img_url in extract_image_urls(html, 'mimg', limit)
+        ]
+    
+    def _extract_duckduckgo_images(self, html, limit=5):
+        """
+        从DuckDuckGo图片搜索结果中提取图片URL
+        :param html: 搜索结果页HTML
+        :param limit: 返回结果数量
+        :return: 图片URL列表
+        """
         # DuckDuckGo图片搜索结果的HTML结构
-        img_elements = soup.find_all('img', class_='tile--img__img')
-        
-        for img in img_elements[:limit]:
-            img_url = img.get('src') or img.get('data-src')
-            if img_url and img_url.startswith('http'):
-                images.append({
-                    'url': img_url,
-                    'thumbnail': img_url,
-                    'source': 'duckduckgo',
-                    'photographer': 'Unknown'
-                })
-        
-        return images
+        return [
+            {
+                'url': img_url,
+                'thumbnail': img_url,
+                'source': 'duckduckgo',
+                'photographer': 'Unknown'
+            }
+            for img_url in extract_image_urls(html, 'tile--img__img', limit)
+        ]
     
     def set_unsplash_api_key(self, api_key):
         """
@@ -0,0 +1,183 @@
+"""
+AI生成图片的本地存储：DashScope返回的OSS链接会过期，生成后立即下载一次原图并生成缩略图，之后由本服务提供访问
+
+文件按原图内容的SHA-256命名，内容不会改变，客户端可以长期缓存：
+- <哈希>.<扩展名>：原图
+- <哈希>.thumb.jpg：缩略图
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+
+import requests
+
+from app.utils.ai_image_generator import UploadEncoder, sniff_mime_type
+
+logger = logging.getLogger(__name__)
+
+# 保存的原图格式对应的扩展名，其他格式保留原链接
+STORED_EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/gif': 'gif'
+}
+
+_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}(\.thumb)?\.(jpg|png|webp|gif)$')
+
+# 图片文件名包含内容哈希，响应可以缓存一年
+MEDIA_MAX_AGE = 365 * 24 * 3600
+
+# 下载时每次读取的字节数
+_CHUNK_SIZE = 64 * 1024
+
+
+class ImageStore:
+    def __init__(self, store_dir, url_prefix='/media', thumbnail_size=384, thumbnail_quality=80, fetch_timeout=30,
+                 max_bytes=20 * 1024 * 1024, max_files=3000):
+        """
+        :param store_dir: 保存图片的目录
+        :param url_prefix: 访问图片的URL前缀
+        :param thumbnail_size: 缩略图长边的最大像素数
+        :param thumbnail_quality: 缩略图JPEG编码质量（1-100）
+        :param fetch_timeout: 下载原图的超时时间（秒）
+        :param max_bytes: 单张原图的最大字节数，超过时保留原链接
+        :param max_files: 最多保留的原图数量，超过时删除最早保存的图片及其缩略图
+        """
+        self.store_dir = store_dir
+        self.url_prefix = url_prefix.rstrip('/')
+        self.fetch_timeout = fetch_timeout
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._thumbnailer = UploadEncoder(max_size=thumbnail_size, image_format='jpeg', quality=thumbnail_quality)
+        self._prune_lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+
+    def mirror(self, images):
+        """
+        下载生成结果中的图片保存到本地，链接替换为本服务的地址，原链接保存在source_url中
+        下载或解码失败的图片保留原链接
+        :param images: 生成的图片字典列表
+        :return: 新的图片字典列表
+        """
+        mirrored = []
+        for image in images:
+            url = image.get('url', '')
+            if not url.startswith(('http://', 'https://')):
+                mirrored.append(image)
+                continue
+            try:
+                name, thumbnail_name = self.save(self._fetch(url))
+            except Exception:
+                logger.warning("Failed to mirror generated image %s", url, exc_info=True)
+                mirrored.append(image)
+                continue
+            mirrored.append(dict(
+                image,
+                url=self.url_for(name),
+                thumbnail=self.url_for(thumbnail_name),
+                source_url=url
+            ))
+
+        if any(image.get('source_url') for image in mirrored):
+            self._prune()
+        return mirrored
+
+    def save(self, data):
+        """
+        保存原图并生成缩略图，相同内容只保存一次
+        :param data: 原图字节数据
+        :return: (原图文件名, 缩略图文件名)，无法解码时缩略图即原图
+        :raises ValueError: 不支持的图片格式
+        """
+        extension = STORED_EXTENSIONS.get(sniff_mime_type(data))
+        if extension is None:
+            raise ValueError('Unsupported image format')
+
+        digest = hashlib.sha256(data).hexdigest()
+        name = f'{digest}.{extension}'
+        thumbnail_name = f'{digest}.thumb.jpg'
+
+        if not os.path.exists(os.path.join(self.store_dir, name)):
+            self._write(name, data)
+        if not os.path.exists(os.path.join(self.store_dir, thumbnail_name)):
+            thumbnail, mime_type = self._thumbnailer.encode(data)
+            if mime_type != 'image/jpeg':
+                return name, name
+            self._write(thumbnail_name, thumbnail)
+        return name, thumbnail_name
+
+    def url_for(self, name):
+        """
+        :param name: 文件名
+        :return: 访问图片的URL
+        """
+        return f'{self.url_prefix}/{name}'
+
+    def path(self, name):
+        """
+        :param name: 文件名
+        :return: 图片文件的路径，文件名无效或文件不存在时为None
+        """
+        if not _NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.store_dir, name)
+        return path if os.path.isfile(path) else None
+
+    def contains(self, images):
+        """
+        判断生成结果中的图片是否都已保存在本地，仍是原链接或本地文件已被删除时返回False
+        :param images: 图片字典列表
+        :return: 是否都可以从本地访问
+        """
+        prefix = self.url_prefix + '/'
+        for image in images:
+            for field in ('url', 'thumbnail'):
+                value = image.get(field, '')
+                if not value.startswith(prefix) or self.path(value[len(prefix):]) is None:
+                    return False
+        return True
+
+    def _fetch(self, url):
+        with requests.get(url, timeout=self.fetch_timeout, stream=True) as response:
+            response.raise_for_status()
+            chunks, size = [], 0
+            for chunk in response.iter_content(_CHUNK_SIZE):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ValueError(f'Image larger than {self.max_bytes} bytes')
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+    def _write(self, name, data):
+        # 先写入临时文件再替换，多个进程同时保存或读取时不会看到写了一半的文件
+        fd, temp_path = tempfile.mkstemp(dir=self.store_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.store_dir, name))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def _prune(self):
+        with self._prune_lock:
+            entries = []
+            for name in os.listdir(self.store_dir):
+                if _NAME_PATTERN.match(name) and '.thumb.' not in name:
+                    try:
+                        entries.append((os.path.getmtime(os.path.join(self.store_dir, name)), name))
+                    except FileNotFoundError:
+                        continue
+            entries.sort()
+            for _, name in entries[:max(0, len(entries) - self.max_files)]:
+                digest = name.split('.', 1)[0]
+                for path in (name, f'{digest}.thumb.jpg'):
+                    try:
+                        os.remove(os.path.join(self.store_dir, path))
+                    except FileNotFoundError:
+                        pass
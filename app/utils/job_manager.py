@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+
+class JobManager:
+    def __init__(self, max_workers=4, ttl=600, max_jobs=1000, store_path=None, poll_interval=0.5):
+        """
+        后台任务管理，用于异步完成耗时的推荐步骤（如AI生成参考图片）
+        :param max_workers: 后台线程数量
+        :param ttl: 已完成任务的保留时间（秒）
+        :param max_jobs: 最多保留的任务数量，超出时优先清理最早完成的任务
+        :param store_path: 多个工作进程共享任务状态的SQLite文件路径，None表示只在本进程中保存
+        :param poll_interval: 等待其他进程中的任务时查询共享状态的间隔（秒）
+        """
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.store_path = store_path or None
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='recommend-job')
+        self._jobs = {}
+        self._condition = threading.Condition()
+        self._store_lock = threading.Lock()
+        self._store = None
+        self._store_pid = None
+
+        if self.store_path:
+            directory = os.path.dirname(self.store_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._store_connection()
+
+    def submit(self, initial_result, task=None):
+        """
+        创建任务并在后台执行
+        :param initial_result: 任务创建时即可返回的部分结果
+        :param task: 后台执行的函数，返回的字典会合并到任务结果中；None表示结果已完整，任务创建即完成
+        :return: 任务ID
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._condition:
+            self._cleanup(now)
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': JOB_PENDING if task is not None else JOB_DONE,
+                'result': dict(initial_result),
+                'error': None,
+                'created_at': now,
+                'updated_at': now,
+                'version': 0
+            }
+            self._persist(self._jobs[job_id], cleanup_before=now - self.ttl)
+        if task is not None:
+            self._executor.submit(self._run, job_id, task)
+        return job_id
+
+    def get(self, job_id):
+        """
+        获取任务当前状态
+        :param job_id: 任务ID
+        :return: 任务状态字典的副本，任务不存在时返回None
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job:
+                return self._snapshot(job)
+        # 任务可能由其他工作进程创建
+        return self._load(job_id)
+
+    def wait(self, job_id, version, timeout=None):
+        """
+        等待任务状态发生变化
+        :param job_id: 任务ID
+        :param version: 调用方已知的状态版本
+        :param timeout: 最长等待时间（秒）
+        :return: 最新的任务状态字典，任务不存在时返回None
+        """
+        with self._condition:
+            if job_id in self._jobs:
+                self._condition.wait_for(
+                    lambda: job_id not in self._jobs or self._jobs[job_id]['version'] != version,
+                    timeout=timeout
+                )
+                job = self._jobs.get(job_id)
+                return self._snapshot(job) if job else None
+
+        # 其他工作进程中的任务无法通过条件变量通知，定期查询共享状态
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = self._load(job_id)
+            if job is None or job['version'] != version:
+                return job
+            remaining = deadline - time.monotonic() if deadline is not None else self.poll_interval
+            if remaining <= 0:
+                return job
+            time.sleep(min(self.poll_interval, remaining))
+
+    def shutdown(self, wait=True):
+        """
+        关闭后台线程池
+        :param wait: 是否等待正在执行的任务完成
+        """
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job_id, task):
+        self._update(job_id, status=JOB_RUNNING)
+        try:
+            result = task()
+            self._update(job_id, status=JOB_DONE, result=result)
+        except Exception as e:
+            logger.exception("Recommend job %s failed", job_id)
+            self._update(job_id, status=JOB_FAILED, error=str(e))
+
+    def _update(self, job_id, status, result=None, error=None):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['status'] = status
+            if result:
+                job['result'].update(result)
+            if error is not None:
+                job['error'] = error
+            job['updated_at'] = time.time()
+            job['version'] += 1
+            self._persist(job)
+            self._condition.notify_all()
+
+    def _cleanup(self, now):
+        # 调用方需持有锁
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['status'] in FINISHED_STATUSES and now - job['updated_at'] > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+        if len(self._jobs) >= self.max_jobs:
+            finished = sorted(
+                (job for job in self._jobs.values() if job['status'] in FINISHED_STATUSES),
+                key=lambda job: job['updated_at']
+            )
+            for job in finished[:len(self._jobs) - self.max_jobs + 1]:
+                del self._jobs[job['job_id']]
+
+    def _store_connection(self):
+        # 调用方需持有_store_lock（初始化时除外）；fork出的工作进程重新打开连接
+        if self._store is None or self._store_pid != os.getpid():
+            self._store = sqlite3.connect(self.store_path, timeout=5, check_same_thread=False)
+            self._store_pid = os.getpid()
+            self._store.execute('PRAGMA journal_mode=WAL')
+            self._store.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id TEXT PRIMARY KEY, value TEXT NOT NULL, finished INTEGER NOT NULL, updated REAL NOT NULL)'
+            )
+            self._store.commit()
+        return self._store
+
+    def _persist(self, job, cleanup_before=None):
+        if not self.store_path:
+            return
+        try:
+            with self._store_lock:
+                conn = self._store_connection()
+                conn.execute(
+                    'INSERT OR REPLACE INTO jobs (job_id, value, finished, updated) VALUES (?, ?, ?, ?)',
+                    (job['job_id'], json.dumps(job, ensure_ascii=False, default=float),
+                     int(job['status'] in FINISHED_STATUSES), job['updated_at'])
+                )
+                if cleanup_before is not None:
+                    conn.execute('DELETE FROM jobs WHERE finished = 1 AND updated < ?', (cleanup_before,))
+                conn.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning("Job store write error: %s", e)
+
+    def _load(self, job_id):
+        if not self.store_path:
+            return None
+        try:
+            with self._store_lock:
+                row = self._store_connection().execute(
+                    'SELECT value FROM jobs WHERE job_id = ?', (job_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Job store read error: %s", e)
+            return None
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def _snapshot(job):
+        snapshot = dict(job)
+        snapshot['result'] = dict(job['result'])
+        return snapshot
@@ -0,0 +1,277 @@
+"""
+进程内的运行指标：计数器、仪表和直方图，以Prometheus文本格式导出（/metrics）
+
+每个进程单独计数，gunicorn启动多个工作进程时每次抓取只返回处理该请求的进程的指标。
+"""
+import math
+import threading
+
+# 请求和各步骤耗时（秒）的默认分桶，覆盖毫秒级的图片分析到数十秒的AI生成
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _render_family(name, metric_type, documentation, samples):
+    """
+    :param samples: (指标名称, 标签列表, 值)列表，标签列表为[(标签名, 标签值)]
+    :return: 文本行列表
+    """
+    lines = [f'# HELP {name} {_escape(documentation)}', f'# TYPE {name} {metric_type}']
+    for sample_name, labels, value in samples:
+        lines.append(f'{sample_name}{_format_labels(labels)} {_format_value(value)}')
+    return lines
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return list(zip(self.labelnames, key))
+
+    def value(self, **labels):
+        """
+        获取一组标签的当前值（计数器和仪表）
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        return _render_family(self.name, self.metric_type, self.documentation, self.samples())
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 各分桶的计数（不累计）、总和与次数
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def value(self, **labels):
+        """
+        获取一组标签的观测次数和总和
+        :return: (次数, 总和)
+        """
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[2], state[1]) if state else (0, 0.0)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f'{self.name}_bucket', labels + [('le', _format_value(float(bound)))],
+                                    cumulative))
+                samples.append((f'{self.name}_sum', labels, total))
+                samples.append((f'{self.name}_count', labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f'Metric {metric.name} already registered')
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collect):
+        """
+        注册在导出时才读取的指标，例如各缓存已有的统计信息
+        :param collect: 无参数函数，返回(名称, 类型, 说明, [(标签字典, 值)])列表
+        """
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        """
+        :return: Prometheus文本格式的全部指标
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collect in collectors:
+            for name, metric_type, documentation, values in collect():
+                samples = [(name, sorted(labels.items()), value) for labels, value in values]
+                lines.extend(_render_family(name, metric_type, documentation, samples))
+        return '\n'.join(lines) + '\n'
+
+
+def cache_collector(get_caches):
+    """
+    将各缓存stats()中的命中、未命中和条目数转换为指标
+    :param get_caches: 返回{缓存名称: 缓存实例}的函数，值为None的缓存会被跳过
+    :return: 可传给MetricsRegistry.register_collector的函数
+    """
+    def collect():
+        hits, misses, ratios, entries = [], [], [], []
+        for name, cache in get_caches().items():
+            if cache is None:
+                continue
+            stats = cache.stats()
+            labels = {'cache': name}
+            # 磁盘缓存命中和陈旧结果命中同样计入命中率
+            hits.append((labels, stats['hits'] + stats.get('disk_hits', 0) + stats.get('stale_hits', 0)))
+            misses.append((labels, stats['misses']))
+            ratios.append((labels, stats['hit_rate']))
+            entries.append((labels, stats['entries']))
+        return [
+            ('easy_pose_cache_hits_total', 'counter', '缓存命中次数', hits),
+            ('easy_pose_cache_misses_total', 'counter', '缓存未命中次数', misses),
+            ('easy_pose_cache_hit_ratio', 'gauge', '缓存命中率', ratios),
+            ('easy_pose_cache_entries', 'gauge', '缓存条目数', entries)
+        ]
+
+    return collect
+
+
+def server_timing(timings):
+    """
+    将各步骤耗时转换为Server-Timing响应头
+    :param timings: {步骤: 毫秒}
+    :return: 响应头的值
+    """
+    return ', '.join(f'{stage};dur={milliseconds}' for stage, milliseconds in timings.items())
+
+
+def observe_stages(timings):
+    """
+    记录一次推荐请求中各步骤的耗时
+    :param timings: StageTimer.finish()返回的{步骤: 毫秒}
+    """
+    for stage, milliseconds in timings.items():
+        STAGE_DURATION.observe(milliseconds / 1000, stage=stage)
+
+
+# 默认的全局指标，Flask应用和异步服务共用
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'easy_pose_http_requests_total', '按接口、请求方法和状态码统计的HTTP请求数量', ('endpoint', 'method', 'status')
+)
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    'easy_pose_http_request_duration_seconds', 'HTTP请求处理耗时（秒）', ('endpoint',)
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    'easy_pose_http_requests_in_flight', '正在处理的HTTP请求数量', ('endpoint',)
+)
+STAGE_DURATION = REGISTRY.histogram(
+    'easy_pose_recommend_stage_duration_seconds', '姿势推荐各步骤耗时（秒）', ('stage',)
+)
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    'easy_pose_upstream_responses_total', '上游服务响应数量，请求异常时状态码为error', ('upstream', 'status')
+)
+UPSTREAM_DURATION = REGISTRY.histogram(
+    'easy_pose_upstream_request_duration_seconds', '上游服务请求耗时（秒）', ('upstream',)
+)
+UPSTREAM_IN_USE = REGISTRY.gauge(
+    'easy_pose_upstream_in_use', '正在进行的上游请求数量', ('upstream',)
+)
+UPSTREAM_QUEUE_DEPTH = REGISTRY.gauge(
+    'easy_pose_upstream_queue_depth', '等待调用上游服务的请求数量', ('upstream',)
+)
+UPSTREAM_QUEUE_WAIT = REGISTRY.histogram(
+    'easy_pose_upstream_queue_wait_seconds', '调用上游服务前的排队等待时间（秒）', ('upstream',)
+)
+UPSTREAM_REJECTED = REGISTRY.counter(
+    'easy_pose_upstream_rejected_total', '超出上游服务容量而直接失败的请求数量', ('upstream', 'reason')
+)
+UPSTREAM_CIRCUIT_STATE = REGISTRY.gauge(
+    'easy_pose_upstream_circuit_state', '上游服务熔断器状态：0关闭，1熔断，2半开（试探中）', ('upstream',)
+)
@@ -0,0 +1,256 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from app.utils.request_profiler import propagate
+from app.utils.upstream import UpstreamTimeoutError, UpstreamUnavailableError
+
+
+class StageTimer:
+    """
+    记录推荐流程中各步骤的耗时（毫秒）
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings = {}
+
+    def run(self, stage, func, *args, **kwargs):
+        """
+        执行一个步骤并记录耗时
+        :param stage: 步骤名称
+        :param func: 步骤函数
+        :return: 步骤函数的返回值
+        """
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.timings[stage] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def run_async(self, stage, awaitable):
+        """
+        等待一个异步步骤并记录耗时
+        :param stage: 步骤名称
+        :param awaitable: 步骤的协程或Future
+        :return: 步骤的返回值
+        """
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[stage] = round((time.perf_counter() - started) * 1000, 2)
+
+    def mark(self, stage):
+        """
+        记录从开始计时到现在的耗时，例如第一张AI参考图片返回的时间
+        :param stage: 步骤名称
+        """
+        self.timings[stage] = round((time.perf_counter() - self.start) * 1000, 2)
+
+    def finish(self):
+        """
+        记录总耗时
+        :return: 各步骤耗时字典的副本，超过截止时间仍在执行的步骤结束后不会修改返回结果
+        """
+        self.timings['total'] = round((time.perf_counter() - self.start) * 1000, 2)
+        return dict(self.timings)
+
+
+class RecommendPipeline:
+    def __init__(self, image_analyzer, analysis_cache, style_matcher, advice_generator, ai_image_generator,
+                 max_workers=8):
+        """
+        并发执行的姿势推荐流程：能重叠的步骤同时进行，总耗时取决于最慢的步骤而不是各步骤之和
+        :param max_workers: 后台线程数量
+        """
+        self.image_analyzer = image_analyzer
+        self.analysis_cache = analysis_cache
+        self.style_matcher = style_matcher
+        self.advice_generator = advice_generator
+        self.ai_image_generator = ai_image_generator
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='recommend-stage')
+
+    def run(self, image_bytes, style, num_images=3, timer=None, deadline=None):
+        """
+        执行完整的推荐流程
+        :param image_bytes: 图片字节数据
+        :param style: 风格
+        :param num_images: AI生成参考图片数量
+        :param timer: 已记录前置步骤（如读取上传图片）的StageTimer，None表示从现在开始计时
+        :param deadline: 请求的截止时间（time.monotonic()），到期时不再等待AI生成，None表示不限制
+        :return: 推荐结果字典，包含各步骤耗时timings；上游不可用时ai_error说明原因
+        """
+        timer = timer or StageTimer()
+
+        # 生成缓存键所需的图片哈希不依赖分析结果，与场景分析同时计算
+        prepared_future = self._submit(timer.run, 'prepare', self._prepare, image_bytes)
+
+        try:
+            # 1. 分析图片（相同图片直接使用缓存结果）
+            scene_features = timer.run(
+                'analyze', self.analysis_cache.get_or_compute, image_bytes, self.image_analyzer.analyze_bytes
+            )
+
+            # 2. 风格匹配
+            timer.run('match', self.style_matcher.match_style, style)
+        except Exception:
+            prepared_future.cancel()
+            raise
+
+        # 3. AI生成参考图片只依赖分析结果中的少数字段，分析完成后立即开始
+        generate_future, generated = self._start_generate(
+            timer, self._prepared(timer, prepared_future, image_bytes), scene_features, style, num_images, deadline
+        )
+
+        # 4. 等待上游生成的同时生成拍摄建议
+        advice = timer.run('advice', self.advice_generator.generate_advice, scene_features, style)
+        if generate_future is None:
+            ai_reference_images, ai_error = generated
+        else:
+            try:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                ai_reference_images, ai_error = generate_future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # 上游请求本身也带有相同的截止时间，会在后台自行结束
+                ai_reference_images = []
+                ai_error = UpstreamTimeoutError(
+                    'Request deadline exceeded while generating AI reference images'
+                ).to_dict()
+
+        return {
+            'scene_features': scene_features,
+            'style': style,
+            'ai_reference_images': ai_reference_images,
+            'ai_error': ai_error,
+            'advice': advice,
+            'timings': timer.finish()
+        }
+
+    def stream(self, image_bytes, style, num_images=3, timer=None, deadline=None):
+        """
+        流式执行推荐流程：场景分析和拍摄建议完成后立即返回，AI参考图片逐张生成
+        :param image_bytes: 图片字节数据
+        :param style: 风格
+        :param num_images: AI生成参考图片数量
+        :param timer: 已记录前置步骤的StageTimer，None表示从现在开始计时
+        :param deadline: 请求的截止时间（time.monotonic()），None表示不限制
+        :return: (包含scene_features、style和advice的结果字典, 事件生成器)
+                 事件生成器每生成一张图片产生{'type': 'image', 'index', 'image'}，
+                 最后产生{'type': 'done', 'ai_error', 'timings'}，timings中first_image为第一张图片返回的时间
+        """
+        timer = timer or StageTimer()
+
+        prepared_future = self._submit(timer.run, 'prepare', self._prepare, image_bytes)
+
+        try:
+            scene_features = timer.run(
+                'analyze', self.analysis_cache.get_or_compute, image_bytes, self.image_analyzer.analyze_bytes
+            )
+            timer.run('match', self.style_matcher.match_style, style)
+            advice = timer.run('advice', self.advice_generator.generate_advice, scene_features, style)
+        except Exception:
+            prepared_future.cancel()
+            raise
+
+        result = {
+            'scene_features': scene_features,
+            'style': style,
+            'advice': advice
+        }
+        return result, self._stream_images(
+            timer, prepared_future, image_bytes, scene_features, style, num_images, deadline
+        )
+
+    def shutdown(self, wait=True):
+        """
+        关闭后台线程池
+        :param wait: 是否等待正在执行的步骤完成
+        """
+        self._executor.shutdown(wait=wait)
+
+    def _submit(self, func, *args):
+        """
+        提交步骤到后台线程池，请求正在剖析时步骤在后台线程中同样被剖析
+        :return: Future
+        """
+        return self._executor.submit(propagate(func), *args)
+
+    def _prepare(self, image_bytes):
+        # 只计算缓存键所需的哈希，缩小和重新编码在缓存未命中时由生成步骤完成
+        return self.ai_image_generator.prepare_hashed(image_bytes)
+
+    def _prepared(self, timer, prepared_future, image_bytes):
+        """
+        获取上传DashScope所需的编码结果。后台线程都在执行生成时准备步骤还没有开始，
+        此时改为在请求线程中执行，不排在其他请求的生成任务后面
+        :return: 编码后的PreparedImage
+        """
+        if prepared_future.cancel():
+            return timer.run('prepare', self._prepare, image_bytes)
+        return prepared_future.result()
+
+    def _start_generate(self, timer, prepared, scene_features, style, num_images, deadline=None):
+        """
+        在请求线程中完成提交生成任务前的检查：命中缓存时直接返回结果，否则先获取DashScope调用机会再提交。
+        超出调用容量的请求在这里按排队限制立即失败，不会在线程池的队列中无限等待
+        :return: (后台生成的Future, None)，或不需要后台生成时为(None, (AI参考图片列表, 错误信息))
+        """
+        try:
+            cached = self.ai_image_generator.cached_images(prepared, scene_features, style, num_images)
+            if cached is not None:
+                return None, (cached, None)
+            reservation = self.ai_image_generator.reserve(deadline)
+        except UpstreamUnavailableError as e:
+            # 上游不可用时仍然返回分析结果和拍摄建议
+            return None, ([], e.to_dict())
+
+        try:
+            return self._submit(
+                timer.run, 'generate', self._generate, prepared, scene_features, style, num_images, deadline,
+                reservation
+            ), None
+        except BaseException:
+            if reservation is not None:
+                reservation.release()
+            raise
+
+    def _generate(self, prepared, scene_features, style, num_images, deadline=None, reservation=None):
+        """
+        :return: (AI参考图片列表, 上游不可用时的错误信息)
+        """
+        try:
+            return self.ai_image_generator.generate_images_from_image(
+                prepared,
+                scene_features,
+                style,
+                num_images=num_images,
+                deadline=deadline,
+                reservation=reservation
+            ), None
+        except UpstreamUnavailableError as e:
+            return [], e.to_dict()
+
+    def _stream_images(self, timer, prepared_future, image_bytes, scene_features, style, num_images, deadline=None):
+        ai_error = None
+        started = time.perf_counter()
+        try:
+            self.ai_image_generator.ensure_available()
+            prepared = self._prepared(timer, prepared_future, image_bytes)
+            # 单张生成请求使用同一个线程池，等待结果的是调用方线程，不会占满线程池而互相等待
+            images = self.ai_image_generator.iter_images_from_image(
+                prepared,
+                scene_features,
+                style,
+                num_images=num_images,
+                executor=self._executor,
+                deadline=deadline
+            )
+            for index, image in enumerate(images):
+                if index == 0:
+                    timer.mark('first_image')
+                yield {'type': 'image', 'index': index, 'image': image}
+        except UpstreamUnavailableError as e:
+            ai_error = e.to_dict()
+        finally:
+            timer.timings['generate'] = round((time.perf_counter() - started) * 1000, 2)
+
+        yield {'type': 'done', 'ai_error': ai_error, 'timings': timer.finish()}
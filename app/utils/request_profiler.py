@@ -0,0 +1,265 @@
+"""
+按请求开启的性能剖析：通过请求头或按比例抽样，用cProfile记录单个请求的调用耗时
+
+cProfile只记录启用它的线程，请求提交到线程池的步骤用propagate包装后在执行线程中单独剖析，结果合并到请求的剖析结果中。
+
+结果按请求ID保存为两份文件：
+- <请求ID>.collapsed：折叠调用栈（每行“调用栈 微秒数”），可以直接用flamegraph.pl或speedscope生成火焰图
+- <请求ID>.pstats：cProfile原始数据，可以用pstats或snakeviz查看
+"""
+import cProfile
+import hmac
+import logging
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# 请求方提供的请求ID只允许用作文件名的字符
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# 展开调用栈的最大深度，避免调用关系复杂时输出过大
+_MAX_STACK_DEPTH = 64
+
+# 当前线程正在剖析的请求，提交到线程池的步骤据此决定是否剖析
+_local = threading.local()
+
+
+def _label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        return name
+    return f'{os.path.basename(filename)}:{lineno}:{name}'
+
+
+def collapse_stats(stats):
+    """
+    将cProfile的统计数据转换为折叠调用栈
+    cProfile只记录直接的调用关系，经过同一函数的不同调用路径按调用边的累计耗时比例分摊
+    :param stats: pstats.Stats实例
+    :return: {调用栈字符串: 自身耗时（微秒）}
+    """
+    callees = {}
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        known_callers = [caller for caller in callers if caller in stats.stats]
+        if not known_callers:
+            roots.append(func)
+        for caller in known_callers:
+            callees.setdefault(caller, []).append((func, callers[caller][3]))
+
+    stacks = {}
+
+    def walk(func, path, scale):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        path = path + [_label(func)]
+        self_time = int(tt * scale * 1e6)
+        if self_time > 0:
+            key = ';'.join(path)
+            stacks[key] = stacks.get(key, 0) + self_time
+        if len(path) >= _MAX_STACK_DEPTH:
+            return
+        for callee, edge_time in callees.get(func, ()):
+            callee_total = stats.stats[callee][3]
+            # 递归调用不再展开，耗时已经计入外层
+            if callee_total <= 0 or _label(callee) in path:
+                continue
+            walk(callee, path, min(1.0, edge_time * scale / callee_total))
+
+    for root in roots:
+        walk(root, [], 1.0)
+    return stacks
+
+
+class _ProfileSession:
+    """
+    一次请求剖析中各工作线程的剖析结果
+    """
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def add(self, profile):
+        with self._lock:
+            # 请求结束后才完成的步骤不再计入
+            if not self._closed:
+                self._profiles.append(profile)
+
+    def close(self):
+        """
+        :return: 请求结束前完成的工作线程剖析结果列表
+        """
+        with self._lock:
+            self._closed = True
+            return list(self._profiles)
+
+
+def propagate(func):
+    """
+    当前线程正在剖析请求时，包装要提交到线程池的函数，使其在执行线程中同样被剖析并合并到请求的结果中
+    :param func: 要在其他线程中执行的函数
+    :return: 包装后的函数，当前线程没有在剖析时为func本身
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        return func
+
+    def profiled(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            session.add(profile)
+
+    return profiled
+
+
+class RequestProfiler:
+    def __init__(self, store_dir, sample_rate=0.0, token='', max_profiles=50):
+        """
+        :param store_dir: 保存剖析结果的目录，为空表示关闭
+        :param sample_rate: 随机抽样剖析的请求比例（0到1），0表示不抽样
+        :param token: 请求头X-Profile-Token与之相同时剖析该请求，为空表示不接受请求头触发
+        :param max_profiles: 最多保留的剖析结果数量，超过时删除最早的结果
+        """
+        self.store_dir = store_dir
+        self.sample_rate = sample_rate
+        self.token = token
+        self.max_profiles = max_profiles
+        # 同一时间只剖析一个请求，剖析开销不会叠加
+        self._active = threading.Lock()
+        self._prune_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.store_dir) and self.max_profiles > 0 and (self.sample_rate > 0 or bool(self.token))
+
+    def authorized(self, headers):
+        """
+        :param headers: 请求头
+        :return: 请求头中的令牌是否有效
+        """
+        provided = headers.get('X-Profile-Token', '')
+        return bool(self.token) and bool(provided) and hmac.compare_digest(provided, self.token)
+
+    def select(self, headers):
+        """
+        判断是否剖析当前请求
+        :param headers: 请求头
+        :return: 剖析结果的请求ID，不剖析时为None
+        """
+        if not self.enabled:
+            return None
+        authorized = self.authorized(headers)
+        if not authorized and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return None
+
+        # 只有持有令牌的请求方可以指定请求ID，否则任何请求都能覆盖已有的剖析结果
+        request_id = headers.get('X-Request-ID', '') if authorized else ''
+        if not _REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        return request_id
+
+    def run(self, request_id, func, *args, **kwargs):
+        """
+        剖析一次函数调用并保存结果，已有请求正在剖析时直接执行
+        :param request_id: select返回的请求ID
+        :param func: 被剖析的函数
+        :return: (函数返回值, 是否完成剖析)
+        """
+        if not self._active.acquire(blocking=False):
+            return func(*args, **kwargs), False
+
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # 其他剖析工具已经启用
+                return func(*args, **kwargs), False
+            session = _local.session = _ProfileSession()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                profiler.disable()
+                _local.session = None
+            try:
+                self._save(request_id, profiler, session.close())
+            except Exception:
+                # 保存失败不影响已经成功处理的请求
+                logger.exception("Failed to save profile for request %s", request_id)
+                return result, False
+            return result, True
+        finally:
+            self._active.release()
+
+    def load(self, request_id):
+        """
+        读取折叠调用栈
+        :param request_id: 请求ID
+        :return: 折叠调用栈文本，不存在时为None
+        """
+        if not self.store_dir or not _REQUEST_ID_PATTERN.match(request_id):
+            return None
+        try:
+            with open(os.path.join(self.store_dir, f'{request_id}.collapsed'), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _save(self, request_id, profiler, worker_profiles=()):
+        os.makedirs(self.store_dir, exist_ok=True)
+        stats = pstats.Stats(profiler)
+        for profile in worker_profiles:
+            stats.add(profile)
+        stacks = collapse_stats(stats)
+        text = ''.join(f'{stack} {micros}\n' for stack, micros in sorted(stacks.items()))
+
+        self._write(f'{request_id}.pstats', lambda path: stats.dump_stats(path))
+        self._write(f'{request_id}.collapsed', lambda path: _write_text(path, text))
+        self._prune()
+
+    def _write(self, name, write):
+        # 先写入临时文件再替换，读取时不会看到写了一半的结果
+        fd, temp_path = tempfile.mkstemp(dir=self.store_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            write(temp_path)
+            os.replace(temp_path, os.path.join(self.store_dir, name))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _prune(self):
+        with self._prune_lock:
+            entries = []
+            for name in os.listdir(self.store_dir):
+                if name.endswith('.collapsed'):
+                    path = os.path.join(self.store_dir, name)
+                    try:
+                        entries.append((os.path.getmtime(path), name[:-len('.collapsed')]))
+                    except FileNotFoundError:
+                        continue
+            entries.sort()
+            for _, request_id in entries[:max(0, len(entries) - self.max_profiles)]:
+                for suffix in ('.collapsed', '.pstats'):
+                    try:
+                        os.remove(os.path.join(self.store_dir, request_id + suffix))
+                    except FileNotFoundError:
+                        pass
+
+
+def _write_text(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
@@ -0,0 +1,216 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCache:
+    def __init__(self, ttl=3600, stale_ttl=86400, max_entries=2048, cache_dir=None):
+        """
+        关键词搜索结果缓存，过期后在有效的陈旧期内先返回旧结果并在后台刷新
+        :param ttl: 结果新鲜期（秒）
+        :param stale_ttl: 新鲜期之后仍可返回旧结果的时间（秒），期间触发后台刷新
+        :param max_entries: 内存中最多保留的结果数量（LRU淘汰）
+        :param cache_dir: 磁盘缓存目录，多个进程或预热脚本可共享，None表示只使用内存缓存
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir or None
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._refresh_tasks = set()
+        self._lock = threading.Lock()
+
+        # 命中统计
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+        if self.cache_dir and not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def make_key(query, limit):
+        """
+        根据搜索查询和结果数量生成缓存键
+        :param query: 搜索查询
+        :param limit: 返回结果数量
+        :return: 缓存键
+        """
+        return hashlib.sha256(f'{limit}:{query}'.encode('utf-8')).hexdigest()
+
+    def get_or_fetch(self, key, fetch, refresh_executor=None):
+        """
+        查询缓存：新鲜结果直接返回；陈旧结果先返回并在后台刷新；没有可用结果时同步获取
+        :param key: 缓存键
+        :param fetch: 获取结果的函数
+        :param refresh_executor: 执行后台刷新的线程池，None时陈旧结果也同步刷新
+        :return: 搜索结果
+        """
+        value, refresh = self._check(key, allow_stale=refresh_executor is not None)
+        if refresh:
+            refresh_executor.submit(self._refresh, key, fetch)
+        if value is not None:
+            return value
+
+        result = fetch()
+        self.put(key, result)
+        return result
+
+    async def get_or_fetch_async(self, key, fetch):
+        """
+        get_or_fetch的异步版本，陈旧结果在事件循环中后台刷新
+        :param key: 缓存键
+        :param fetch: 获取结果的协程函数
+        :return: 搜索结果
+        """
+        value, refresh = self._check(key, allow_stale=True)
+        if refresh:
+            # 保留任务引用，避免后台刷新被垃圾回收
+            task = asyncio.ensure_future(self._refresh_async(key, fetch))
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+        if value is not None:
+            return value
+
+        result = await fetch()
+        self.put(key, result)
+        return result
+
+    def put(self, key, value):
+        """
+        写入缓存，空结果（通常表示搜索失败）不写入
+        :param key: 缓存键
+        :param value: 搜索结果
+        """
+        if not value:
+            return
+        stored_at = time.time()
+        with self._lock:
+            self._store(key, copy.deepcopy(value), stored_at)
+        self._write_disk(key, value, stored_at)
+
+    def stats(self):
+        """
+        获取缓存统计信息
+        :return: 统计字典
+        """
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0
+            }
+
+    def _check(self, key, allow_stale):
+        """
+        查询缓存并统计命中情况
+        :return: (结果副本, 是否需要启动后台刷新)，没有可用结果时结果为None
+        """
+        value, stored_at = self._lookup(key)
+        if value is not None:
+            age = time.time() - stored_at
+            if age < self.ttl:
+                with self._lock:
+                    self.hits += 1
+                return copy.deepcopy(value), False
+
+            if allow_stale and age < self.ttl + self.stale_ttl:
+                with self._lock:
+                    self.stale_hits += 1
+                    refresh = key not in self._refreshing
+                    if refresh:
+                        self._refreshing.add(key)
+                return copy.deepcopy(value), refresh
+
+        with self._lock:
+            self.misses += 1
+        return None, False
+
+    def _refresh(self, key, fetch):
+        try:
+            self.put(key, fetch())
+            self._refreshed(key, None)
+        except Exception as e:
+            self._refreshed(key, e)
+
+    async def _refresh_async(self, key, fetch):
+        try:
+            self.put(key, await fetch())
+            self._refreshed(key, None)
+        except Exception as e:
+            self._refreshed(key, e)
+
+    def _refreshed(self, key, error):
+        if error is not None:
+            logger.warning("Search cache refresh error: %s", error)
+        with self._lock:
+            if error is None:
+                self.refreshes += 1
+            else:
+                self.refresh_errors += 1
+            self._refreshing.discard(key)
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        entry = self._read_disk(key)
+        if entry is None:
+            return None, None
+        with self._lock:
+            self._store(key, entry['value'], entry['stored_at'])
+        return entry['value'], entry['stored_at']
+
+    def _store(self, key, value, stored_at):
+        # 调用方需持有锁
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, value, stored_at):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，避免并发读取到不完整的文件
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'stored_at': stored_at, 'value': value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Search cache write error: %s", e)
@@ -0,0 +1,439 @@
+"""
+上游服务（DashScope）调用保护：
+- UpstreamLimiter限制同时进行的请求数量和请求速率，超出容量时立即失败而不是堆积线程
+- CircuitBreaker在连续失败后熔断，冷却期间直接跳过调用
+"""
+import asyncio
+import collections
+import contextlib
+import threading
+import time
+
+from app.utils.metrics import (
+    UPSTREAM_CIRCUIT_STATE, UPSTREAM_IN_USE, UPSTREAM_QUEUE_DEPTH, UPSTREAM_QUEUE_WAIT, UPSTREAM_REJECTED
+)
+
+# 熔断器状态及对应的指标值
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+CIRCUIT_STATE_VALUES = {CIRCUIT_CLOSED: 0, CIRCUIT_OPEN: 1, CIRCUIT_HALF_OPEN: 2}
+
+
+class UpstreamUnavailableError(Exception):
+    """
+    上游服务暂时不可用，调用方应跳过本次调用并降级返回
+    """
+    code = 'upstream_unavailable'
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        """
+        :return: 响应中描述错误的字典
+        """
+        return {'code': self.code, 'message': str(self), 'retry_after': self.retry_after}
+
+
+class UpstreamBusyError(UpstreamUnavailableError):
+    """
+    等待队列已满或排队超时
+    """
+    code = 'upstream_busy'
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """
+    熔断器已打开，冷却期间不调用上游服务
+    """
+    code = 'circuit_open'
+
+
+class UpstreamTimeoutError(UpstreamUnavailableError):
+    """
+    请求的截止时间已到，上游调用被放弃
+    """
+    code = 'upstream_timeout'
+
+
+def remaining_time(deadline, name='upstream'):
+    """
+    计算距离截止时间的剩余秒数
+    :param deadline: time.monotonic()表示的截止时间，None表示不限制
+    :return: 剩余秒数，不限制时为None
+    :raises UpstreamTimeoutError: 截止时间已过
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        UPSTREAM_REJECTED.inc(upstream=name, reason='deadline')
+        raise UpstreamTimeoutError(f'Request deadline exceeded before calling {name}')
+    return remaining
+
+
+class _Waiter:
+    __slots__ = ('granted', 'event', 'loop', 'future')
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def grant(self):
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class UpstreamLimiter:
+    def __init__(self, name, max_concurrent=8, max_queue=32, queue_timeout=10.0, rate=0.0, burst=1):
+        """
+        并发数量限制和令牌桶速率限制，等待的请求按到达顺序获得调用机会
+        :param name: 上游服务名称，用作指标标签
+        :param max_concurrent: 同时进行的最大请求数量
+        :param max_queue: 最多等待的请求数量，队列已满时立即失败
+        :param queue_timeout: 最长等待时间（秒），包括排队和等待令牌
+        :param rate: 每秒允许发出的请求数量，0表示不限制速率
+        :param burst: 令牌桶容量，空闲后允许连续发出的请求数量
+        """
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters = collections.deque()
+        # 令牌桶：按速率计算的下一个令牌的理论发放时间
+        self._next_token = time.monotonic()
+        self.acquired = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def acquire(self, timeout=None):
+        """
+        获取一个调用机会，必要时排队等待
+        :param timeout: 本次最长等待时间（秒），不超过queue_timeout，None表示使用queue_timeout
+        :return: 本次获取的等待时间（秒）
+        """
+        started = time.monotonic()
+        timeout = self._wait_limit(timeout)
+        waiter = self._enqueue(None)
+        if waiter is not None and not waiter.event.wait(timeout):
+            self._abandon(waiter, timeout)
+        delay = self._reserve_token(started, timeout)
+        if delay > 0:
+            time.sleep(delay)
+        return self._acquired(started)
+
+    def release(self):
+        """
+        释放调用机会，直接交给最早等待的请求
+        """
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().grant()
+            else:
+                self._in_use -= 1
+            self._update_gauges()
+
+    def reserve(self, timeout=None):
+        """
+        在提交后台任务前获取调用机会，交给执行任务的线程使用；
+        超出容量时在提交方线程中立即失败，任务不会在线程池的队列中绕过排队限制
+        :param timeout: 本次最长等待时间（秒），None表示使用queue_timeout
+        :return: Reservation，任务结束时调用release()归还
+        """
+        self.acquire(timeout)
+        return Reservation(self)
+
+    @contextlib.contextmanager
+    def slot(self, timeout=None):
+        """
+        获取调用机会的上下文管理器，用法：with limiter.slot(): call_upstream()
+        :param timeout: 本次最长等待时间（秒），None表示使用queue_timeout
+        """
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire_async(self, timeout=None):
+        """
+        acquire的异步版本，排队时不占用线程
+        """
+        started = time.monotonic()
+        timeout = self._wait_limit(timeout)
+        waiter = self._enqueue(asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                self._abandon(waiter, timeout)
+            except asyncio.CancelledError:
+                # 请求被取消时放弃排队，已经分配到的调用机会交给下一个请求
+                with self._lock:
+                    if waiter.granted:
+                        granted = True
+                    else:
+                        self._waiters.remove(waiter)
+                        self._update_gauges()
+                        granted = False
+                if granted:
+                    self.release()
+                raise
+        delay = self._reserve_token(started, timeout)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+        return self._acquired(started)
+
+    @contextlib.asynccontextmanager
+    async def slot_async(self, timeout=None):
+        await self.acquire_async(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """
+        :return: 当前并发数量、排队数量和累计的获取、拒绝、超时次数
+        """
+        with self._lock:
+            return {
+                'in_use': self._in_use,
+                'queued': len(self._waiters),
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'acquired': self.acquired,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts
+            }
+
+    def _enqueue(self, loop):
+        """
+        有空闲且无人排队时直接占用，否则加入等待队列
+        :return: 等待对象，直接占用时为None
+        """
+        with self._lock:
+            if self._in_use < self.max_concurrent and not self._waiters:
+                self._in_use += 1
+                self._update_gauges()
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                UPSTREAM_REJECTED.inc(upstream=self.name, reason='queue_full')
+                raise UpstreamBusyError(f'{self.name} is at capacity, {len(self._waiters)} requests already waiting',
+                                        retry_after=self.queue_timeout)
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            self._update_gauges()
+            return waiter
+
+    def _wait_limit(self, timeout):
+        return self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+
+    def _abandon(self, waiter, timeout):
+        """
+        排队超时：仍在队列中时移除并报错；超时的同时被分配到调用机会时继续使用
+        """
+        with self._lock:
+            if waiter.granted:
+                return
+            self._waiters.remove(waiter)
+            self.timeouts += 1
+            self._update_gauges()
+        UPSTREAM_REJECTED.inc(upstream=self.name, reason='queue_timeout')
+        raise UpstreamBusyError(f'Timed out after {round(timeout, 3)}s waiting for {self.name}',
+                                retry_after=self.queue_timeout)
+
+    def _reserve_token(self, started, timeout):
+        """
+        预约一个令牌，等待时间超过剩余的排队时间时释放调用机会并报错
+        :return: 需要等待的秒数
+        """
+        if self.rate <= 0:
+            return 0.0
+        interval = 1.0 / self.rate
+        with self._lock:
+            now = time.monotonic()
+            # 空闲期间最多积累burst个令牌
+            available_at = max(self._next_token, now - (self.burst - 1) * interval)
+            delay = max(0.0, available_at - now)
+            if now + delay - started > timeout:
+                self.timeouts += 1
+                rejected = True
+            else:
+                self._next_token = available_at + interval
+                rejected = False
+        if rejected:
+            self.release()
+            UPSTREAM_REJECTED.inc(upstream=self.name, reason='rate_limited')
+            raise UpstreamBusyError(f'{self.name} rate limit of {self.rate}/s exceeded', retry_after=delay)
+        return delay
+
+    def _acquired(self, started):
+        waited = time.monotonic() - started
+        with self._lock:
+            self.acquired += 1
+        UPSTREAM_QUEUE_WAIT.observe(waited, upstream=self.name)
+        return waited
+
+    def _update_gauges(self):
+        # 调用方已持有self._lock
+        UPSTREAM_IN_USE.set(self._in_use, upstream=self.name)
+        UPSTREAM_QUEUE_DEPTH.set(len(self._waiters), upstream=self.name)
+
+
+class Reservation:
+    """
+    已经获取的一个调用机会，可以在其他线程中使用，多次release()只归还一次
+    """
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._limiter.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        """
+        连续失败达到阈值后熔断，冷却期过后放行一次试探请求，成功则恢复，失败则继续熔断
+        :param name: 上游服务名称，用作指标标签
+        :param failure_threshold: 触发熔断的连续失败次数，0表示关闭熔断
+        :param reset_timeout: 熔断后的冷却时间（秒）
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started = None
+        self.opened = 0
+        self.rejected = 0
+        UPSTREAM_CIRCUIT_STATE.set(0, upstream=name)
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def before_call(self):
+        """
+        调用上游服务前检查，半开状态下占用唯一的试探机会
+        :return: 占用试探机会时返回其标记，没有到达上游就放弃调用时交给release_trial；未占用时为None
+        :raises CircuitOpenError: 熔断中或试探请求正在进行
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CIRCUIT_CLOSED:
+                return None
+            # 试探请求超过冷却时间仍未返回结果时视为丢失，允许新的试探
+            if state == CIRCUIT_HALF_OPEN and (self._trial_started is None or
+                                               now - self._trial_started > self.reset_timeout):
+                self._trial_started = now
+                return now
+            self.rejected += 1
+            retry_after = max(0.0, self._opened_at + self.reset_timeout - now)
+        UPSTREAM_REJECTED.inc(upstream=self.name, reason='circuit_open')
+        raise CircuitOpenError(f'{self.name} circuit is open after {self.failure_threshold} consecutive failures',
+                               retry_after=round(retry_after, 3))
+
+    def check(self):
+        """
+        只检查是否熔断，不占用试探机会，用于排队前快速失败
+        :raises CircuitOpenError: 熔断中
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._current_state(now) != CIRCUIT_OPEN:
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self._opened_at + self.reset_timeout - now)
+        UPSTREAM_REJECTED.inc(upstream=self.name, reason='circuit_open')
+        raise CircuitOpenError(f'{self.name} circuit is open', retry_after=round(retry_after, 3))
+
+    def release_trial(self, trial):
+        """
+        归还没有到达上游的试探机会，不记录成功或失败，下一个请求可以立即试探
+        :param trial: before_call的返回值，None时不做任何事
+        """
+        if trial is None:
+            return
+        with self._lock:
+            # 试探已有结果或已被视为丢失时不影响新的试探
+            if self._trial_started == trial:
+                self._trial_started = None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_started = None
+            self._set_state(CIRCUIT_CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_started = None
+            if self._state == CIRCUIT_HALF_OPEN or (self._state == CIRCUIT_CLOSED and self.failure_threshold
+                                                    and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                self._set_state(CIRCUIT_OPEN)
+
+    def stats(self):
+        """
+        :return: 当前状态、连续失败次数和累计的熔断、拒绝次数
+        """
+        with self._lock:
+            return {
+                'state': self._current_state(time.monotonic()),
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'opened': self.opened,
+                'rejected': self.rejected
+            }
+
+    def _current_state(self, now):
+        # 调用方已持有self._lock
+        if self._state == CIRCUIT_OPEN and now - self._opened_at >= self.reset_timeout:
+            self._set_state(CIRCUIT_HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state):
+        self._state = state
+        UPSTREAM_CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[state], upstream=self.name)
@@ -0,0 +1,119 @@
+"""
+ImageAnalyzer.analyze_batch与逐张分析的吞吐量对比
+
+用法：
+    python benchmarks/analyze_batch.py --count 256 --batch-size 64
+    python benchmarks/analyze_batch.py --images path/to/dir
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadgen import isolate_app_state
+
+_STATE_DIR = isolate_app_state()
+
+from app.utils.image_analyzer import ImageAnalyzer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def make_synthetic_images(count, width, height, seed=0):
+    """
+    生成带有平滑色块和纹理的合成图片
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        coarse = rng.integers(0, 256, size=(height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+        image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+        noise = rng.integers(-20, 20, size=image.shape, dtype=np.int16)
+        images.append(np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8))
+    return images
+
+
+def load_images(directory, limit):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            image = cv2.imread(os.path.join(directory, name))
+            if image is not None:
+                images.append(image)
+        if len(images) >= limit:
+            break
+    return images
+
+
+def run_loop(analyzer, images, size):
+    # 逐张缩放到相同的工作尺寸后分析，与analyze_batch的计算量一致
+    return [
+        analyzer.analyze_image(cv2.resize(image, size, interpolation=cv2.INTER_AREA), original_size=image.shape[:2])
+        for image in images
+    ]
+
+
+def run_batch(analyzer, images, size, batch_size):
+    results = []
+    for start in range(0, len(images), batch_size):
+        results.extend(analyzer.analyze_batch(images[start:start + batch_size], size=size))
+    return results
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ImageAnalyzer批量分析吞吐量测试')
+    parser.add_argument('--images', help='测试图片目录，不指定时使用合成图片')
+    parser.add_argument('--count', type=int, default=256, help='图片数量')
+    parser.add_argument('--source-size', default='1024x768', help='合成图片尺寸，格式为宽x高')
+    parser.add_argument('--size', default='256x256', help='批量分析的工作尺寸，格式为宽x高')
+    parser.add_argument('--batch-size', type=int, default=64, help='每批图片数量')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，取最快的一次')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.split('x'))
+    if args.images:
+        images = load_images(args.images, args.count)
+    else:
+        source_width, source_height = (int(v) for v in args.source_size.split('x'))
+        images = make_synthetic_images(args.count, source_width, source_height)
+
+    analyzer = ImageAnalyzer()
+    loop_seconds = measure(lambda: run_loop(analyzer, images, size), args.repeat)
+    batch_seconds = measure(lambda: run_batch(analyzer, images, size, args.batch_size), args.repeat)
+
+    report = {
+        'images': len(images),
+        'working_size': list(size),
+        'batch_size': args.batch_size,
+        'loop_seconds': round(loop_seconds, 4),
+        'batch_seconds': round(batch_seconds, 4),
+        'loop_images_per_second': round(len(images) / loop_seconds, 1),
+        'batch_images_per_second': round(len(images) / batch_seconds, 1),
+        'speedup': round(loop_seconds / batch_seconds, 2)
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+ImageAnalyzer各步骤在不同图片尺寸下的耗时和内存峰值
+
+步骤与analyze_bytes的执行顺序一致：解码（decode）、缩放到工作分辨率（resize）、颜色空间转换和全图统计
+（extract_features）、场景分类（classify_scene）、光线分析（analyze_light）、色彩分析（analyze_color）、
+Canny边缘检测（analyze_content）和场景描述生成（description）。
+
+每个尺寸在单独的子进程中测量，内存峰值包括：
+- 各步骤的Python/numpy内存分配峰值（tracemalloc，不含OpenCV内部的临时缓冲区）
+- 子进程的常驻内存峰值（ru_maxrss，包含OpenCV内部分配）
+
+用法：
+    python benchmarks/analyzer_stages.py --output analyzer_stages.json
+    python benchmarks/analyzer_stages.py --megapixels 0.3,12,48 --working-size 1024,0 --standalone
+    python benchmarks/analyzer_stages.py --images path/to/dir --repeat 10
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadgen import isolate_app_state
+
+_STATE_DIR = isolate_app_state()
+
+from app.utils.image_analyzer import ImageAnalyzer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+DEFAULT_MEGAPIXELS = '0.3,1,2,5,12,24,48'
+
+STAGES = ('decode', 'resize', 'extract_features', 'classify_scene', 'analyze_light', 'analyze_color',
+          'analyze_content', 'description')
+
+# 不共享特征时各分析步骤单独完成颜色空间转换的耗时，对应原来逐步计算的实现
+STANDALONE_STAGES = ('classify_scene', 'analyze_light', 'analyze_color', 'analyze_content')
+
+
+def size_for_megapixels(megapixels, aspect=4 / 3):
+    """
+    按宽高比计算指定像素数的图片尺寸
+    :return: (width, height)
+    """
+    height = math.sqrt(megapixels * 1e6 / aspect)
+    return round(height * aspect), round(height)
+
+
+def make_synthetic_image(width, height, seed=0):
+    """
+    生成带有平滑色块和细小纹理的合成图片，噪声直接在uint8上叠加，避免大图时占用过多内存
+    """
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(height // 64 + 2, width // 64 + 2, 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = np.empty_like(image)
+    cv2.randu(noise, 0, 24)
+    return cv2.add(image, noise)
+
+
+def iter_cases(megapixels_list, images_dir=None, quality=90):
+    """
+    生成测试用例：每个尺寸的合成图片，以及目录中每张真实图片缩放到每个尺寸后的JPEG数据
+    :return: (来源名称, 宽, 高, JPEG字节数据)生成器
+    """
+    sources = [('synthetic', None)]
+    if images_dir:
+        for name in sorted(os.listdir(images_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                sources.append((name, os.path.join(images_dir, name)))
+
+    for name, path in sources:
+        original = cv2.imread(path) if path else None
+        if path and original is None:
+            continue
+        aspect = original.shape[1] / original.shape[0] if original is not None else 4 / 3
+        for megapixels in megapixels_list:
+            width, height = size_for_megapixels(megapixels, aspect)
+            if original is None:
+                image = make_synthetic_image(width, height)
+            else:
+                interpolation = cv2.INTER_AREA if width < original.shape[1] else cv2.INTER_CUBIC
+                image = cv2.resize(original, (width, height), interpolation=interpolation)
+            ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            del image
+            if ok:
+                yield name, width, height, encoded.tobytes()
+
+
+def run_stages(analyzer, image_bytes, timings=None, memory=None, standalone=False):
+    """
+    按analyze_bytes的顺序执行一次各步骤
+    :param timings: 记录各步骤耗时（毫秒）的字典，None表示不记录
+    :param memory: 记录各步骤内存分配峰值（MB）的字典，需要已经启动tracemalloc
+    :param standalone: 是否额外测量不共享特征时各分析步骤的耗时
+    :return: 场景特征字典
+    """
+    state = {}
+
+    def stage(name, func):
+        if memory is not None:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        if timings is not None:
+            timings.setdefault(name, []).append(elapsed)
+        if memory is not None:
+            peak = (tracemalloc.get_traced_memory()[1] - baseline) / 2 ** 20
+            memory[name] = max(memory.get(name, 0.0), peak)
+        return result
+
+    def read():
+        state['image'], state['original_size'] = analyzer._read_image(image_bytes)
+
+    def extract():
+        state['features'] = analyzer._extract_features(state['image'])
+        state['features']['edge_scale'] = max(state['image'].shape[:2]) / max(state['original_size'])
+
+    stage('decode', read)
+    state['image'] = stage('resize', lambda: analyzer._fit_working_size(state['image']))
+    stage('extract_features', extract)
+    image, features = state['image'], state['features']
+    scene_type = stage('classify_scene', lambda: analyzer._classify_scene(image, features))
+    light_type = stage('analyze_light', lambda: analyzer._analyze_light(image, features))
+    color_features = stage('analyze_color', lambda: analyzer._analyze_color(image, features))
+    content_features = stage('analyze_content', lambda: analyzer._analyze_content(image, features))
+    scene_features = stage('description', lambda: analyzer._build_scene_features(
+        scene_type, light_type, color_features, content_features, state['original_size']
+    ))
+
+    if standalone:
+        stage('standalone_classify_scene', lambda: analyzer._classify_scene(image))
+        stage('standalone_analyze_light', lambda: analyzer._analyze_light(image))
+        stage('standalone_analyze_color', lambda: analyzer._analyze_color(image))
+        stage('standalone_analyze_content', lambda: analyzer._analyze_content(image, {
+            'gray': cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), 'edge_scale': features['edge_scale']
+        }))
+    return scene_features
+
+
+def measure_case(image_bytes, working_size, repeat, standalone):
+    """
+    在子进程中测量一个用例
+    :return: 各步骤耗时统计、内存峰值和进程常驻内存峰值
+    """
+    analyzer = ImageAnalyzer(working_size=working_size)
+    rss_baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    # 预热一次，首次调用会初始化OpenCV的线程池和解码器
+    run_stages(analyzer, image_bytes, standalone=standalone)
+
+    timings = {}
+    for _ in range(repeat):
+        run_stages(analyzer, image_bytes, timings=timings, standalone=standalone)
+
+    # 内存分配单独测量一次，tracemalloc会拖慢计时
+    memory = {}
+    tracemalloc.start()
+    try:
+        run_stages(analyzer, image_bytes, memory=memory, standalone=standalone)
+    finally:
+        tracemalloc.stop()
+
+    stages = {
+        name: {
+            'min_ms': round(min(values), 3),
+            'median_ms': round(statistics.median(values), 3),
+            'peak_alloc_mb': round(memory.get(name, 0.0), 2)
+        }
+        for name, values in timings.items()
+    }
+    totals = [sum(timings[name][i] for name in STAGES) for i in range(repeat)]
+    return {
+        'stages': stages,
+        'total_min_ms': round(min(totals), 3),
+        'total_median_ms': round(statistics.median(totals), 3),
+        'rss_baseline_mb': round(rss_baseline, 1),
+        'rss_peak_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ImageAnalyzer各步骤耗时和内存基准')
+    parser.add_argument('--megapixels', default=DEFAULT_MEGAPIXELS, help='逗号分隔的图片像素数（百万）')
+    parser.add_argument('--working-size', default='1024,0', help='逗号分隔的工作分辨率，0表示原始分辨率')
+    parser.add_argument('--images', help='真实图片目录，每张图片缩放到各个尺寸后测量')
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例的重复次数')
+    parser.add_argument('--quality', type=int, default=90, help='测试图片的JPEG质量')
+    parser.add_argument('--standalone', action='store_true', help='同时测量不共享特征时各分析步骤的耗时')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args()
+
+    megapixels_list = [float(value) for value in args.megapixels.split(',')]
+    working_sizes = [int(value) for value in args.working_size.split(',')]
+
+    report = {
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'opencv_threads': cv2.getNumThreads(),
+        'repeat': args.repeat,
+        'jpeg_quality': args.quality,
+        'results': []
+    }
+
+    # 每个用例使用新的子进程，常驻内存峰值互不影响
+    context = multiprocessing.get_context('spawn')
+    for source, width, height, image_bytes in iter_cases(megapixels_list, args.images, args.quality):
+        for working_size in working_sizes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                measured = executor.submit(measure_case, image_bytes, working_size or None, args.repeat,
+                                           args.standalone).result()
+            result = {
+                'source': source,
+                'width': width,
+                'height': height,
+                'megapixels': round(width * height / 1e6, 2),
+                'jpeg_bytes': len(image_bytes),
+                'working_size': working_size
+            }
+            result.update(measured)
+            report['results'].append(result)
+            print(f"{source} {result['megapixels']}MP working_size={working_size}: "
+                  f"{result['total_median_ms']}ms, rss {result['rss_peak_mb']}MB", file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+本地DashScope桩服务，模拟qwen-image-edit-plus的生成接口和响应耗时，压测时代替真实的上游服务
+
+用法：
+    from dashscope_stub import start_dashscope_stub
+    server = start_dashscope_stub(latency=1.0)
+    env['DASHSCOPE_API_URL'] = server.url('/api/v1')
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_server import StubServer
+
+GENERATION_PATH = '/api/v1/services/aigc/multimodal-generation/generation'
+# 生成结果中的图片链接指向桩服务自身，开启图片本地存储时可以正常下载
+IMAGE_PATH = '/generated/image.jpg'
+
+
+def make_image(size=1024):
+    """
+    :param size: 图片边长（像素）
+    :return: 与生成结果分辨率相近的JPEG图片字节数据
+    """
+    import cv2
+    import numpy as np
+
+    gradient = np.linspace(0, 255, size, dtype=np.uint8)
+    image = np.dstack([np.tile(gradient, (size, 1)), np.tile(gradient[:, None], (1, size)),
+                       np.full((size, size), 128, dtype=np.uint8)])
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def make_generation_handler(latency=1.0, status=200):
+    """
+    创建模拟生成接口的处理函数
+    :param latency: 每次生成的耗时（秒）
+    :param status: 返回的HTTP状态码
+    :return: StubServer的路由处理函数
+    """
+    def handler(request):
+        time.sleep(latency)
+        if status != 200:
+            body = {'request_id': 'stub', 'code': 'Throttling', 'message': 'stub error'}
+            return status, {'Content-Type': 'application/json'}, json.dumps(body).encode()
+
+        num_images = json.loads(request['body'] or b'{}').get('parameters', {}).get('n', 1)
+        host = request['headers'].get('Host', 'dashscope.stub')
+        content = [{'image': f'http://{host}{IMAGE_PATH}?index={index}'} for index in range(num_images)]
+        body = {
+            'request_id': 'stub',
+            'output': {'choices': [{'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}]},
+            'usage': {'image_count': num_images}
+        }
+        return 200, {'Content-Type': 'application/json'}, json.dumps(body).encode()
+
+    return handler
+
+
+def start_dashscope_stub(latency=1.0, status=200, host='127.0.0.1', port=0):
+    """
+    启动DashScope桩服务
+    :param latency: 每次生成的耗时（秒）
+    :param status: 返回的HTTP状态码
+    :return: 已启动的StubServer，DashScope API地址为server.url('/api/v1')
+    """
+    server = StubServer(host=host, port=port, record=False)
+    server.add_route(GENERATION_PATH, make_generation_handler(latency, status), method='POST')
+    image = make_image()
+    server.add_route(IMAGE_PATH, lambda request: (200, {'Content-Type': 'image/jpeg'}, image))
+    return server.start()
@@ -0,0 +1,226 @@
+"""
+推荐服务压测和延迟基准：并发请求/api/recommend、/api/upload和/api/styles，
+统计吞吐量、p50/p95/p99延迟和推荐流程各步骤的耗时，结果保存为JSON，可与之前版本的结果对比
+
+默认启动本地DashScope桩服务和gunicorn（gthread），关闭缓存，每个请求都完整执行。
+
+用法：
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --endpoints recommend --concurrency 1,8,32 --duration 30 --server async
+    python benchmarks/load_test.py --baseline benchmarks/results/20250101-120000-abc1234.json --fail-on-regression
+    python benchmarks/load_test.py --base-url http://127.0.0.1:5000    # 压测已经运行的服务
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import requests
+
+from dashscope_stub import start_dashscope_stub
+from loadgen import ROOT, SETUPS, latency_summary, run_load, start_server, state_env, stop_server, wait_ready
+
+ENDPOINTS = ('styles', 'upload', 'recommend')
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+def make_sender(endpoint, base_url, image_bytes, style):
+    """
+    创建发送一次请求的函数
+    :param endpoint: styles、upload或recommend
+    :return: 接收requests.Session并返回响应的函数
+    """
+    if endpoint == 'styles':
+        return lambda session: session.get(base_url + '/api/styles', timeout=30)
+    if endpoint == 'upload':
+        return lambda session: session.post(base_url + '/api/upload', timeout=60,
+                                            files={'image': ('loadtest.jpg', image_bytes, 'image/jpeg')})
+    return lambda session: session.post(base_url + '/api/recommend', timeout=300,
+                                        files={'image': ('loadtest.jpg', image_bytes, 'image/jpeg')},
+                                        data={'style': style})
+
+
+def stage_breakdown(results):
+    """
+    汇总推荐响应中timings字段记录的各步骤耗时
+    :return: {步骤: 延迟统计}
+    """
+    stages = {}
+    for status, latency, response in results:
+        if status != 200:
+            continue
+        try:
+            timings = response.json().get('timings') or {}
+        except ValueError:
+            continue
+        for stage, milliseconds in timings.items():
+            stages.setdefault(stage, []).append(milliseconds)
+    return {stage: latency_summary(values) for stage, values in sorted(stages.items())}
+
+
+def summarize(endpoint, concurrency, results, elapsed):
+    latencies = [latency * 1000 for status, latency, response in results if status == 200]
+    summary = {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': len(results) - len(latencies),
+        'status_counts': {str(status): count for status, count in sorted(Counter(r[0] for r in results).items())},
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        'latency_ms': latency_summary(latencies)
+    }
+    if endpoint == 'recommend':
+        summary['stages_ms'] = stage_breakdown(results)
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(report, baseline, threshold):
+    """
+    与之前保存的结果对比吞吐量和p95延迟
+    :param threshold: 判定为性能下降的相对变化比例
+    :return: (对比结果列表, 是否有性能下降)
+    """
+    previous = {(item['endpoint'], item['concurrency']): item for item in baseline['results']}
+    rows = []
+    regressed = False
+    for item in report['results']:
+        old = previous.get((item['endpoint'], item['concurrency']))
+        if old is None:
+            continue
+
+        throughput_change = None
+        if old['requests_per_second']:
+            throughput_change = item['requests_per_second'] / old['requests_per_second'] - 1
+        p95_change = None
+        if old['latency_ms']['p95'] and item['latency_ms']['p95'] is not None:
+            p95_change = item['latency_ms']['p95'] / old['latency_ms']['p95'] - 1
+
+        row_regressed = ((throughput_change is not None and throughput_change < -threshold) or
+                         (p95_change is not None and p95_change > threshold))
+        regressed = regressed or row_regressed
+        rows.append({
+            'endpoint': item['endpoint'],
+            'concurrency': item['concurrency'],
+            'requests_per_second': [old['requests_per_second'], item['requests_per_second']],
+            'p95_ms': [old['latency_ms']['p95'], item['latency_ms']['p95']],
+            'throughput_change': round(throughput_change, 3) if throughput_change is not None else None,
+            'p95_change': round(p95_change, 3) if p95_change is not None else None,
+            'regressed': row_regressed
+        })
+    return rows, regressed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='推荐服务压测和延迟基准')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f'逗号分隔的接口，可选{"、".join(ENDPOINTS)}')
+    parser.add_argument('--concurrency', default='1,8,32', help='逗号分隔的并发客户端数量，依次压测')
+    parser.add_argument('--duration', type=float, default=15, help='每组压测的时间（秒）')
+    parser.add_argument('--latency', type=float, default=1.0, help='模拟的DashScope生成耗时（秒）')
+    parser.add_argument('--server', default='gthread', choices=SETUPS, help='启动的本地服务器配置')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='gunicorn进程数量')
+    parser.add_argument('--threads', type=int, default=32, help='gthread每个进程的线程数量')
+    parser.add_argument('--with-cache', action='store_true', help='保留分析和生成缓存（默认关闭，每个请求都完整执行）')
+    parser.add_argument('--base-url', help='压测已经运行的服务，不启动本地服务器和DashScope桩服务')
+    parser.add_argument('--image', default=os.path.join(ROOT, 'test_image.jpg'), help='上传的测试图片')
+    parser.add_argument('--style', default='清新', help='风格')
+    parser.add_argument('--output', help='结果文件路径，默认保存到benchmarks/results/<时间>-<版本>.json')
+    parser.add_argument('--baseline', help='之前保存的结果文件，用于对比')
+    parser.add_argument('--threshold', type=float, default=0.15, help='吞吐量下降或p95延迟上升超过该比例时判定为性能下降')
+    parser.add_argument('--fail-on-regression', action='store_true', help='有性能下降时以非零状态码退出')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.image, 'rb') as f:
+        image_bytes = f.read()
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'server': 'external' if args.base_url else args.server,
+        'workers': args.workers,
+        'threads': args.threads,
+        'upstream_latency': None if args.base_url else args.latency,
+        'with_cache': args.with_cache,
+        'image_bytes': len(image_bytes),
+        'duration': args.duration,
+        'results': []
+    }
+
+    stub = process = state_dir = None
+    try:
+        if args.base_url:
+            base_url = args.base_url.rstrip('/')
+        else:
+            stub = start_dashscope_stub(latency=args.latency)
+            env = dict(os.environ)
+            env.update({
+                'DASHSCOPE_API_URL': stub.url('/api/v1'),
+                'DASHSCOPE_API_KEY': 'stub'
+            })
+            state_dir = tempfile.TemporaryDirectory(prefix='easy-pose-bench-')
+            env.update(state_env(state_dir.name, with_cache=args.with_cache))
+            process, base_url = start_server(args.server, env, args.workers, args.threads)
+        wait_ready(base_url)
+
+        for endpoint in args.endpoints.split(','):
+            send = make_sender(endpoint, base_url, image_bytes, args.style)
+            # 预热：首个请求会初始化SDK和建立连接
+            send(requests.Session())
+            for concurrency in (int(value) for value in args.concurrency.split(',')):
+                results, elapsed = run_load(send, concurrency, args.duration)
+                summary = summarize(endpoint, concurrency, results, elapsed)
+                report['results'].append(summary)
+                print(f"{endpoint:<10} c={concurrency:<4} {summary['requests_per_second']:>8.2f} req/s  "
+                      f"p50={summary['latency_ms']['p50']}ms p95={summary['latency_ms']['p95']}ms "
+                      f"p99={summary['latency_ms']['p99']}ms errors={summary['errors']}", file=sys.stderr)
+    finally:
+        if process is not None:
+            stop_server(process)
+        if stub is not None:
+            stub.stop()
+        if state_dir is not None:
+            state_dir.cleanup()
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            report['comparison'], regressed = compare(report, json.load(f), args.threshold)
+        report['baseline'] = os.path.basename(args.baseline)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['revision']}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f'结果已保存到{output}', file=sys.stderr)
+    if regressed:
+        print('与基准结果相比性能下降', file=sys.stderr)
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+压测公共工具：启动和停止本地服务器、并发发送请求、统计延迟分位数
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUPS = ('dev', 'sync', 'gthread', 'async')
+
+
+def state_env(directory, with_cache=True):
+    """
+    服务运行时写入磁盘的文件（上传图片、各缓存、AI生成图片、任务状态和剖析结果）都放到指定目录中，
+    压测不会在项目目录中留下文件，也不会读到上一次运行的缓存
+    :param directory: 保存这些文件的目录，通常是本次运行的临时目录
+    :param with_cache: False时关闭分析、生成和搜索缓存，每个请求都完整执行
+    :return: 环境变量字典
+    """
+    env = {
+        'UPLOAD_FOLDER': os.path.join(directory, 'uploads'),
+        'ANALYSIS_CACHE_DIR': '',
+        'IMAGE_STORE_DIR': os.path.join(directory, 'images'),
+        'GENERATION_CACHE_PATH': os.path.join(directory, 'generation.sqlite3'),
+        'SEARCH_CACHE_DIR': os.path.join(directory, 'search'),
+        'JOB_STORE_PATH': os.path.join(directory, 'jobs.sqlite3'),
+        'PROFILE_DIR': os.path.join(directory, 'profiles')
+    }
+    if not with_cache:
+        env.update({'GENERATION_CACHE_PATH': '', 'ANALYSIS_CACHE_SIZE': '0', 'SEARCH_CACHE_DIR': ''})
+    return env
+
+
+def isolate_app_state():
+    """
+    在进程内导入app之前调用：导入时会创建上传文件夹和缓存目录，改为创建在临时目录中，进程退出时删除。
+    spawn启动的子进程继承环境变量，沿用父进程的临时目录
+    :return: 临时目录对象（需要保持引用），子进程中为None
+    """
+    if os.environ.get('BENCHMARK_STATE_DIR'):
+        return None
+    state_dir = tempfile.TemporaryDirectory(prefix='easy-pose-bench-')
+    os.environ.update(state_env(state_dir.name), BENCHMARK_STATE_DIR=state_dir.name)
+    return state_dir
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(setup, env, workers, threads):
+    """
+    启动一种配置的服务器
+    :param setup: dev（python run.py）、sync、gthread或async（gunicorn）
+    :param env: 环境变量
+    :param workers: gunicorn进程数量
+    :param threads: gthread每个进程的线程数量
+    :return: (进程, 服务地址)
+    """
+    env = dict(env)
+    if setup == 'dev':
+        # 当前的启动方式，run.py固定监听5000端口
+        command = [sys.executable, 'run.py']
+        port = 5000
+    else:
+        port = free_port()
+        command = [sys.executable, '-m', 'gunicorn']
+        env.update({
+            'SERVER_WORKER_CLASS': setup,
+            'SERVER_BIND': f'127.0.0.1:{port}',
+            'SERVER_ACCESS_LOG': '',
+            'WEB_CONCURRENCY': str(workers),
+            'SERVER_THREADS': str(threads)
+        })
+
+    # 新的进程组，停止时连同开发服务器的重载子进程和gunicorn工作进程一起结束
+    process = subprocess.Popen(command, cwd=ROOT, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process, f'http://127.0.0.1:{port}'
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def wait_ready(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + '/api/styles', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'Server at {base_url} did not become ready')
+
+
+def run_load(send, concurrency, duration):
+    """
+    多个客户端线程在指定时间内循环发送请求
+    :param send: 发送一次请求的函数，接收requests.Session，返回requests.Response
+    :param concurrency: 并发客户端数量
+    :param duration: 持续时间（秒）
+    :return: (每个请求的(状态码, 耗时秒数, 响应)列表, 实际持续时间)，连接失败时状态码为0、响应为None
+    """
+    results = []
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + duration
+
+    def client():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            request_started = time.monotonic()
+            try:
+                response = send(session)
+                status = response.status_code
+            except requests.RequestException:
+                response = None
+                status = 0
+            with lock:
+                results.append((status, time.monotonic() - request_started, response))
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def latency_summary(latencies_ms):
+    """
+    统计延迟分位数（毫秒）
+    :param latencies_ms: 延迟列表（毫秒）
+    :return: 包含mean、p50、p95、p99和max的字典
+    """
+    if not latencies_ms:
+        return {'mean': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    return {
+        'mean': round(sum(latencies_ms) / len(latencies_ms), 1),
+        'p50': round(percentile(latencies_ms, 0.5), 1),
+        'p95': round(percentile(latencies_ms, 0.95), 1),
+        'p99': round(percentile(latencies_ms, 0.99), 1),
+        'max': round(max(latencies_ms), 1)
+    }
@@ -0,0 +1,99 @@
+"""
+搜索结果页图片提取：流式提取器与BeautifulSoup的解析耗时对比
+
+测试页面保存在benchmarks/fixtures目录中，也可以用--page指定其他保存的结果页。
+
+用法：
+    python benchmarks/parse_search_results.py
+    python benchmarks/parse_search_results.py --limit 5 --repeat 20
+    python benchmarks/parse_search_results.py --page bing:saved_bing.html
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.html_extractor import extract_image_urls
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# 各搜索引擎结果页中图片标签的class
+IMAGE_CLASSES = {
+    'bing': 'mimg',
+    'duckduckgo': 'tile--img__img'
+}
+
+DEFAULT_PAGES = {
+    'bing': os.path.join(FIXTURE_DIR, 'bing_images.html'),
+    'duckduckgo': os.path.join(FIXTURE_DIR, 'duckduckgo_images.html')
+}
+
+
+def extract_with_soup(html, css_class, limit):
+    # 原来的实现：构建完整的文档树后查找img标签
+    soup = BeautifulSoup(html, 'html.parser')
+    urls = []
+    for img in soup.find_all('img', class_=css_class)[:limit]:
+        img_url = img.get('src') or img.get('data-src')
+        if img_url and img_url.startswith('http'):
+            urls.append(img_url)
+    return urls
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='搜索结果页图片提取耗时测试')
+    parser.add_argument('--page', action='append', help='保存的结果页，格式为引擎:路径，可指定多次，默认使用fixtures中的页面')
+    parser.add_argument('--limit', type=int, default=5, help='提取的图片数量')
+    parser.add_argument('--repeat', type=int, default=10, help='重复次数，取最快的一次')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args()
+
+    pages = DEFAULT_PAGES
+    if args.page:
+        pages = dict(page.split(':', 1) for page in args.page)
+
+    report = {'limit': args.limit, 'pages': []}
+    for engine, path in pages.items():
+        with open(path, 'r', encoding='utf-8') as f:
+            html = f.read()
+        css_class = IMAGE_CLASSES[engine]
+
+        soup_urls = extract_with_soup(html, css_class, args.limit)
+        stream_urls = extract_image_urls(html, css_class, args.limit)
+        soup_seconds = measure(lambda: extract_with_soup(html, css_class, args.limit), args.repeat)
+        stream_seconds = measure(lambda: extract_image_urls(html, css_class, args.limit), args.repeat)
+
+        report['pages'].append({
+            'engine': engine,
+            'page': os.path.basename(path),
+            'page_bytes': len(html.encode('utf-8')),
+            'images': len(stream_urls),
+            'same_results': soup_urls == stream_urls,
+            'soup_ms': round(soup_seconds * 1000, 2),
+            'stream_ms': round(stream_seconds * 1000, 2),
+            'speedup': round(soup_seconds / stream_seconds, 1)
+        })
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+不同服务器配置下/api/recommend的吞吐量对比：当前的开发服务器（python run.py）与gunicorn的sync、gthread、async
+
+上游DashScope由本地桩服务代替（固定耗时），关闭分析和生成缓存，每个请求都完整执行分析、建议和生成。
+
+用法：
+    python benchmarks/server_throughput.py
+    python benchmarks/server_throughput.py --setups dev,gthread --concurrency 64 --duration 30 --latency 2
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import requests
+
+from dashscope_stub import start_dashscope_stub
+from loadgen import ROOT, SETUPS, latency_summary, run_load, start_server, state_env, stop_server, wait_ready
+
+
+def summarize(setup, results, elapsed):
+    latencies = [latency * 1000 for status, latency, response in results if status == 200]
+    latency = latency_summary(latencies)
+    return {
+        'setup': setup,
+        'requests': len(results),
+        'errors': len(results) - len(latencies),
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        'p50_ms': latency['p50'],
+        'p95_ms': latency['p95']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务器配置吞吐量对比')
+    parser.add_argument('--setups', default=','.join(SETUPS), help=f'逗号分隔的配置，可选{"、".join(SETUPS)}')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发客户端数量')
+    parser.add_argument('--duration', type=float, default=20, help='每种配置的压测时间（秒）')
+    parser.add_argument('--latency', type=float, default=1.0, help='模拟的DashScope生成耗时（秒）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='gunicorn进程数量')
+    parser.add_argument('--threads', type=int, default=32, help='gthread每个进程的线程数量')
+    parser.add_argument('--image', default=os.path.join(ROOT, 'test_image.jpg'), help='上传的测试图片')
+    parser.add_argument('--style', default='清新', help='风格')
+    parser.add_argument('--output', help='将结果写入JSON文件')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        image_bytes = f.read()
+
+    stub = start_dashscope_stub(latency=args.latency)
+    state_dir = tempfile.TemporaryDirectory(prefix='easy-pose-bench-')
+    env = dict(os.environ)
+    env.update({
+        'DASHSCOPE_API_URL': stub.url('/api/v1'),
+        'DASHSCOPE_API_KEY': 'stub'
+    })
+    # 关闭缓存，每个请求都完整执行；其余运行时文件写入本次运行的临时目录
+    env.update(state_env(state_dir.name, with_cache=False))
+
+    report = {
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'upstream_latency': args.latency,
+        'workers': args.workers,
+        'threads': args.threads,
+        'cpu_count': os.cpu_count(),
+        'results': []
+    }
+    try:
+        for setup in args.setups.split(','):
+            process, base_url = start_server(setup, env, args.workers, args.threads)
+            try:
+                wait_ready(base_url)
+                # 预热：首个请求会初始化SDK和建立连接
+                requests.post(base_url + '/api/recommend', timeout=300,
+                              files={'image': ('scene.jpg', image_bytes, 'image/jpeg')}, data={'style': args.style})
+                results, elapsed = run_load(
+                    lambda session: session.post(base_url + '/api/recommend', timeout=300,
+                                                 files={'image': ('scene.jpg', image_bytes, 'image/jpeg')},
+                                                 data={'style': args.style}),
+                    args.concurrency, args.duration
+                )
+                summary = summarize(setup, results, elapsed)
+            finally:
+                stop_server(process)
+            report['results'].append(summary)
+            print(json.dumps(summary), file=sys.stderr)
+    finally:
+        stub.stop()
+        state_dir.cleanup()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
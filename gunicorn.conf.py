@@ -0,0 +1,54 @@
+"""
+生产环境gunicorn配置，在项目根目录下直接运行gunicorn即可使用
+
+用法：
+    gunicorn                                    # gthread，每个CPU核一个进程
+    SERVER_WORKER_CLASS=async gunicorn          # aiohttp异步服务（app/async_app.py）
+    WEB_CONCURRENCY=4 SERVER_THREADS=64 gunicorn
+
+推荐请求的耗时大部分在等待DashScope返回（数秒到数十秒），只有场景分析和拍摄建议需要CPU：
+- gthread（默认）：进程数等于CPU核数，负责CPU计算；每个进程多个线程，等待上游时不占用CPU，
+  少量线程在做分析时其他线程仍能继续等待上游和接收请求，两类负载互不阻塞
+- sync：每个进程同时只处理一个请求，等待上游期间整个进程空闲，只适合没有AI生成的场景
+- async：每个进程一个事件循环，进行中的请求数量不受线程数限制，CPU计算在进程内的线程池中执行
+"""
+import multiprocessing
+import os
+
+worker_mode = os.environ.get('SERVER_WORKER_CLASS', 'gthread')
+if worker_mode not in ('sync', 'gthread', 'async'):
+    raise ValueError(f'SERVER_WORKER_CLASS must be sync, gthread or async, got {worker_mode}')
+
+bind = os.environ.get('SERVER_BIND', '0.0.0.0:5000')
+
+# 分析是CPU密集型计算，进程数默认等于CPU核数
+cpu_count = multiprocessing.cpu_count()
+workers = int(os.environ.get('WEB_CONCURRENCY', cpu_count))
+
+if worker_mode == 'async':
+    worker_class = 'aiohttp.GunicornWebWorker'
+    wsgi_app = 'app.async_app:create_async_app()'
+    # 每个进程的分析线程数，与进程数相乘不超过CPU核数太多，避免CPU计算互相争抢
+    os.environ.setdefault('ASYNC_ANALYSIS_WORKERS', str(max(1, cpu_count // workers)))
+else:
+    worker_class = worker_mode
+    wsgi_app = 'app:app'
+    # 每个线程大部分时间在等待上游，线程数决定每个进程能同时等待的请求数量
+    threads = int(os.environ.get('SERVER_THREADS', 32)) if worker_mode == 'gthread' else 1
+    # 每个推荐请求在等待上游生成时占用一个流程线程，流程线程数不能少于请求线程数，否则成为瓶颈
+    os.environ.setdefault('PIPELINE_WORKERS', str(threads * 2))
+
+# 在主进程中导入应用后再fork，routes.py中的模块级单例和只读数据以写时复制方式共享
+preload_app = True
+
+# 多个进程时，异步推荐任务的状态必须放在共享存储中，否则查询状态的请求可能落到其他进程
+if workers > 1:
+    os.environ.setdefault('JOB_STORE_PATH', os.path.join('cache', 'jobs.sqlite3'))
+
+# DashScope生成可能需要数十秒，默认30秒会误杀正在等待上游的工作进程
+timeout = int(os.environ.get('SERVER_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# 访问日志输出到标准输出，设置为空字符串时关闭（如压测时）
+accesslog = os.environ.get('SERVER_ACCESS_LOG', '-') or None
@@ -0,0 +1,163 @@
+"""
+离线批量重新分析图片（场景分析 + 拍摄建议），支持断点续跑
+
+用法：
+    python reanalyze.py --input photos/ --style 清新 --output results.jsonl
+    python reanalyze.py --list paths.txt --style 忧郁 --output results.parquet --workers 8
+
+结果逐行写入JSONL文件，该文件同时作为检查点：中断后使用相同参数重新运行，
+已完成的图片会被跳过。输出为.parquet时，先写入<output>.jsonl检查点，全部完成后再转换。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from app.utils.batch_analyzer import BatchAnalyzer
+from app.utils.style_matcher import StyleMatcher
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+
+
+def iter_image_paths(input_dir=None, list_file=None):
+    """
+    列出需要分析的图片路径
+    :param input_dir: 图片目录（递归查找）
+    :param list_file: 每行一个图片路径的列表文件
+    :return: 图片路径生成器
+    """
+    if list_file:
+        with open(list_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                path = line.strip()
+                if path:
+                    yield path
+        return
+
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def load_checkpoint(checkpoint_path, retry_errors=False):
+    """
+    读取检查点文件中已完成的图片，并截掉中断时写了一半的最后一行
+    :param checkpoint_path: JSONL检查点文件路径
+    :param retry_errors: 是否重新分析之前失败的图片
+    :return: 已完成的图片路径集合
+    """
+    done = set()
+    if not os.path.exists(checkpoint_path):
+        return done
+
+    with open(checkpoint_path, 'rb+') as f:
+        data = f.read()
+        valid_length = data.rfind(b'\n') + 1
+        if valid_length != len(data):
+            f.truncate(valid_length)
+
+    for line in data[:valid_length].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if retry_errors and 'error' in record:
+            continue
+        done.add(record['path'])
+    return done
+
+
+def write_parquet(checkpoint_path, output_path):
+    """
+    将JSONL结果转换为Parquet文件（需要安装pyarrow）
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit('输出Parquet需要安装pyarrow：pip install pyarrow')
+
+    records = {}
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            # 重试后同一图片可能有多条记录，保留最后一条
+            records[record['path']] = record
+
+    # 嵌套字段序列化为JSON字符串，避免不同记录的结构不一致
+    rows = [
+        {
+            'path': record['path'],
+            'style': record['style'],
+            'error': record.get('error'),
+            'scene_type': record.get('scene_features', {}).get('scene_type'),
+            'light_type': record.get('scene_features', {}).get('light_type'),
+            'scene_features': json.dumps(record.get('scene_features'), ensure_ascii=False),
+            'advice': json.dumps(record.get('advice'), ensure_ascii=False)
+        }
+        for record in records.values()
+    ]
+    pq.write_table(pa.Table.from_pylist(rows), output_path)
+
+
+def run(args):
+    if args.style not in StyleMatcher().get_available_styles():
+        raise SystemExit(f'未知风格：{args.style}')
+
+    to_parquet = args.output.endswith('.parquet')
+    checkpoint_path = args.output + '.jsonl' if to_parquet else args.output
+    done = load_checkpoint(checkpoint_path, retry_errors=args.retry_errors)
+
+    paths = [path for path in iter_image_paths(args.input, args.list) if path not in done]
+    print(f'已完成{len(done)}张，待分析{len(paths)}张', file=sys.stderr)
+
+    analyzer = BatchAnalyzer(max_workers=args.workers or None, working_size=args.working_size or None)
+    started = time.time()
+    completed = 0
+    errors = 0
+    try:
+        with open(checkpoint_path, 'a', encoding='utf-8') as out:
+            for result in analyzer.imap_unordered((path, path, args.style) for path in paths):
+                result['path'] = result.pop('key')
+                if 'error' in result:
+                    errors += 1
+                out.write(json.dumps(result, ensure_ascii=False, default=float) + '\n')
+                completed += 1
+
+                # 定期刷新到磁盘，崩溃时最多重复分析一个检查点间隔内的图片
+                if completed % args.checkpoint_every == 0:
+                    out.flush()
+                    os.fsync(out.fileno())
+                    rate = completed / max(time.time() - started, 1e-6)
+                    print(f'{completed}/{len(paths)}，{rate:.1f}张/秒，失败{errors}张', file=sys.stderr)
+    finally:
+        analyzer.shutdown()
+
+    if to_parquet:
+        write_parquet(checkpoint_path, args.output)
+
+    print(f'完成：新分析{completed}张，失败{errors}张，结果写入{args.output}', file=sys.stderr)
+    return completed, errors
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='离线批量重新分析图片')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='图片目录（递归查找）')
+    source.add_argument('--list', help='每行一个图片路径的列表文件')
+    parser.add_argument('--style', required=True, help='生成拍摄建议使用的风格')
+    parser.add_argument('--output', required=True, help='结果文件，.jsonl或.parquet')
+    parser.add_argument('--workers', type=int, default=0, help='工作进程数量，默认为CPU核数')
+    # 默认与应用使用相同的工作分辨率，离线结果与在线分析一致
+    parser.add_argument('--working-size', type=int, default=int(os.environ.get('ANALYSIS_WORKING_SIZE', 0)),
+                        help='分析时图片长边的最大像素数，0表示原始分辨率，默认读取ANALYSIS_WORKING_SIZE')
+    parser.add_argument('--checkpoint-every', type=int, default=100, help='每分析多少张图片写一次检查点')
+    parser.add_argument('--retry-errors', action='store_true', help='重新分析之前失败的图片')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())
@@ -0,0 +1,24 @@
+"""
+启动基于asyncio的推荐服务
+
+用法：
+    python run_async.py --port 5001
+"""
+import argparse
+
+from aiohttp import web
+
+from app.async_app import create_async_app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='启动异步推荐服务')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+    parser.add_argument('--port', type=int, default=5001, help='监听端口')
+    parser.add_argument('--analysis-workers', type=int, default=0, help='场景分析线程数量，默认使用配置ASYNC_ANALYSIS_WORKERS')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    web.run_app(create_async_app(analysis_workers=args.analysis_workers), host=args.host, port=args.port)
@@ -0,0 +1,138 @@
+"""
+本地HTTP桩服务器，用于在没有外网的情况下测试搜索和上游API调用
+
+用法：
+    with StubServer() as server:
+        server.add_route('/search', lambda request: (200, {'Content-Type': 'text/html'}, b'<html></html>'))
+        requests.get(server.url('/search'))
+        assert server.requests[0]['path'] == '/search'
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class StubServer:
+    def __init__(self, host='127.0.0.1', port=0, record=True):
+        """
+        :param host: 监听地址
+        :param port: 监听端口，0表示自动选择空闲端口
+        :param record: 是否记录收到的请求，压测时关闭以免占用大量内存
+        """
+        self.record = record
+        self.routes = {}
+        self.requests = []
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def url(self, path):
+        """
+        获取桩服务器上某个路径的完整URL
+        """
+        return self.base_url + path
+
+    def add_route(self, path, handler, method='GET'):
+        """
+        注册路由
+        :param path: 请求路径（不含查询参数）
+        :param handler: 处理函数，接收请求字典，返回(状态码, 响应头字典, 响应体bytes)
+        :param method: 请求方法
+        """
+        self.routes[(method, path)] = handler
+
+    def add_sequence(self, path, responses, method='GET'):
+        """
+        注册按顺序返回的响应，用完后重复最后一个
+        :param responses: (状态码, 响应头字典, 响应体bytes, 延迟秒数)列表
+        """
+        remaining = list(responses)
+        lock = threading.Lock()
+
+        def handler(request):
+            with lock:
+                response = remaining.pop(0) if len(remaining) > 1 else remaining[0]
+            status, headers, body, delay = response
+            if delay:
+                time.sleep(delay)
+            return status, headers, body
+
+        self.add_route(path, handler, method)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _record(self, request):
+        if not self.record:
+            return
+        with self._lock:
+            self.requests.append(request)
+            self.connections.add(request['client_port'])
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self, method):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                request = {
+                    'method': method,
+                    'path': parts.path,
+                    'query': parse_qs(parts.query),
+                    'headers': dict(self.headers),
+                    'body': self.rfile.read(length) if length else b'',
+                    'client_port': self.client_address[1]
+                }
+                server._record(request)
+
+                handler = server.routes.get((method, parts.path))
+                if handler is None:
+                    status, headers, body = 404, {'Content-Type': 'text/plain'}, b'not found'
+                else:
+                    status, headers, body = handler(request)
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,192 @@
+import asyncio
+import base64
+import io
+import threading
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+import requests
+from PIL import Image
+
+from app.utils import ai_image_generator as ai_module
+from app.utils.ai_image_generator import AIImageGenerator, PreparedImage, UploadEncoder, sniff_mime_type
+from app.utils.generation_cache import GenerationCache
+from app.utils.upstream import CircuitBreaker, CircuitOpenError, UpstreamTimeoutError
+
+
+def make_photo(width, height, image_format='JPEG', orientation=None):
+    image = Image.new('RGB', (width, height), (30, 120, 60))
+    image.paste((220, 40, 40), (0, 0, width // 4, height // 4))
+    exif = Image.Exif()
+    exif[271] = 'PhoneMaker'
+    if orientation:
+        exif[274] = orientation
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        image.save(buffer, format='JPEG', quality=95, exif=exif)
+    else:
+        image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+# 测试大图缩小到上限并去除EXIF，方向已应用
+def test_encoder_resizes_and_strips_metadata():
+    original = make_photo(4000, 3000, orientation=6)
+    payload, mime_type = UploadEncoder(max_size=1536, quality=85).encode(original)
+
+    assert mime_type == 'image/jpeg'
+    assert len(payload) < len(original)
+    with Image.open(io.BytesIO(payload)) as encoded:
+        # EXIF方向为6（顺时针旋转90度），编码后为竖图
+        assert encoded.size == (1152, 1536)
+        assert not encoded.getexif()
+
+
+# 测试小图不放大，PNG重新编码后标注为实际的JPEG类型
+def test_encoder_png_to_jpeg():
+    payload, mime_type = UploadEncoder(max_size=1536).encode(make_photo(640, 480, image_format='PNG'))
+    assert mime_type == 'image/jpeg'
+    decoded = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape[:2] == (480, 640)
+
+
+def test_encoder_webp():
+    payload, mime_type = UploadEncoder(max_size=512, image_format='webp').encode(make_photo(2048, 1024))
+    assert mime_type == 'image/webp'
+    assert sniff_mime_type(payload) == 'image/webp'
+    with Image.open(io.BytesIO(payload)) as encoded:
+        assert encoded.size == (512, 256)
+
+
+# 测试无法解码的格式原样上传并按文件头标注类型
+def test_encoder_undecodable_keeps_original():
+    heic = b'\x00\x00\x00\x18ftypheic' + b'\x00' * 64
+    assert UploadEncoder().encode(heic) == (heic, 'image/heic')
+    png = make_photo(64, 64, image_format='PNG')
+    assert UploadEncoder(image_format='original').encode(png) == (png, 'image/png')
+
+
+# 测试data URL使用重新编码后的数据和类型，哈希基于上传的数据
+def test_prepared_image_data_url():
+    original = make_photo(3000, 2000, image_format='PNG')
+    prepared = AIImageGenerator(encoder=UploadEncoder(max_size=1024)).prepare_image(original).encode()
+
+    assert prepared.data is original
+    prefix = 'data:image/jpeg;base64,'
+    assert prepared.data_url.startswith(prefix)
+    assert base64.b64decode(prepared.data_url[len(prefix):]) == prepared.payload
+    assert prepared.sha256 != PreparedImage(original).sha256
+    # 生成data URL后不再保留编码后的字节数据
+    assert prepared._payload is None
+    # 缓存键的哈希由原始图片和编码参数决定，参数不同时不复用
+    assert prepared.sha256 == AIImageGenerator(encoder=UploadEncoder(max_size=1024)).prepare_hashed(original).sha256
+    assert prepared.sha256 != AIImageGenerator(encoder=UploadEncoder(max_size=768)).prepare_hashed(original).sha256
+
+
+SCENE_FEATURES = {'scene_type': 'nature', 'light_type': 'soft', 'colors': {'dominant_color': 'green'}}
+
+
+# 测试请求剩余时间作为DashScope的超时时间，超时后转换为UpstreamTimeoutError并计入熔断
+def test_generator_deadline_and_breaker(monkeypatch):
+    calls = []
+
+    def timeout_call(**kwargs):
+        calls.append(kwargs)
+        raise requests.ReadTimeout('read timed out')
+
+    monkeypatch.setattr(ai_module.MultiModalConversation, 'call', timeout_call)
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+    generator = AIImageGenerator(breaker=breaker)
+    image = make_photo(64, 64)
+
+    for _ in range(2):
+        with pytest.raises(UpstreamTimeoutError):
+            generator.generate_images_from_image(image, SCENE_FEATURES, '清新', deadline=time.monotonic() + 5)
+    assert 4 < calls[0]['request_timeout'] <= 5
+
+    # 熔断后不再调用DashScope
+    with pytest.raises(CircuitOpenError):
+        generator.generate_images_from_image(image, SCENE_FEATURES, '清新')
+    assert len(calls) == 2
+
+
+# 测试截止时间已过或等待上游时被取消的请求不占用半开状态下的试探机会
+def test_generator_releases_unused_trial(monkeypatch):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    generator = AIImageGenerator(breaker=breaker)
+    image = make_photo(64, 64)
+
+    with pytest.raises(UpstreamTimeoutError):
+        generator.generate_images_from_image(image, SCENE_FEATURES, '清新', deadline=time.monotonic() - 1)
+    breaker.release_trial(breaker.before_call())
+
+    async def slow_call(image, prompt, num_images=3, timeout=None):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(generator, '_call_dashscope_api_async', slow_call)
+
+    async def cancelled():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(generator.generate_images_from_image_async(image, SCENE_FEATURES, '清新'), 0.05)
+
+    asyncio.run(cancelled())
+    assert breaker.state == 'half_open'
+    breaker.before_call()
+
+
+# 测试参数错误等状态码不触发熔断
+def test_generator_client_error_keeps_breaker_closed(monkeypatch):
+    response = SimpleNamespace(status_code=400, code='InvalidParameter', message='bad', request_id='stub')
+    monkeypatch.setattr(ai_module.MultiModalConversation, 'call', lambda **kwargs: response)
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    generator = AIImageGenerator(breaker=breaker)
+    assert generator.generate_images_from_image(make_photo(64, 64), SCENE_FEATURES, '清新') == []
+    assert breaker.state == 'closed'
+
+
+# 测试异步生成时图片编码和缓存读写都在线程池中执行，不阻塞事件循环
+def test_generate_async_keeps_blocking_work_off_loop(monkeypatch):
+    generator = AIImageGenerator(cache=GenerationCache(':memory:'), encoder=UploadEncoder(max_size=32))
+    blocking_threads = []
+
+    def record(func):
+        def wrapper(*args, **kwargs):
+            blocking_threads.append(threading.current_thread())
+            return func(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(generator.encoder, 'encode', record(generator.encoder.encode))
+    monkeypatch.setattr(generator.cache, 'get', record(generator.cache.get))
+    monkeypatch.setattr(generator.cache, 'put', record(generator.cache.put))
+
+    async def fake_call(image, prompt, num_images=3, timeout=None):
+        return [{'url': 'http://example.com/ai.jpg'}]
+
+    monkeypatch.setattr(generator, '_call_dashscope_api_async', fake_call)
+
+    images = asyncio.run(generator.generate_images_from_image_async(make_photo(64, 64), SCENE_FEATURES, '清新'))
+    assert images == [{'url': 'http://example.com/ai.jpg'}]
+    assert len(blocking_threads) == 3
+    assert threading.main_thread() not in blocking_threads
+
+
+# 测试命中生成缓存时不解码和重新编码图片，未命中时只编码一次
+def test_cache_hit_skips_encoding(monkeypatch):
+    generator = AIImageGenerator(cache=GenerationCache(':memory:'), encoder=UploadEncoder(max_size=32))
+    encoded = []
+    encode = generator.encoder.encode
+    monkeypatch.setattr(generator.encoder, 'encode', lambda data: encoded.append(1) or encode(data))
+    monkeypatch.setattr(generator, '_call_dashscope_api',
+                        lambda image, prompt, num_images=3, timeout=None: [{'url': image.data_url[:32]}])
+
+    image = make_photo(64, 64)
+    first = generator.generate_images_from_image(generator.prepare_hashed(image), SCENE_FEATURES, '清新')
+    assert len(encoded) == 1
+    second = generator.generate_images_from_image(generator.prepare_hashed(image), SCENE_FEATURES, '清新')
+    assert second == first
+    assert len(encoded) == 1
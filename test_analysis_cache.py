@@ -0,0 +1,102 @@
+import os
+
+from app.utils.analysis_cache import AnalysisCache
+from app.utils.image_analyzer import ImageAnalyzer
+
+TEST_IMAGE_PATH = 'test_image.jpg'
+
+
+# 计数的分析函数，用于判断是否真正执行了分析
+class CountingAnalyzer:
+    def __init__(self):
+        self.calls = 0
+
+    def analyze_bytes(self, image_bytes):
+        self.calls += 1
+        return {'scene_type': 'nature', 'size': len(image_bytes), 'colors': {'hue_mean': 1.5}}
+
+
+# 测试相同图片只分析一次
+def test_cache_hit_skips_analysis():
+    cache = AnalysisCache(max_entries=4)
+    analyzer = CountingAnalyzer()
+    first = cache.get_or_compute(b'image-a', analyzer.analyze_bytes)
+    second = cache.get_or_compute(b'image-a', analyzer.analyze_bytes)
+    assert first == second
+    assert analyzer.calls == 1
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+
+# 测试返回的是副本，修改结果不会影响缓存
+def test_cache_returns_copy():
+    cache = AnalysisCache(max_entries=4)
+    analyzer = CountingAnalyzer()
+    cache.get_or_compute(b'image-a', analyzer.analyze_bytes)['colors']['hue_mean'] = 99
+    assert cache.get_or_compute(b'image-a', analyzer.analyze_bytes)['colors']['hue_mean'] == 1.5
+
+
+# 测试LRU淘汰最久未使用的条目
+def test_lru_eviction():
+    cache = AnalysisCache(max_entries=2)
+    analyzer = CountingAnalyzer()
+    cache.get_or_compute(b'a', analyzer.analyze_bytes)
+    cache.get_or_compute(b'b', analyzer.analyze_bytes)
+    cache.get_or_compute(b'a', analyzer.analyze_bytes)
+    cache.get_or_compute(b'c', analyzer.analyze_bytes)
+    assert cache.stats()['entries'] == 2
+    assert cache.get(cache.make_key(b'a')) is not None
+    assert cache.get(cache.make_key(b'b')) is None
+
+
+# 测试磁盘缓存在内存缓存清空后仍然可用
+def test_disk_tier(tmp_path):
+    analyzer = CountingAnalyzer()
+    cache = AnalysisCache(max_entries=1, cache_dir=str(tmp_path))
+    cache.get_or_compute(b'a', analyzer.analyze_bytes)
+    cache.get_or_compute(b'b', analyzer.analyze_bytes)
+
+    # 新的缓存实例（如进程重启）从磁盘读取
+    restarted = AnalysisCache(max_entries=1, cache_dir=str(tmp_path))
+    result = restarted.get_or_compute(b'a', analyzer.analyze_bytes)
+    assert result['size'] == 1
+    assert analyzer.calls == 2
+    assert restarted.stats()['disk_hits'] == 1
+
+
+# 测试不同命名空间的结果互不影响
+def test_namespace_separates_keys():
+    cache_a = AnalysisCache(namespace='w1024-')
+    cache_b = AnalysisCache(namespace='w0-')
+    assert cache_a.make_key(b'a') != cache_b.make_key(b'a')
+
+
+# 测试磁盘缓存读取的结果与分析结果完全一致，元组（如image_size）不会变成列表
+def test_disk_tier_preserves_tuples(tmp_path):
+    result = ImageAnalyzer().analyze(TEST_IMAGE_PATH)
+    cache = AnalysisCache(max_entries=0, cache_dir=str(tmp_path))
+    key = cache.make_key(b'scene')
+    cache.put(key, result)
+
+    cached = cache.get(key)
+    assert cached == result
+    assert isinstance(cached['image_size'], tuple)
+    assert cache.stats()['disk_hits'] == 1
+
+
+# 测试磁盘缓存超过文件数量上限时删除最早写入的文件
+def test_disk_tier_max_files(tmp_path):
+    analyzer = CountingAnalyzer()
+    cache = AnalysisCache(max_entries=0, cache_dir=str(tmp_path), max_files=10)
+    for index in range(12):
+        key = cache.make_key(b'image-%d' % index)
+        cache.put(key, analyzer.analyze_bytes(b'x' * index))
+        os.utime(cache._disk_path(key), (index, index))
+
+    files = [name for _, _, names in os.walk(tmp_path) for name in names]
+    assert len(files) <= 10
+    # 清理到上限的90%，最早写入的文件先被删除
+    assert cache.get(cache.make_key(b'image-0')) is None
+    assert cache.get(cache.make_key(b'image-11')) is not None
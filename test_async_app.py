@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+
+from app import routes
+from app.async_app import create_async_app
+from app.utils.generation_cache import GenerationCache
+from stub_server import StubServer
+from test_image_searcher import BING_PAGE, DUCKDUCKGO_PAGE, HTML, make_searcher
+
+TEST_IMAGE_PATH = 'test_image.jpg'
+
+
+# 替换异步AI生成步骤，模拟耗时的上游调用
+def stub_async_generator(monkeypatch, delay=0.0):
+    calls = []
+
+    async def fake_call(image, prompt, num_images=3, timeout=None):
+        calls.append(image.data)
+        await asyncio.sleep(delay)
+        return [{'url': 'http://example.com/ai.jpg', 'thumbnail': 'http://example.com/ai.jpg',
+                 'source': 'aliyun_qwen', 'photographer': 'stub', 'prompt': prompt}]
+
+    monkeypatch.setattr(routes.ai_image_generator, '_call_dashscope_api_async', fake_call)
+    monkeypatch.setattr(routes.ai_image_generator, 'cache', GenerationCache(':memory:'))
+    monkeypatch.setattr(routes.ai_image_generator, 'store', None)
+    return calls
+
+
+def run_with_client(check, analysis_workers=2):
+    async def main():
+        async with TestClient(TestServer(create_async_app(analysis_workers=analysis_workers))) as client:
+            return await check(client)
+    return asyncio.run(main())
+
+
+def recommend_form(style='生命力'):
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+    data = aiohttp.FormData()
+    data.add_field('image', image_bytes, filename='scene.jpg', content_type='image/jpeg')
+    data.add_field('style', style)
+    return data
+
+
+# 测试异步推荐接口的返回结果与Flask接口一致
+def test_async_recommend(monkeypatch):
+    calls = stub_async_generator(monkeypatch)
+
+    async def check(client):
+        response = await client.post('/api/recommend', data=recommend_form())
+        assert response.status == 200
+        return await response.json()
+
+    data = run_with_client(check)
+    assert data['scene_features']['scene_type'] == 'nature'
+    assert len(data['ai_reference_images']) == 1
+    assert {'prepare', 'analyze', 'match', 'generate', 'advice', 'total'} <= set(data['timings'])
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        assert calls == [f.read()]
+
+
+# 测试等待上游时不占用线程：并发请求数远大于线程数时总耗时接近单次上游耗时
+def test_async_recommend_concurrency(monkeypatch):
+    stub_async_generator(monkeypatch, delay=0.5)
+
+    async def check(client):
+        responses = await asyncio.gather(*[
+            client.post('/api/recommend', data=recommend_form()) for _ in range(20)
+        ])
+        return [response.status for response in responses]
+
+    started = time.monotonic()
+    statuses = run_with_client(check, analysis_workers=1)
+    elapsed = time.monotonic() - started
+    assert statuses == [200] * 20
+    assert elapsed < 0.5 * 20 / 4
+
+
+# 测试缺少参数时返回400
+def test_async_recommend_missing_style(monkeypatch):
+    stub_async_generator(monkeypatch)
+
+    async def check(client):
+        response = await client.post('/api/recommend', data=aiohttp.FormData({'style': '生命力'}))
+        return response.status
+
+    assert run_with_client(check) == 400
+
+
+# 测试异步搜索接口使用aiohttp请求搜索引擎
+def test_async_search(monkeypatch):
+    with StubServer() as server:
+        server.add_sequence('/bing/images/search', [(200, HTML, BING_PAGE, 0)])
+        searcher = make_searcher(server)
+        searcher.search_engines = searcher.search_engines[:1]
+        monkeypatch.setattr('app.async_app.image_searcher', searcher)
+
+        async def check(client):
+            response = await client.get('/api/search', params={
+                'scene_type': 'nature', 'light_type': 'bright', 'dominant_color': 'fresh', 'style': '清新'
+            })
+            assert response.status == 200
+            return await response.json()
+
+        data = run_with_client(check)
+        assert [image['url'] for image in data['images']] == ['http://img.example.com/b1.jpg',
+                                                              'http://img.example.com/b2.jpg']
+        assert 'nature' in server.requests[0]['query']['q'][0]
+
+
+# 测试异步并发搜索在慢的来源返回前就收集到足够结果
+def test_async_hedged_search():
+    with StubServer() as server:
+        server.add_sequence('/bing/images/search', [(200, HTML, BING_PAGE, 1.5)])
+        server.add_sequence('/duckduckgo/', [(200, HTML, DUCKDUCKGO_PAGE, 0)])
+        searcher = make_searcher(server)
+        searcher.hedged = True
+
+        async def main():
+            try:
+                return await searcher.search_images_async(['nature'], limit=1)
+            finally:
+                await searcher.aclose()
+
+        images = asyncio.run(main())
+        assert [image['source'] for image in images] == ['duckduckgo']
+
+
+# 测试异步服务导出与Flask应用相同名称的指标
+def test_async_metrics(monkeypatch):
+    stub_async_generator(monkeypatch)
+
+    async def check(client):
+        assert (await client.post('/api/recommend', data=recommend_form())).status == 200
+        assert (await client.get('/api/missing')).status == 404
+        response = await client.get('/metrics')
+        assert response.status == 200
+        return await response.text()
+
+    text = run_with_client(check)
+    assert 'easy_pose_recommend_stage_duration_seconds_count{stage="save"}' in text
+    assert 'easy_pose_http_requests_total{endpoint="recommend_pose",method="POST",status="200"}' in text
+    assert 'easy_pose_http_requests_total{endpoint="unmatched",method="GET",status="404"}' in text
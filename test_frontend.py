@@ -0,0 +1,142 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from app import app
+from test_routes import TEST_IMAGE_PATH, post_recommend, stub_generator
+
+MAIN_JS = os.path.join('app', 'static', 'js', 'main.js')
+
+# 在Node中用最简单的DOM替身执行main.js，按响应数据渲染结果后输出AI参考图片区域的内容
+HARNESS = r"""
+const fs = require('fs');
+const vm = require('vm');
+
+class Element {
+    constructor() {
+        this.children = [];
+        this.style = {};
+        this.classList = { add() {}, remove() {} };
+        this._html = '';
+    }
+    set innerHTML(value) { this._html = value; this.children = []; }
+    get innerHTML() { return this._html; }
+    set textContent(value) { this._html = value; }
+    appendChild(child) { this.children.push(child); return child; }
+    querySelector() { return new Element(); }
+    addEventListener() {}
+    click() {}
+}
+
+const elements = {};
+const document = {
+    getElementById(id) { return elements[id] || (elements[id] = new Element()); },
+    createElement() { return new Element(); },
+    querySelectorAll() { return []; },
+    addEventListener() {}
+};
+
+const [mode, mainJs] = process.argv.slice(1);
+const payload = fs.readFileSync(0, 'utf8');
+const encoder = new TextEncoder();
+const context = {
+    document, console, TextDecoder, ReadableStream, setTimeout,
+    alert(message) { throw new Error('alert: ' + message); },
+    bootstrap: { Modal: { getOrCreateInstance() { return { show() {} }; } } },
+    fetch: async () => ({
+        ok: true,
+        json: async () => JSON.parse(payload),
+        // 按固定大小切分响应，模拟一次读取只得到半行的情况
+        body: new ReadableStream({
+            start(controller) {
+                const bytes = encoder.encode(payload);
+                for (let i = 0; i < bytes.length; i += 97) {
+                    controller.enqueue(bytes.slice(i, i + 97));
+                }
+                controller.close();
+            }
+        })
+    })
+};
+context.window = context;
+vm.createContext(context);
+vm.runInContext(fs.readFileSync(mainJs, 'utf8'), context);
+
+(async () => {
+    if (mode === 'stream') {
+        await vm.runInContext('streamRecommendations({})', context);
+    } else {
+        vm.runInContext('displayResults', context)(JSON.parse(payload));
+    }
+    const grid = document.getElementById('ai-image-grid');
+    console.log(JSON.stringify({
+        images: grid.children.map(child => child.innerHTML),
+        html: grid.innerHTML,
+        advice: document.getElementById('advice-list').children.length
+    }));
+})().catch(error => { console.error(error); process.exit(1); });
+"""
+
+
+def run_main_js(mode, payload):
+    """
+    :param mode: stream表示读取流式响应，json表示直接渲染推荐结果
+    :param payload: 模拟的响应内容
+    :return: AI参考图片区域的内容
+    """
+    result = subprocess.run(
+        ['node', '-e', HARNESS, '--', mode, MAIN_JS],
+        input=payload, capture_output=True, text=True, timeout=30
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout)
+
+
+pytestmark = pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+
+
+# 测试页面读取流式推荐响应，逐张显示AI参考图片
+def test_stream_renders_images(monkeypatch):
+    stub_generator(monkeypatch)
+    client = app.test_client()
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = {'image': (io.BytesIO(f.read()), 'scene.jpg'), 'style': '清新'}
+    body = client.post('/api/recommend/stream', data=data, content_type='multipart/form-data').get_data(as_text=True)
+
+    rendered = run_main_js('stream', body)
+    assert len(rendered['images']) == 3
+    assert all('http://example.com/ai.jpg' in image for image in rendered['images'])
+    assert rendered['advice'] > 0
+
+
+# 测试页面渲染/api/recommend返回的完整结果
+def test_json_renders_images(monkeypatch):
+    stub_generator(monkeypatch)
+    body = post_recommend(app.test_client()).get_data(as_text=True)
+
+    rendered = run_main_js('json', body)
+    assert len(rendered['images']) == 1
+    assert rendered['advice'] > 0
+
+
+# 测试没有AI参考图片时显示提示信息
+def test_json_renders_empty_message():
+    result = {
+        'style': '清新',
+        'scene_features': {
+            'scene_type': 'nature', 'light_type': 'soft', 'colors': {'dominant_color': 'green'},
+            'scene_description': '', 'scene_elements': [], 'detailed_analysis': {
+                'scene_summary': '', 'lighting_summary': '', 'color_summary': '', 'composition_summary': ''
+            }
+        },
+        'advice': {'pose': '自然站立', 'angle': '平视', 'position': '居中', 'lighting': '顺光', 'composition': '三分法'},
+        'ai_reference_images': [],
+        'ai_error': {'code': 'upstream_busy'}
+    }
+    rendered = run_main_js('json', json.dumps(result))
+    assert rendered['images'] == []
+    assert 'AI生成服务繁忙' in rendered['html']
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from app.utils.ai_image_generator import AIImageGenerator
+from app.utils.generation_cache import GenerationCache
+from app.utils.image_store import ImageStore
+from app.utils.upstream import UpstreamTimeoutError
+
+SCENE_FEATURES = {
+    'scene_type': 'nature',
+    'light_type': 'soft',
+    'colors': {'dominant_color': 'warm'},
+    'scene_description': '柔和温暖的自然场景'
+}
+
+
+# 记录调用次数的生成器，替代真实的DashScope调用
+def make_generator(cache, delay=0.0):
+    generator = AIImageGenerator(cache=cache)
+    calls = []
+
+    def fake_call(image, prompt, num_images=3, timeout=None):
+        calls.append((image, prompt, num_images))
+        time.sleep(delay)
+        return [{'url': f'http://example.com/{len(calls)}.png', 'prompt': prompt}]
+
+    generator._call_dashscope_api = fake_call
+
+    async def fake_call_async(image, prompt, num_images=3, timeout=None):
+        calls.append((image, prompt, num_images))
+        await asyncio.sleep(delay)
+        return [{'url': f'http://example.com/{len(calls)}.png', 'prompt': prompt}]
+
+    generator._call_dashscope_api_async = fake_call_async
+    return generator, calls
+
+
+# 测试相同的图片、风格和数量复用缓存结果
+def test_repeated_request_hits_cache():
+    generator, calls = make_generator(GenerationCache(':memory:'))
+    first = generator.generate_images_from_image(b'image', SCENE_FEATURES, '清新', num_images=3)
+    second = generator.generate_images_from_image(b'image', SCENE_FEATURES, '清新', num_images=3)
+    assert first == second
+    assert len(calls) == 1
+
+    # 风格、数量或图片不同时重新生成
+    generator.generate_images_from_image(b'image', SCENE_FEATURES, '甜美', num_images=3)
+    generator.generate_images_from_image(b'image', SCENE_FEATURES, '清新', num_images=1)
+    generator.generate_images_from_image(b'other', SCENE_FEATURES, '清新', num_images=3)
+    assert len(calls) == 4
+
+
+# 测试空结果（生成失败）不写入缓存
+def test_empty_result_not_cached():
+    cache = GenerationCache(':memory:')
+    calls = []
+    key = cache.make_key(b'image', 'prompt', 'model', 3)
+
+    def generate():
+        calls.append(1)
+        return []
+
+    assert cache.get_or_generate(key, generate) == []
+    assert cache.get_or_generate(key, generate) == []
+    assert len(calls) == 2
+
+
+# 测试过期结果重新生成
+def test_ttl_expiry():
+    cache = GenerationCache(':memory:', ttl=0.05)
+    key = cache.make_key(b'image', 'prompt', 'model', 3)
+    cache.put(key, [{'url': 'a'}])
+    assert cache.get(key) == [{'url': 'a'}]
+    time.sleep(0.1)
+    assert cache.get(key) is None
+    assert cache.stats()['expired'] == 1
+
+
+# 测试超出数量时淘汰最久未使用的结果
+def test_size_eviction():
+    cache = GenerationCache(':memory:', max_entries=2)
+    cache.put('a', [1])
+    time.sleep(0.01)
+    cache.put('b', [2])
+    time.sleep(0.01)
+    cache.get('a')
+    time.sleep(0.01)
+    cache.put('c', [3])
+    assert cache.get('b') is None
+    assert cache.get('a') == [1]
+    assert cache.stats()['evictions'] == 1
+
+
+# 测试结果在进程重启后仍然可用
+def test_persistent(tmp_path):
+    path = str(tmp_path / 'generation.sqlite3')
+    GenerationCache(path).put('a', [{'url': 'a'}])
+    assert GenerationCache(path).get('a') == [{'url': 'a'}]
+
+
+# 测试并发的相同请求只调用一次上游API
+def test_concurrent_requests_collapse():
+    cache = GenerationCache(':memory:')
+    generator, calls = make_generator(cache, delay=0.2)
+    results = []
+
+    def worker():
+        results.append(generator.generate_images_from_image(b'image', SCENE_FEATURES, '清新'))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 8
+    assert all(result == results[0] for result in results)
+    assert cache.stats()['collapsed'] + cache.stats()['hits'] == 7
+
+
+# 测试合并到其他请求的请求按自己的截止时间放弃等待，正在进行的生成不受影响
+def test_collapsed_request_honours_deadline():
+    cache = GenerationCache(':memory:')
+    generator, calls = make_generator(cache, delay=0.5)
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(generator.generate_images_from_image(b'image', SCENE_FEATURES, '清新'))
+    )
+    leader.start()
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    with pytest.raises(UpstreamTimeoutError):
+        generator.generate_images_from_image(b'image', SCENE_FEATURES, '清新', deadline=time.monotonic() + 0.1)
+    assert time.monotonic() - started < 0.4
+
+    leader.join()
+    assert len(calls) == 1
+    assert results and results[0]
+    assert cache.stats()['collapsed'] == 1
+
+
+# 测试异步版本同样合并并发的相同请求
+def test_concurrent_async_requests_collapse():
+    cache = GenerationCache(':memory:')
+    generator, calls = make_generator(cache, delay=0.2)
+
+    async def burst():
+        return await asyncio.gather(*[
+            generator.generate_images_from_image_async(b'image', SCENE_FEATURES, '清新') for _ in range(8)
+        ])
+
+    results = asyncio.run(burst())
+
+    assert len(calls) == 1
+    assert results[0]
+    assert all(result == results[0] for result in results)
+    assert cache.stats()['collapsed'] == 7
+    assert cache.stats()['misses'] == 1
+
+
+# 测试异步请求等待相同调用时按自己的截止时间放弃，正在进行的生成不受影响
+def test_collapsed_async_request_honours_deadline():
+    cache = GenerationCache(':memory:')
+    generator, calls = make_generator(cache, delay=0.5)
+
+    async def scenario():
+        leader = asyncio.ensure_future(generator.generate_images_from_image_async(b'image', SCENE_FEATURES, '清新'))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        with pytest.raises(UpstreamTimeoutError):
+            await generator.generate_images_from_image_async(
+                b'image', SCENE_FEATURES, '清新', deadline=time.monotonic() + 0.1
+            )
+        assert time.monotonic() - started < 0.4
+        return await leader
+
+    assert asyncio.run(scenario())
+    assert len(calls) == 1
+    assert cache.stats()['collapsed'] == 1
+
+
+# 测试fork出的子进程重新打开数据库连接，并能读到父进程写入的结果
+def test_reopens_connection_after_fork(tmp_path):
+    cache = GenerationCache(str(tmp_path / 'generation.sqlite3'))
+    cache.put('key', [{'url': 'http://example.com/a.jpg'}])
+    parent_connection = cache._conn
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        ok = cache._conn is not parent_connection and cache.get('key') == [{'url': 'http://example.com/a.jpg'}]
+        os.write(write_fd, b'1' if ok else b'0')
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 1) == b'1'
+    assert cache._conn is parent_connection
+
+
+# 测试配置图片存储后，未保存到本地或本地文件已删除的结果重新生成
+def test_image_store_backs_cache(tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path / 'images'))
+    with open('test_image.jpg', 'rb') as f:
+        data = f.read()
+    monkeypatch.setattr(store, '_fetch', lambda url: data)
+    cache = GenerationCache(':memory:', image_store=store)
+    generator, calls = make_generator(cache)
+    generator.store = store
+
+    first = generator.generate_images_from_image(b'image', SCENE_FEATURES, '清新')
+    assert first[0]['url'].startswith('/media/')
+    assert generator.generate_images_from_image(b'image', SCENE_FEATURES, '清新') == first
+    assert len(calls) == 1
+
+    for name in os.listdir(tmp_path / 'images'):
+        os.remove(tmp_path / 'images' / name)
+    generator.generate_images_from_image(b'image', SCENE_FEATURES, '清新')
+    assert len(calls) == 2
+    assert cache.stats()['missing'] == 1
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from app.utils.http_client import HttpClient, DeadlineExceeded
+from stub_server import StubServer
+
+OK = (200, {'Content-Type': 'text/plain'}, b'ok', 0)
+UNAVAILABLE = (503, {'Content-Type': 'text/plain'}, b'busy', 0)
+
+
+# 测试多次请求复用同一个连接
+def test_keep_alive_reuses_connection():
+    with StubServer() as server:
+        server.add_sequence('/ping', [OK])
+        client = HttpClient()
+        for _ in range(5):
+            assert client.get(server.url('/ping')).text == 'ok'
+        assert len(server.requests) == 5
+        assert len(server.connections) == 1
+        client.close()
+
+
+# 测试可重试的状态码会退避重试
+def test_retry_on_unavailable():
+    with StubServer() as server:
+        server.add_sequence('/flaky', [UNAVAILABLE, UNAVAILABLE, OK])
+        client = HttpClient(max_retries=2, backoff_factor=0.01)
+        response = client.get(server.url('/flaky'))
+        assert response.status_code == 200
+        assert client.stats() == {'requests': 3, 'retries': 2, 'failures': 0}
+
+
+# 测试重试用尽后返回最后一次的响应
+def test_retries_exhausted_returns_response():
+    with StubServer() as server:
+        server.add_sequence('/down', [UNAVAILABLE])
+        client = HttpClient(max_retries=1, backoff_factor=0.01)
+        assert client.get(server.url('/down')).status_code == 503
+        assert len(server.requests) == 2
+
+
+# 测试慢响应不会超过截止时间
+def test_deadline_bounds_slow_upstream():
+    with StubServer() as server:
+        server.add_sequence('/slow', [(200, {}, b'late', 1.0)])
+        client = HttpClient(max_retries=5, backoff_factor=0.01)
+        started = time.monotonic()
+        with pytest.raises((DeadlineExceeded, Exception)):
+            client.get(server.url('/slow'), deadline=0.3)
+        assert time.monotonic() - started < 0.9
+        assert client.stats()['failures'] == 1
+
+
+# 测试连接池的连接都在使用中时，新的请求不等待空闲连接，仍然遵守截止时间
+def test_saturated_pool_does_not_wait():
+    with StubServer() as server:
+        server.add_sequence('/slow', [(200, {}, b'late', 1.5)])
+        server.add_sequence('/ping', [OK])
+        client = HttpClient(pool_maxsize=1, max_retries=0)
+        busy = threading.Thread(target=client.get, args=(server.url('/slow'),))
+        busy.start()
+        time.sleep(0.2)
+
+        started = time.monotonic()
+        assert client.get(server.url('/ping'), deadline=1).text == 'ok'
+        assert time.monotonic() - started < 0.5
+        busy.join()
+        client.close()
+
+
+# 测试连接失败时重试并抛出异常
+def test_connection_error():
+    client = HttpClient(max_retries=1, backoff_factor=0.01)
+    server = StubServer()
+    url = server.url('/closed')
+    server.stop()
+    with pytest.raises(Exception):
+        client.get(url, deadline=2)
+    assert client.stats()['retries'] == 1
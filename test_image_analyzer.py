@@ -0,0 +1,264 @@
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+from app.utils.image_analyzer import ImageAnalyzer
+
+TEST_IMAGE_PATH = 'test_image.jpg'
+
+
+# 生成一组确定性的参考图片，覆盖不同的场景、光线和色调分支
+def make_reference_images():
+    rng = np.random.default_rng(2024)
+    images = {}
+
+    # 纯白图片（与test_image.jpg一致）
+    images['white'] = np.full((400, 600, 3), 255, dtype=np.uint8)
+
+    # 绿色植被 + 蓝天（自然场景）
+    nature = np.zeros((480, 640, 3), dtype=np.uint8)
+    nature[:200] = (230, 180, 120)
+    nature[200:] = (60, 170, 70)
+    images['nature'] = cv2.GaussianBlur(nature, (31, 31), 0)
+
+    # 偏蓝的海面（海滩/户外场景）
+    beach = np.zeros((360, 640, 3), dtype=np.uint8)
+    beach[:] = (200, 120, 40)
+    beach[240:] = (170, 190, 210)
+    images['beach'] = beach
+
+    # 偏红的砖墙纹理（城市场景）
+    city = np.zeros((512, 512, 3), dtype=np.uint8)
+    city[:] = (50, 60, 150)
+    for y in range(0, 512, 16):
+        city[y:y + 2] = (200, 200, 200)
+    for x in range(0, 512, 32):
+        city[:, x:x + 2] = (200, 200, 200)
+    images['city'] = city
+
+    # 昏暗的室内噪声图片
+    images['dim'] = rng.integers(0, 60, size=(300, 400, 3), dtype=np.uint8)
+
+    # 高对比度的黑白条纹
+    stripes = np.zeros((400, 400, 3), dtype=np.uint8)
+    stripes[:, ::40] = 255
+    stripes = cv2.dilate(stripes, np.ones((1, 20), np.uint8))
+    images['stripes'] = stripes
+
+    # 紫色渐变
+    gradient = np.zeros((300, 500, 3), dtype=np.uint8)
+    gradient[:, :, 0] = np.linspace(120, 255, 500, dtype=np.uint8)
+    gradient[:, :, 2] = np.linspace(100, 220, 500, dtype=np.uint8)
+    images['purple'] = gradient
+
+    # 块状随机纹理（高频细节）
+    images['texture'] = rng.integers(0, 256, size=(96, 128, 3), dtype=np.uint8)
+
+    return images
+
+
+# 将参考图片放大为高分辨率JPEG文件，模拟手机拍摄的大图
+def write_large_reference_images(directory, size=(3200, 2400)):
+    paths = {}
+    for name, image in make_reference_images().items():
+        # 纹理类图片保持锐利边缘，其余图片平滑放大
+        interpolation = cv2.INTER_NEAREST if name in ('city', 'stripes', 'texture') else cv2.INTER_LINEAR
+        large = cv2.resize(image, size, interpolation=interpolation)
+        path = os.path.join(directory, f'{name}.jpg')
+        cv2.imwrite(path, large, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        paths[name] = path
+    return paths
+
+
+# 生成原始分辨率下的高复杂度和细纹理图片，细节接近或小于缩小后的像素，检验缩小分析时的复杂度判断
+def write_textured_reference_images(directory, size=(3200, 2400)):
+    rng = np.random.default_rng(7)
+    width, height = size
+    images = {}
+
+    # 像素级噪点：缩小后几乎完全被平均掉
+    images['noise'] = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+    # 3像素左右的颗粒纹理
+    grain = rng.integers(0, 256, size=(height // 3, width // 3, 3), dtype=np.uint8)
+    images['grain'] = cv2.resize(grain, size, interpolation=cv2.INTER_LINEAR)
+
+    # 类似树叶的高对比度模糊噪点
+    foliage = cv2.GaussianBlur(rng.integers(0, 256, size=(height, width)).astype(np.float32), (0, 0), 1.5)
+    foliage = np.clip((foliage - foliage.mean()) * 6 + 128, 0, 255).astype(np.uint8)
+    images['foliage'] = cv2.cvtColor(foliage, cv2.COLOR_GRAY2BGR)
+
+    # 6像素的棋盘格
+    rows, cols = np.mgrid[0:height, 0:width]
+    checker = ((rows // 6 + cols // 6) % 2 * 255).astype(np.uint8)
+    images['checker'] = cv2.cvtColor(checker, cv2.COLOR_GRAY2BGR)
+
+    # 大量2像素宽的短线（类似文字或树枝）
+    scribble = np.full((height, width, 3), 200, dtype=np.uint8)
+    for _ in range(6000):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        end = (x + int(rng.integers(-60, 60)), y + int(rng.integers(-60, 60)))
+        cv2.line(scribble, (x, y), end, (20, 20, 20), 2)
+    images['scribble'] = scribble
+
+    paths = {}
+    for name, image in images.items():
+        path = os.path.join(directory, f'{name}.jpg')
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        paths[name] = path
+    return paths
+
+
+# 优化前的实现，每个步骤单独做颜色空间转换，用于校验结果一致
+def legacy_features(image):
+    blue_mean = np.mean(image[:, :, 0])
+    green_mean = np.mean(image[:, :, 1])
+    red_mean = np.mean(image[:, :, 2])
+    if green_mean > 120 and blue_mean > 100:
+        scene_type = 'nature'
+    elif blue_mean > 130:
+        scene_type = 'beach' if green_mean > 80 else 'outdoor'
+    elif red_mean > 100 and green_mean < 100:
+        scene_type = 'city'
+    else:
+        scene_type = 'indoor'
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    mean_brightness = np.mean(gray)
+    contrast = np.std(gray)
+    if mean_brightness > 150:
+        light_type = 'bright' if contrast > 80 else 'soft'
+    else:
+        light_type = 'dim' if contrast < 50 else 'harsh'
+
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    h_mean = np.mean(hsv[:, :, 0])
+
+    edges = cv2.Canny(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), 100, 200)
+    edge_density = np.sum(edges > 0) / (image.shape[0] * image.shape[1])
+
+    return {
+        'scene_type': scene_type,
+        'light_type': light_type,
+        'hue_mean': h_mean,
+        'saturation_mean': np.mean(hsv[:, :, 1]),
+        'brightness_mean': np.mean(hsv[:, :, 2]),
+        'edge_density': edge_density
+    }
+
+
+# 测试共享特征的分析结果与逐步转换的结果完全一致
+def test_fused_analysis_matches_legacy():
+    analyzer = ImageAnalyzer()
+    for name, image in make_reference_images().items():
+        result = analyzer.analyze_image(image)
+        expected = legacy_features(image)
+        assert result['scene_type'] == expected['scene_type'], name
+        assert result['light_type'] == expected['light_type'], name
+        assert result['colors']['hue_mean'] == expected['hue_mean'], name
+        assert result['colors']['saturation_mean'] == expected['saturation_mean'], name
+        assert result['colors']['brightness_mean'] == expected['brightness_mean'], name
+        assert result['content']['edge_density'] == expected['edge_density'], name
+
+
+# 测试从文件路径分析
+def test_analyze_from_path():
+    analyzer = ImageAnalyzer()
+    result = analyzer.analyze(TEST_IMAGE_PATH)
+    assert result['scene_type'] == 'nature'
+    assert result['light_type'] == 'soft'
+    assert result['colors']['dominant_color'] == 'warm'
+    assert result['content']['complexity'] == 'low'
+    assert result['image_size'] == (400, 600)
+
+
+# 测试直接分析内存中的图片数据与从文件读取的结果一致
+def test_analyze_bytes_matches_path():
+    for working_size in (None, 800):
+        analyzer = ImageAnalyzer(working_size=working_size)
+        with tempfile.TemporaryDirectory() as directory:
+            for name, path in write_large_reference_images(directory).items():
+                with open(path, 'rb') as f:
+                    image_bytes = f.read()
+                assert analyzer.analyze_bytes(image_bytes) == analyzer.analyze(path), name
+
+
+# 测试缩小分辨率分析时，分类结果与原始分辨率一致
+def test_downscaled_analysis_tolerance():
+    full_analyzer = ImageAnalyzer()
+    reduced_analyzers = [ImageAnalyzer(working_size=working_size) for working_size in (800, 1024)]
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_large_reference_images(directory)
+        paths.update(write_textured_reference_images(directory))
+        complexities = set()
+        for name, path in paths.items():
+            full = full_analyzer.analyze(path)
+            complexities.add(full['content']['complexity'])
+            for reduced_analyzer in reduced_analyzers:
+                reduced = reduced_analyzer.analyze(path)
+                label = (name, reduced_analyzer.working_size)
+                assert reduced['scene_type'] == full['scene_type'], label
+                assert reduced['light_type'] == full['light_type'], label
+                assert reduced['colors']['dominant_color'] == full['colors']['dominant_color'], label
+                assert reduced['content']['complexity'] == full['content']['complexity'], label
+                # 报告的仍是原始图片尺寸
+                assert reduced['image_size'] == (2400, 3200), label
+        # 参考图片需要同时覆盖高、低两种复杂度
+        assert complexities == {'high', 'low'}
+
+
+# 测试缩小解码后的图片不超过工作分辨率
+def test_reduced_decode_size():
+    analyzer = ImageAnalyzer(working_size=800)
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_large_reference_images(directory)['nature']
+        image, original_size = analyzer._read_image(path)
+        assert original_size == (2400, 3200)
+        # 3200 // 4 = 800，可以直接按1/4解码
+        assert image.shape[:2] == (600, 800)
+
+
+# 测试批量分析与逐张分析（相同工作尺寸）的结果一致
+def test_analyze_batch_matches_single():
+    analyzer = ImageAnalyzer()
+    images = list(make_reference_images().values())
+    size = (256, 256)
+    results = analyzer.analyze_batch(images, size=size)
+    assert len(results) == len(images)
+    for image, result in zip(images, results):
+        resized = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        expected = analyzer.analyze_image(resized, original_size=image.shape[:2])
+        assert result['scene_type'] == expected['scene_type']
+        assert result['light_type'] == expected['light_type']
+        assert result['colors']['dominant_color'] == expected['colors']['dominant_color']
+        assert result['content']['complexity'] == expected['content']['complexity']
+        assert result['scene_description'] == expected['scene_description']
+        assert result['image_size'] == expected['image_size']
+        for key in ('hue_mean', 'saturation_mean', 'brightness_mean'):
+            assert np.isclose(result['colors'][key], expected['colors'][key])
+        # 批量边缘检测只在图片交界处可能有细微差别
+        assert abs(result['content']['edge_density'] - expected['content']['edge_density']) < 0.005
+
+
+# 测试批量分析支持图片路径和字节数据
+def test_analyze_batch_sources():
+    analyzer = ImageAnalyzer()
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+    results = analyzer.analyze_batch([TEST_IMAGE_PATH, image_bytes])
+    assert [result['scene_type'] for result in results] == ['nature', 'nature']
+    assert results[0]['image_size'] == (400, 600)
+    assert analyzer.analyze_batch([]) == []
+
+
+if __name__ == '__main__':
+    test_fused_analysis_matches_legacy()
+    test_analyze_from_path()
+    test_analyze_bytes_matches_path()
+    test_downscaled_analysis_tolerance()
+    test_reduced_decode_size()
+    test_analyze_batch_matches_single()
+    test_analyze_batch_sources()
+    print('ImageAnalyzer测试完成！')
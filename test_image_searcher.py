@@ -0,0 +1,143 @@
+import json
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+from app.utils.html_extractor import extract_image_urls
+from app.utils.http_client import HttpClient
+from app.utils.image_searcher import ImageSearcher
+from app.utils.search_cache import SearchCache
+from stub_server import StubServer
+
+BING_PAGE = b'''<html><body>
+<img class="mimg" src="http://img.example.com/b1.jpg">
+<img class="mimg" data-src="http://img.example.com/b2.jpg">
+<img class="other" src="http://img.example.com/ignored.jpg">
+</body></html>'''
+
+DUCKDUCKGO_PAGE = b'''<html><body>
+<img class="tile--img__img" src="http://img.example.com/d1.jpg">
+</body></html>'''
+
+HTML = {'Content-Type': 'text/html; charset=utf-8'}
+
+
+def make_searcher(server):
+    searcher = ImageSearcher(http_client=HttpClient(backoff_factor=0.01), deadline=2)
+    searcher.search_engines = [
+        server.url('/bing/images/search') + '?q={}',
+        server.url('/duckduckgo/') + '?q={}&iax=images&ia=images'
+    ]
+    searcher.unsplash_api_url = server.url('/unsplash/search/photos')
+    return searcher
+
+
+# 测试从搜索结果页中提取图片
+def test_search_web_extracts_images():
+    with StubServer() as server:
+        server.add_sequence('/bing/images/search', [(200, HTML, BING_PAGE, 0)])
+        searcher = make_searcher(server)
+        searcher.search_engines = searcher.search_engines[:1]
+        images = searcher.search_images(['nature', 'pose'], limit=5)
+        assert [image['url'] for image in images] == ['http://img.example.com/b1.jpg', 'http://img.example.com/b2.jpg']
+        assert server.requests[0]['query']['q'] == ['nature pose']
+
+
+# 测试一个搜索引擎失败时切换到其他搜索引擎
+def test_search_web_falls_back_to_other_engine():
+    with StubServer() as server:
+        server.add_sequence('/bing/images/search', [(500, HTML, b'error', 0)])
+        server.add_sequence('/duckduckgo/', [(500, HTML, b'error', 0)])
+        searcher = make_searcher(server)
+        assert searcher.search_images(['nature']) == []
+
+        server.add_sequence('/duckduckgo/', [(200, HTML, DUCKDUCKGO_PAGE, 0)])
+        images = searcher.search_images(['nature'])
+        assert [image['source'] for image in images] == ['duckduckgo']
+
+
+# 测试Unsplash API搜索
+def test_search_unsplash():
+    payload = {'results': [{'urls': {'regular': 'http://u/r.jpg', 'small': 'http://u/s.jpg'},
+                            'user': {'name': 'Alice'}}]}
+    with StubServer() as server:
+        server.add_sequence('/unsplash/search/photos',
+                            [(200, {'Content-Type': 'application/json'}, json.dumps(payload).encode(), 0)])
+        searcher = make_searcher(server)
+        searcher.set_unsplash_api_key('key')
+        images = searcher.search_images(['beach'], limit=1)
+        assert images[0]['thumbnail'] == 'http://u/s.jpg'
+        assert server.requests[0]['headers']['Authorization'] == 'Client-ID key'
+
+
+def make_hedged_searcher(server, deadline=2):
+    searcher = make_searcher(server)
+    searcher.hedged = True
+    searcher.deadline = deadline
+    return searcher
+
+
+# 测试并发搜索时慢的来源不会拖慢结果
+def test_hedged_search_returns_first_good_result():
+    with StubServer() as server:
+        server.add_sequence('/bing/images/search', [(200, HTML, BING_PAGE, 1.5)])
+        server.add_sequence('/duckduckgo/', [(200, HTML, DUCKDUCKGO_PAGE, 0)])
+        searcher = make_hedged_searcher(server)
+        started = time.monotonic()
+        images = searcher.search_images(['nature'], limit=1)
+        assert time.monotonic() - started < 1.0
+        assert [image['source'] for image in images] == ['duckduckgo']
+
+
+# 测试合并多个来源的结果并去重
+def test_hedged_search_deduplicates():
+    duplicate_page = BING_PAGE.replace(b'class="mimg"', b'class="tile--img__img"')
+    with StubServer() as server:
+        server.add_sequence('/bing/images/search', [(200, HTML, BING_PAGE, 0)])
+        server.add_sequence('/duckduckgo/', [(200, HTML, duplicate_page, 0)])
+        searcher = make_hedged_searcher(server)
+        images = searcher.search_images(['nature'], limit=5)
+        assert sorted(image['url'] for image in images) == ['http://img.example.com/b1.jpg',
+                                                            'http://img.example.com/b2.jpg']
+
+
+# 测试所有来源都很慢时在截止时间返回
+def test_hedged_search_deadline():
+    with StubServer() as server:
+        server.add_sequence('/bing/images/search', [(200, HTML, BING_PAGE, 1.5)])
+        server.add_sequence('/duckduckgo/', [(200, HTML, DUCKDUCKGO_PAGE, 1.5)])
+        searcher = make_hedged_searcher(server, deadline=0.3)
+        started = time.monotonic()
+        assert searcher.search_images(['nature']) == []
+        assert time.monotonic() - started < 1.0
+
+
+# 测试开启缓存后相同关键词不会重复请求搜索引擎
+def test_search_uses_cache():
+    with StubServer() as server:
+        server.add_sequence('/bing/images/search', [(200, HTML, BING_PAGE, 0)])
+        searcher = make_searcher(server)
+        searcher.search_engines = searcher.search_engines[:1]
+        searcher.cache = SearchCache(ttl=60)
+        first = searcher.search_images(['nature', 'pose'])
+        second = searcher.search_images(['nature', 'pose'])
+        assert first == second
+        assert len(server.requests) == 1
+
+
+# 测试流式提取与BeautifulSoup的结果一致，包括只有data-src、非http地址和提前停止的情况
+def test_stream_extractor_matches_soup():
+    fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'fixtures')
+    pages = [('bing_images.html', 'mimg'), ('duckduckgo_images.html', 'tile--img__img')]
+    for name, css_class in pages:
+        with open(os.path.join(fixture_dir, name), 'r', encoding='utf-8') as f:
+            html = f.read()
+        soup = BeautifulSoup(html, 'html.parser')
+        for limit in (1, 5, 30, 500):
+            expected = []
+            for img in soup.find_all('img', class_=css_class)[:limit]:
+                img_url = img.get('src') or img.get('data-src')
+                if img_url and img_url.startswith('http'):
+                    expected.append(img_url)
+            assert extract_image_urls(html, css_class, limit, chunk_size=4096) == expected
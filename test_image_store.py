@@ -0,0 +1,86 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.image_store import ImageStore
+
+TEST_IMAGE_PATH = 'test_image.jpg'
+
+
+def read_test_image():
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        return f.read()
+
+
+# 测试原图只保存一次，缩略图按长边缩小
+def test_save_original_and_thumbnail(tmp_path):
+    store = ImageStore(str(tmp_path), thumbnail_size=128)
+    data = read_test_image()
+
+    name, thumbnail_name = store.save(data)
+    assert name.endswith('.jpg') and thumbnail_name.endswith('.thumb.jpg')
+    with open(store.path(name), 'rb') as f:
+        assert f.read() == data
+    thumbnail = cv2.imread(store.path(thumbnail_name))
+    assert max(thumbnail.shape[:2]) <= 128
+    assert os.path.getsize(store.path(thumbnail_name)) < len(data)
+
+    assert store.save(data) == (name, thumbnail_name)
+    assert len(os.listdir(tmp_path)) == 2
+
+
+# 测试生成结果中的链接替换为本地地址，下载失败时保留原链接
+def test_mirror(tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path))
+    data = read_test_image()
+
+    def fake_fetch(url):
+        if 'broken' in url:
+            raise ConnectionError('unreachable')
+        return data
+
+    monkeypatch.setattr(store, '_fetch', fake_fetch)
+    images = [
+        {'url': 'https://oss.example.com/a.jpg', 'thumbnail': 'https://oss.example.com/a.jpg', 'prompt': 'p'},
+        {'url': 'https://oss.example.com/broken.jpg', 'thumbnail': 'https://oss.example.com/broken.jpg'}
+    ]
+    mirrored = store.mirror(images)
+
+    assert mirrored[0]['url'].startswith('/media/')
+    assert mirrored[0]['thumbnail'].endswith('.thumb.jpg')
+    assert mirrored[0]['source_url'] == 'https://oss.example.com/a.jpg'
+    assert mirrored[0]['prompt'] == 'p'
+    assert mirrored[1] == images[1]
+    assert store.contains(mirrored[:1])
+    assert not store.contains(mirrored)
+
+
+# 测试不支持的格式和无效文件名
+def test_rejects_invalid(tmp_path):
+    store = ImageStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.save(b'not an image')
+    assert store.path('../test_image.jpg') is None
+    assert store.path('0' * 64 + '.jpg') is None
+
+
+# 测试超过数量上限时删除最早保存的图片及其缩略图
+def test_prune(tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path), max_files=2)
+    payloads = {}
+    for index in range(3):
+        ok, buffer = cv2.imencode('.png', np.full((8, 8, 3), index * 40, dtype=np.uint8))
+        payloads[f'https://oss.example.com/{index}.png'] = buffer.tobytes()
+    monkeypatch.setattr(store, '_fetch', lambda url: payloads[url])
+
+    mirrored = []
+    for index, url in enumerate(payloads):
+        mirrored.extend(store.mirror([{'url': url, 'thumbnail': url}]))
+        os.utime(store.path(mirrored[-1]['url'].rsplit('/', 1)[1]), (index, index))
+
+    store._prune()
+    assert not store.contains(mirrored[:1])
+    assert store.contains(mirrored[1:])
+    assert len(os.listdir(tmp_path)) == 4
@@ -0,0 +1,84 @@
+import threading
+
+from app.utils.job_manager import JobManager
+
+
+# 测试任务结果合并到初始结果中
+def test_job_result_merged():
+    manager = JobManager(max_workers=1)
+    release = threading.Event()
+
+    def task():
+        release.wait(5)
+        return {'images': [1, 2]}
+
+    job_id = manager.submit({'advice': 'a', 'images': None}, task)
+    job = manager.get(job_id)
+    assert job['result'] == {'advice': 'a', 'images': None}
+    assert job['status'] in ('pending', 'running')
+
+    release.set()
+    while job['status'] != 'done':
+        job = manager.wait(job_id, job['version'], timeout=5)
+    assert job['result'] == {'advice': 'a', 'images': [1, 2]}
+    manager.shutdown()
+
+
+# 测试任务异常时标记为失败
+def test_job_failure():
+    manager = JobManager(max_workers=1)
+
+    def task():
+        raise RuntimeError('boom')
+
+    job_id = manager.submit({}, task)
+    manager.shutdown()
+    job = manager.get(job_id)
+    assert job['status'] == 'failed'
+    assert job['error'] == 'boom'
+
+
+# 测试没有后台步骤的任务创建即完成
+def test_job_without_task_done():
+    manager = JobManager(max_workers=1)
+    job = manager.get(manager.submit({'images': []}))
+    assert job['status'] == 'done'
+    assert job['result'] == {'images': []}
+    manager.shutdown()
+
+
+# 测试已完成的任务超过数量上限时被清理
+def test_finished_jobs_bounded():
+    manager = JobManager(max_workers=1, max_jobs=2)
+    job_ids = []
+    for _ in range(5):
+        job_ids.append(manager.submit({}, dict))
+        # 等待前面的任务执行完成
+        manager._executor.submit(lambda: None).result()
+    manager.shutdown()
+    assert manager.get(job_ids[-1]) is not None
+    assert sum(manager.get(job_id) is not None for job_id in job_ids) <= 2
+
+
+# 测试多个工作进程共享任务状态：另一个实例可以查询和等待任务
+def test_shared_store_between_managers(tmp_path):
+    store_path = str(tmp_path / 'jobs.sqlite3')
+    owner = JobManager(max_workers=1, store_path=store_path)
+    other = JobManager(max_workers=1, store_path=store_path, poll_interval=0.05)
+    release = threading.Event()
+
+    def task():
+        release.wait(5)
+        return {'images': [1]}
+
+    job_id = owner.submit({'images': None}, task)
+    job = other.get(job_id)
+    assert job['result'] == {'images': None}
+
+    release.set()
+    while job['status'] != 'done':
+        job = other.wait(job_id, job['version'], timeout=5)
+    assert job['result'] == {'images': [1]}
+    assert other.get('missing') is None
+    owner.shutdown()
+    other.shutdown()
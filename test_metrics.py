@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils import ai_image_generator as ai_module
+from app.utils.ai_image_generator import AIImageGenerator
+from app.utils.analysis_cache import AnalysisCache
+from app.utils.metrics import (
+    MetricsRegistry, UPSTREAM_DURATION, UPSTREAM_RESPONSES, cache_collector, server_timing
+)
+
+
+# 测试计数器、仪表和直方图的Prometheus文本格式
+def test_registry_render():
+    registry = MetricsRegistry()
+    requests = registry.counter('demo_requests_total', '请求数量', ('status',))
+    in_flight = registry.gauge('demo_in_flight', '进行中的请求')
+    latency = registry.histogram('demo_latency_seconds', '耗时', ('stage',), buckets=(0.1, 1.0))
+
+    requests.inc(status=200)
+    requests.inc(2, status=200)
+    requests.inc(status=500)
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    latency.observe(0.05, stage='analyze')
+    latency.observe(0.5, stage='analyze')
+    latency.observe(3, stage='analyze')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE demo_requests_total counter' in lines
+    assert 'demo_requests_total{status="200"} 3' in lines
+    assert 'demo_requests_total{status="500"} 1' in lines
+    assert 'demo_in_flight 1' in lines
+    # 分桶计数是累计的
+    assert 'demo_latency_seconds_bucket{stage="analyze",le="0.1"} 1' in lines
+    assert 'demo_latency_seconds_bucket{stage="analyze",le="1"} 2' in lines
+    assert 'demo_latency_seconds_bucket{stage="analyze",le="+Inf"} 3' in lines
+    assert 'demo_latency_seconds_count{stage="analyze"} 3' in lines
+    assert 'demo_latency_seconds_sum{stage="analyze"} 3.55' in lines
+
+
+# 测试标签不匹配和重复注册时报错
+def test_registry_validation():
+    registry = MetricsRegistry()
+    counter = registry.counter('demo_total', '数量', ('status',))
+    with pytest.raises(ValueError):
+        counter.inc(code=200)
+    with pytest.raises(ValueError):
+        registry.gauge('demo_total', '重复')
+
+
+# 测试缓存统计转换为命中指标，磁盘命中计入命中次数
+def test_cache_collector(tmp_path):
+    cache = AnalysisCache(max_entries=8, cache_dir=str(tmp_path))
+    cache.get_or_compute(b'image', lambda data: {'scene_type': 'nature'})
+    cache.get_or_compute(b'image', lambda data: {'scene_type': 'nature'})
+
+    registry = MetricsRegistry()
+    registry.register_collector(cache_collector(lambda: {'analysis': cache, 'generation': None}))
+    lines = registry.render().splitlines()
+    assert 'easy_pose_cache_hits_total{cache="analysis"} 1' in lines
+    assert 'easy_pose_cache_misses_total{cache="analysis"} 1' in lines
+    assert 'easy_pose_cache_hit_ratio{cache="analysis"} 0.5' in lines
+    assert not any('generation' in line for line in lines)
+
+
+def test_server_timing():
+    assert server_timing({'analyze': 12.5, 'total': 30.0}) == 'analyze;dur=12.5, total;dur=30.0'
+
+
+# 测试DashScope返回错误时记录状态码和耗时，并返回空结果
+def test_dashscope_status_recorded(monkeypatch):
+    response = SimpleNamespace(status_code=429, code='Throttling', message='rate limited', request_id='stub')
+    monkeypatch.setattr(ai_module.MultiModalConversation, 'call', lambda **kwargs: response)
+    before = UPSTREAM_RESPONSES.value(upstream='dashscope', status=429)
+    count_before = UPSTREAM_DURATION.value(upstream='dashscope')[0]
+
+    assert AIImageGenerator()._call_dashscope_api(b'image', 'prompt') == []
+    assert UPSTREAM_RESPONSES.value(upstream='dashscope', status=429) == before + 1
+    assert UPSTREAM_DURATION.value(upstream='dashscope')[0] == count_before + 1
+
+
+# 测试请求异常时状态码记为error
+def test_dashscope_error_recorded(monkeypatch):
+    def fail(**kwargs):
+        raise ConnectionError('unreachable')
+
+    monkeypatch.setattr(ai_module.MultiModalConversation, 'call', fail)
+    before = UPSTREAM_RESPONSES.value(upstream='dashscope', status='error')
+    assert AIImageGenerator().generate_images_from_image(b'image', {
+        'scene_type': 'nature', 'light_type': 'natural', 'colors': {'dominant_color': 'green'}
+    }, '清新') == []
+    assert UPSTREAM_RESPONSES.value(upstream='dashscope', status='error') == before + 1
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+
+import reanalyze
+
+TEST_IMAGE_PATH = 'test_image.jpg'
+
+
+def make_input_dir(tmp_path, count):
+    input_dir = tmp_path / 'photos'
+    input_dir.mkdir()
+    for i in range(count):
+        shutil.copy(TEST_IMAGE_PATH, input_dir / f'{i}.jpg')
+    (input_dir / 'notes.txt').write_text('not an image')
+    return input_dir
+
+
+def read_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+# 测试批量分析目录中的图片并写入JSONL
+def test_reanalyze_directory(tmp_path):
+    input_dir = make_input_dir(tmp_path, 3)
+    output = str(tmp_path / 'results.jsonl')
+    args = reanalyze.parse_args(['--input', str(input_dir), '--style', '清新', '--output', output, '--workers', '1'])
+    assert reanalyze.run(args) == (3, 0)
+
+    records = read_records(output)
+    assert sorted(os.path.basename(record['path']) for record in records) == ['0.jpg', '1.jpg', '2.jpg']
+    assert all(record['scene_features']['scene_type'] == 'nature' for record in records)
+    assert all(record['advice'] for record in records)
+
+
+# 测试中断后重新运行只分析未完成的图片，并修复写了一半的最后一行
+def test_reanalyze_resume(tmp_path):
+    input_dir = make_input_dir(tmp_path, 3)
+    output = str(tmp_path / 'results.jsonl')
+    done_path = str(input_dir / '0.jpg')
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'path': done_path, 'style': '清新', 'scene_features': {}, 'advice': {}}) + '\n')
+        f.write('{"path": "partial')
+
+    args = reanalyze.parse_args(['--input', str(input_dir), '--style', '清新', '--output', output, '--workers', '1'])
+    assert reanalyze.run(args) == (2, 0)
+
+    records = read_records(output)
+    assert len(records) == 3
+    assert records[0]['path'] == done_path
+
+    # 全部完成后再次运行不会重复分析
+    assert reanalyze.run(args) == (0, 0)
+
+
+# 测试从列表文件读取路径，失败的图片记录错误
+def test_reanalyze_list_with_errors(tmp_path):
+    list_file = tmp_path / 'paths.txt'
+    list_file.write_text(f'{TEST_IMAGE_PATH}\n{tmp_path / "missing.jpg"}\n')
+    output = str(tmp_path / 'results.jsonl')
+    args = reanalyze.parse_args(['--list', str(list_file), '--style', '忧郁', '--output', output, '--workers', '1'])
+    assert reanalyze.run(args) == (2, 1)
+    errors = [record for record in read_records(output) if 'error' in record]
+    assert len(errors) == 1
+
+
+# 测试默认工作分辨率与应用的ANALYSIS_WORKING_SIZE一致
+def test_working_size_follows_app_setting(monkeypatch):
+    argv = ['--input', 'photos', '--style', '清新', '--output', 'out.jsonl']
+    monkeypatch.delenv('ANALYSIS_WORKING_SIZE', raising=False)
+    assert reanalyze.parse_args(argv).working_size == 0
+    monkeypatch.setenv('ANALYSIS_WORKING_SIZE', '768')
+    assert reanalyze.parse_args(argv).working_size == 768
+    assert reanalyze.parse_args(argv + ['--working-size', '1024']).working_size == 1024
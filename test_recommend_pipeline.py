@@ -0,0 +1,205 @@
+import threading
+import time
+
+import pytest
+
+from app.utils.advice_generator import AdviceGenerator
+from app.utils.ai_image_generator import AIImageGenerator
+from app.utils.analysis_cache import AnalysisCache
+from app.utils.generation_cache import GenerationCache
+from app.utils.image_analyzer import ImageAnalyzer
+from app.utils.recommend_pipeline import RecommendPipeline
+from app.utils.style_matcher import StyleMatcher
+from app.utils.upstream import CircuitBreaker, UpstreamLimiter
+
+TEST_IMAGE_PATH = 'test_image.jpg'
+
+
+# 模拟耗时的上游调用
+class SlowGenerator(AIImageGenerator):
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.prepared = []
+
+    def _call_dashscope_api(self, image, prompt, num_images=3, timeout=None):
+        self.prepared.append(image)
+        time.sleep(self.delay)
+        return [{'url': 'http://example.com/ai.jpg', 'prompt': prompt}]
+
+
+def make_pipeline(generator, max_workers=8):
+    return RecommendPipeline(
+        ImageAnalyzer(),
+        AnalysisCache(max_entries=0),
+        StyleMatcher(),
+        AdviceGenerator(),
+        generator,
+        max_workers=max_workers
+    )
+
+
+# 测试流程结果和各步骤耗时
+def test_pipeline_result_and_timings():
+    generator = SlowGenerator(delay=0.05)
+    pipeline = make_pipeline(generator)
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+
+    result = pipeline.run(image_bytes, '清新', num_images=3)
+    assert result['scene_features']['scene_type'] == 'nature'
+    assert result['advice']
+    assert len(result['ai_reference_images']) == 1
+    for stage in ('prepare', 'analyze', 'match', 'advice', 'generate', 'total'):
+        assert stage in result['timings']
+    assert result['timings']['generate'] >= 50
+
+    # 缓存键哈希与场景分析同时计算，缩小和重新编码留到缓存未命中的生成步骤中
+    assert generator.prepared[0].data is image_bytes
+    assert generator.prepared[0]._sha256 is not None
+    pipeline.shutdown()
+
+
+# 测试未知风格时抛出异常
+def test_pipeline_unknown_style():
+    pipeline = make_pipeline(SlowGenerator(delay=0))
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+    with pytest.raises(ValueError):
+        pipeline.run(image_bytes, 'unknown')
+    pipeline.shutdown()
+
+
+# 测试到达截止时间时不再等待上游，返回分析结果和拍摄建议
+def test_pipeline_deadline():
+    pipeline = make_pipeline(SlowGenerator(delay=1.0))
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+
+    started = time.monotonic()
+    result = pipeline.run(image_bytes, '清新', deadline=started + 0.3)
+    assert time.monotonic() - started < 0.9
+    assert result['advice']
+    assert result['ai_reference_images'] == []
+    assert result['ai_error']['code'] == 'upstream_timeout'
+    assert 'generate' not in result['timings']
+    pipeline.shutdown()
+
+
+# 测试熔断时立即返回，不调用上游
+def test_pipeline_circuit_open():
+    generator = SlowGenerator(delay=1.0)
+    generator.breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=60)
+    generator.breaker.record_failure()
+    pipeline = make_pipeline(generator)
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+
+    started = time.monotonic()
+    result = pipeline.run(image_bytes, '清新')
+    assert time.monotonic() - started < 0.9
+    assert result['ai_error']['code'] == 'circuit_open'
+    assert generator.prepared == []
+    pipeline.shutdown()
+
+
+# 测试流式推荐先返回分析结果，AI参考图片按完成顺序逐张返回
+def test_pipeline_stream():
+    class StaggeredGenerator(SlowGenerator):
+        def _call_dashscope_api(self, image, prompt, num_images=3, timeout=None):
+            assert num_images == 1
+            with lock:
+                delay = delays.pop(0)
+            time.sleep(delay)
+            return [{'url': f'http://example.com/{delay}.jpg', 'prompt': prompt}]
+
+    lock = threading.Lock()
+    delays = [0.05, 0.6, 0.3]
+    pipeline = make_pipeline(StaggeredGenerator(delay=0))
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+
+    result, events = pipeline.stream(image_bytes, '清新', num_images=3)
+    assert result['scene_features']['scene_type'] == 'nature'
+    assert result['advice']
+
+    events = list(events)
+    assert [event['image']['url'] for event in events[:-1]] == [
+        'http://example.com/0.05.jpg', 'http://example.com/0.3.jpg', 'http://example.com/0.6.jpg'
+    ]
+    assert [event['index'] for event in events[:-1]] == [0, 1, 2]
+    done = events[-1]
+    assert done['type'] == 'done' and done['ai_error'] is None
+    # 第一张图片不必等待最慢的请求
+    assert done['timings']['first_image'] < done['timings']['generate']
+    assert done['timings']['generate'] >= 600
+    pipeline.shutdown()
+
+
+# 测试流式推荐在熔断时返回错误，不调用上游
+def test_pipeline_stream_circuit_open():
+    generator = SlowGenerator(delay=1.0)
+    generator.breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=60)
+    generator.breaker.record_failure()
+    pipeline = make_pipeline(generator)
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+
+    result, events = pipeline.stream(image_bytes, '清新')
+    events = list(events)
+    assert len(events) == 1
+    assert events[0]['ai_error']['code'] == 'circuit_open'
+    assert generator.prepared == []
+    pipeline.shutdown()
+
+
+# 测试并发请求超过线程池大小时，超出DashScope调用容量的请求立即失败，而不是在线程池的队列中等待
+def test_pipeline_rejects_over_capacity():
+    generator = SlowGenerator(delay=0.5)
+    generator.limiter = UpstreamLimiter('test', max_concurrent=2, max_queue=0)
+    pipeline = make_pipeline(generator, max_workers=2)
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+
+    results = []
+
+    def run():
+        started = time.monotonic()
+        result = pipeline.run(image_bytes, '清新')
+        results.append((time.monotonic() - started, result))
+
+    threads = [threading.Thread(target=run) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    succeeded = [elapsed for elapsed, result in results if result['ai_reference_images']]
+    rejected = [elapsed for elapsed, result in results if result['ai_error']]
+    assert len(succeeded) == 2
+    assert len(rejected) == 4
+    assert all(result['ai_error']['code'] == 'upstream_busy' for _, result in results if result['ai_error'])
+    # 被拒绝的请求不等待正在进行的生成
+    assert max(rejected) < 0.5
+    assert generator.limiter.stats()['in_use'] == 0
+    pipeline.shutdown()
+
+
+# 测试提交生成前的缓存查询不重复计入未命中，缓存统计与请求数一致
+def test_pipeline_cache_stats_count_each_request_once():
+    generator = SlowGenerator(delay=0)
+    generator.cache = GenerationCache(':memory:')
+    pipeline = make_pipeline(generator)
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+
+    pipeline.run(image_bytes, '清新')
+    stats = generator.cache.stats()
+    assert (stats['hits'], stats['misses']) == (0, 1)
+
+    pipeline.run(image_bytes, '清新')
+    stats = generator.cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert stats['hit_rate'] == 0.5
+    assert len(generator.prepared) == 1
+    pipeline.shutdown()
@@ -0,0 +1,98 @@
+import cProfile
+import os
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.request_profiler import RequestProfiler, collapse_stats, propagate
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+def outer():
+    return busy(20000) + inner()
+
+
+def inner():
+    return busy(40000)
+
+
+# 测试默认配置不剖析任何请求
+def test_disabled_by_default(tmp_path):
+    profiler = RequestProfiler(str(tmp_path))
+    assert not profiler.enabled
+    assert profiler.select({'X-Profile-Token': 'anything'}) is None
+
+
+# 测试只有令牌正确时才通过请求头触发，使用请求方提供的合法请求ID
+def test_select_by_token(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret')
+    assert profiler.select({}) is None
+    assert profiler.select({'X-Profile-Token': 'wrong'}) is None
+    assert profiler.select({'X-Profile-Token': 'secret', 'X-Request-ID': 'req-1'}) == 'req-1'
+    # 不能用作文件名的请求ID会被替换
+    generated = profiler.select({'X-Profile-Token': 'secret', 'X-Request-ID': '../etc/passwd'})
+    assert generated and '/' not in generated
+
+
+# 测试按比例抽样，没有令牌时不使用请求方提供的请求ID
+def test_select_by_sample_rate(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), sample_rate=1.0, token='secret')
+    assert profiler.select({}) is not None
+    assert profiler.select({'X-Request-ID': 'req-1'}) != 'req-1'
+    assert profiler.select({'X-Profile-Token': 'wrong', 'X-Request-ID': 'req-1'}) != 'req-1'
+
+
+# 测试折叠调用栈包含完整的调用路径
+def test_collapse_stats():
+    profile = cProfile.Profile()
+    profile.runcall(outer)
+    stacks = collapse_stats(pstats.Stats(profile))
+    outer_paths = [stack for stack in stacks if ':outer;' in stack and ':inner;' in stack and ':busy' in stack]
+    assert outer_paths
+    assert all(micros > 0 for micros in stacks.values())
+
+
+# 测试保存剖析结果并只保留最近的若干份
+def test_run_saves_and_prunes(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret', max_profiles=2)
+    for index in range(3):
+        result, profiled = profiler.run(f'req-{index}', outer)
+        assert profiled
+        assert result == outer()
+        os.utime(tmp_path / f'req-{index}.collapsed', (index, index))
+
+    assert sorted(os.listdir(tmp_path)) == ['req-1.collapsed', 'req-1.pstats', 'req-2.collapsed', 'req-2.pstats']
+    assert ':busy' in profiler.load('req-2')
+    assert profiler.load('req-0') is None
+    assert profiler.load('../req-2') is None
+
+
+# 测试保存剖析结果失败时仍然返回请求的结果
+def test_run_save_error_keeps_result(tmp_path):
+    store_file = tmp_path / 'profiles'
+    store_file.write_text('')
+    profiler = RequestProfiler(str(store_file), token='secret')
+    result, profiled = profiler.run('req-1', outer)
+    assert result == outer()
+    assert not profiled
+
+
+# 测试提交到线程池的步骤在执行线程中剖析，结果合并到请求的剖析结果中
+def test_run_includes_worker_threads(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='secret')
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        def handle():
+            return executor.submit(propagate(inner)).result() + executor.submit(outer).result()
+
+        result, profiled = profiler.run('req-pool', handle)
+        assert profiled
+        assert result == inner() + outer()
+
+    collapsed = profiler.load('req-pool')
+    assert ':inner;' in collapsed
+    # 没有包装的步骤不剖析
+    assert ':outer' not in collapsed
+    # 不在剖析中的线程提交的函数不包装
+    assert propagate(inner) is inner
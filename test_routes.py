@@ -0,0 +1,360 @@
+import io
+import json
+import os
+
+from app import app
+from app import routes
+from app.utils.generation_cache import GenerationCache
+from app.utils.image_store import ImageStore
+from app.utils.metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_DURATION, HTTP_REQUESTS
+from app.utils.upstream import UpstreamLimiter
+
+TEST_IMAGE_PATH = 'test_image.jpg'
+
+
+# 替换AI生成步骤，避免测试时调用DashScope API
+def stub_generator(monkeypatch):
+    calls = []
+
+    def fake_call(image, prompt, num_images=3, timeout=None):
+        calls.append(image.data)
+        return [{'url': 'http://example.com/ai.jpg', 'thumbnail': 'http://example.com/ai.jpg',
+                 'source': 'aliyun_qwen', 'photographer': 'stub', 'prompt': prompt}]
+
+    monkeypatch.setattr(routes.ai_image_generator, '_call_dashscope_api', fake_call)
+    # 使用独立的内存缓存，避免受磁盘上已有的生成结果影响
+    monkeypatch.setattr(routes.ai_image_generator, 'cache', GenerationCache(':memory:'))
+    monkeypatch.setattr(routes.ai_image_generator, 'store', None)
+    return calls
+
+
+def post_recommend(client, style='生命力'):
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = {'image': (io.BytesIO(f.read()), 'scene.jpg'), 'style': style}
+    return client.post('/api/recommend', data=data, content_type='multipart/form-data')
+
+
+# 测试推荐接口在内存中处理上传图片，不写入上传文件夹
+def test_recommend_in_memory(monkeypatch, tmp_path):
+    calls = stub_generator(monkeypatch)
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(app.config, 'PERSIST_UPLOADS', False)
+
+    response = post_recommend(app.test_client())
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['scene_features']['scene_type'] == 'nature'
+    assert len(data['ai_reference_images']) == 1
+    assert 'analyze' in data['timings']
+    # 生成器收到的是请求中的图片数据，而不是文件路径
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        assert calls == [f.read()]
+    assert os.listdir(tmp_path) == []
+
+
+# 测试开启持久化时保存上传图片
+def test_recommend_persist_uploads(monkeypatch, tmp_path):
+    stub_generator(monkeypatch)
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(app.config, 'PERSIST_UPLOADS', True)
+
+    response = post_recommend(app.test_client())
+    assert response.status_code == 200
+    assert os.listdir(tmp_path) == ['scene.jpg']
+
+
+# 测试缺少参数时返回400
+def test_recommend_missing_style(monkeypatch):
+    stub_generator(monkeypatch)
+    response = app.test_client().post('/api/recommend', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+# 测试同一张图片切换风格时不再重复分析
+def test_recommend_reuses_cached_analysis(monkeypatch):
+    stub_generator(monkeypatch)
+    routes.analysis_cache.clear()
+    calls = []
+    analyze_bytes = routes.image_analyzer.analyze_bytes
+
+    def counting_analyze(image_bytes):
+        calls.append(len(image_bytes))
+        return analyze_bytes(image_bytes)
+
+    monkeypatch.setattr(routes.image_analyzer, 'analyze_bytes', counting_analyze)
+    client = app.test_client()
+    assert post_recommend(client, style='生命力').status_code == 200
+    assert post_recommend(client, style='忧郁').status_code == 200
+    assert len(calls) == 1
+
+    stats = client.get('/api/cache/stats').get_json()['analysis']
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+
+# 测试异步推荐任务立即返回分析结果，AI参考图片稍后可查询
+def test_recommend_job_lifecycle(monkeypatch):
+    stub_generator(monkeypatch)
+    client = app.test_client()
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = {'image': (io.BytesIO(f.read()), 'scene.jpg'), 'style': '清新'}
+    response = client.post('/api/recommend/jobs', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['scene_features']['scene_type'] == 'nature'
+    assert job['advice']
+    assert job['status'] in ('pending', 'running', 'done')
+
+    # SSE流在任务结束后关闭，最后一个事件包含AI参考图片
+    events = client.get(job['events_url']).get_data(as_text=True)
+    last_event = [line for line in events.splitlines() if line.startswith('data: ')][-1]
+    assert json.loads(last_event[len('data: '):])['status'] == 'done'
+
+    status = client.get(job['status_url']).get_json()
+    assert status['status'] == 'done'
+    assert len(status['ai_reference_images']) == 1
+
+
+# 测试流式推荐逐行返回分析结果和每张AI参考图片，完整结果写入缓存供普通推荐复用
+def test_recommend_stream(monkeypatch):
+    calls = stub_generator(monkeypatch)
+    client = app.test_client()
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = {'image': (io.BytesIO(f.read()), 'scene.jpg'), 'style': '清新'}
+    response = client.post('/api/recommend/stream', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert events[0]['type'] == 'analysis'
+    assert events[0]['scene_features']['scene_type'] == 'nature'
+    assert events[0]['advice']
+    assert [event['type'] for event in events[1:]] == ['image', 'image', 'image', 'done']
+    assert events[-1]['ai_error'] is None
+    assert 'first_image' in events[-1]['timings']
+    assert len(calls) == 3
+
+    response = post_recommend(client, style='清新')
+    assert len(response.get_json()['ai_reference_images']) == 3
+    assert len(calls) == 3
+
+
+# 测试流式推荐缺少参数时直接返回错误
+def test_recommend_stream_missing_style():
+    client = app.test_client()
+    data = {'image': (io.BytesIO(b'image'), 'scene.jpg')}
+    response = client.post('/api/recommend/stream', data=data, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+# 测试查询不存在的任务
+def test_recommend_job_not_found():
+    client = app.test_client()
+    assert client.get('/api/recommend/jobs/missing').status_code == 404
+    assert client.get('/api/recommend/jobs/missing/events').status_code == 404
+
+
+# 测试批量推荐以NDJSON逐行返回每张图片的结果
+def test_recommend_batch():
+    client = app.test_client()
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        image_bytes = f.read()
+    data = {
+        'images': [(io.BytesIO(image_bytes), 'a.jpg'), (io.BytesIO(image_bytes), 'b.jpg'),
+                   (io.BytesIO(b'not an image'), 'broken.jpg')],
+        'style': ['清新', '忧郁', '甜美']
+    }
+    response = client.post('/api/recommend/batch', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    results = {}
+    for line in response.get_data(as_text=True).splitlines():
+        result = json.loads(line)
+        results[result['filename']] = result
+    assert results['a.jpg']['style'] == '清新'
+    assert results['b.jpg']['style'] == '忧郁'
+    assert results['a.jpg']['scene_features']['scene_type'] == 'nature'
+    assert results['b.jpg']['advice']
+    assert 'error' in results['broken.jpg']
+
+
+# 测试批量推荐的风格数量与图片数量不匹配
+def test_recommend_batch_style_mismatch():
+    client = app.test_client()
+    data = {
+        'images': [(io.BytesIO(b'a'), 'a.jpg'), (io.BytesIO(b'b'), 'b.jpg'), (io.BytesIO(b'c'), 'c.jpg')],
+        'style': ['清新', '忧郁']
+    }
+    response = client.post('/api/recommend/batch', data=data, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+# 测试/metrics导出推荐各步骤耗时、请求数量和缓存命中，开启时返回Server-Timing头
+def test_recommend_metrics(monkeypatch):
+    stub_generator(monkeypatch)
+    monkeypatch.setitem(app.config, 'SERVER_TIMING', True)
+    client = app.test_client()
+
+    response = post_recommend(client)
+    assert response.status_code == 200
+    stages = [item.split(';')[0] for item in response.headers['Server-Timing'].split(', ')]
+    assert {'save', 'analyze', 'match', 'advice', 'generate', 'total'} <= set(stages)
+
+    metrics = client.get('/metrics')
+    assert metrics.status_code == 200
+    assert metrics.content_type.startswith('text/plain; version=0.0.4')
+    text = metrics.get_data(as_text=True)
+    assert 'easy_pose_recommend_stage_duration_seconds_count{stage="save"}' in text
+    assert 'easy_pose_recommend_stage_duration_seconds_count{stage="generate"}' in text
+    assert 'easy_pose_http_requests_total{endpoint="recommend_pose",method="POST",status="200"}' in text
+    assert 'easy_pose_http_requests_in_flight{endpoint="recommend_pose"} 0' in text
+    assert 'easy_pose_cache_hit_ratio{cache="analysis"}' in text
+    assert 'easy_pose_cache_hits_total{cache="generation"}' in text
+
+
+# 测试流式接口的请求指标包含发送响应内容的时间：发送完成前仍计为正在处理的请求
+def test_stream_metrics_cover_body(monkeypatch):
+    stub_generator(monkeypatch)
+    client = app.test_client()
+    endpoint = 'stream_recommend_pose'
+    # 测试客户端不会关闭其他测试中未读取完的流式响应，按变化量断言
+    in_flight_before = HTTP_IN_FLIGHT.value(endpoint=endpoint)
+    requests_before = HTTP_REQUESTS.value(endpoint=endpoint, method='POST', status=200)
+    observed_before = HTTP_REQUEST_DURATION.value(endpoint=endpoint)[0]
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = {'image': (io.BytesIO(f.read()), 'scene.jpg'), 'style': '清新'}
+    response = client.post('/api/recommend/stream', data=data, content_type='multipart/form-data', buffered=False)
+    body = response.iter_encoded()
+    next(body)
+    assert HTTP_IN_FLIGHT.value(endpoint=endpoint) == in_flight_before + 1
+    assert HTTP_REQUEST_DURATION.value(endpoint=endpoint)[0] == observed_before
+
+    for _ in body:
+        pass
+    response.close()
+    assert HTTP_IN_FLIGHT.value(endpoint=endpoint) == in_flight_before
+    assert HTTP_REQUESTS.value(endpoint=endpoint, method='POST', status=200) == requests_before + 1
+    assert HTTP_REQUEST_DURATION.value(endpoint=endpoint)[0] == observed_before + 1
+
+
+# 测试默认不返回Server-Timing头
+def test_recommend_without_server_timing(monkeypatch):
+    stub_generator(monkeypatch)
+    monkeypatch.setitem(app.config, 'SERVER_TIMING', False)
+    response = post_recommend(app.test_client())
+    assert response.status_code == 200
+    assert 'Server-Timing' not in response.headers
+
+
+# 测试通过令牌剖析推荐请求，并按请求ID获取折叠调用栈
+def test_recommend_profiling(monkeypatch, tmp_path):
+    stub_generator(monkeypatch)
+    monkeypatch.setattr(routes.request_profiler, 'store_dir', str(tmp_path))
+    monkeypatch.setattr(routes.request_profiler, 'token', 'secret')
+    routes.analysis_cache.clear()
+    client = app.test_client()
+
+    # 未携带令牌时不剖析
+    assert 'X-Profile-Id' not in post_recommend(client, style='忧郁').headers
+    routes.analysis_cache.clear()
+
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = {'image': (io.BytesIO(f.read()), 'scene.jpg'), 'style': '清新'}
+    response = client.post('/api/recommend', data=data, content_type='multipart/form-data',
+                           headers={'X-Profile-Token': 'secret', 'X-Request-ID': 'slow-request'})
+    assert response.status_code == 200
+    assert response.get_json()['scene_features']['scene_type'] == 'nature'
+    assert response.headers['X-Profile-Id'] == 'slow-request'
+
+    assert client.get('/api/profiles/slow-request').status_code == 403
+    profile = client.get('/api/profiles/slow-request', headers={'X-Profile-Token': 'secret'})
+    assert profile.status_code == 200
+    collapsed = profile.get_data(as_text=True)
+    assert 'analyze_bytes' in collapsed
+    # 在线程池中执行的编码和生成步骤也包含在结果中
+    assert 'prepare_image' in collapsed
+    assert 'fake_call' in collapsed
+    assert client.get('/api/profiles/missing', headers={'X-Profile-Token': 'secret'}).status_code == 404
+
+
+# 测试DashScope调用已满时立即返回分析结果和拍摄建议，并说明AI生成不可用的原因
+def test_recommend_upstream_busy(monkeypatch):
+    stub_generator(monkeypatch)
+    limiter = UpstreamLimiter('dashscope', max_concurrent=1, max_queue=0)
+    limiter.acquire()
+    monkeypatch.setattr(routes.ai_image_generator, 'limiter', limiter)
+
+    response = post_recommend(app.test_client())
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['advice']
+    assert data['ai_reference_images'] == []
+    assert data['ai_error']['code'] == 'upstream_busy'
+
+
+# 测试异步推荐任务超出DashScope调用容量时立即结束，不在后台线程池中排队
+def test_recommend_job_upstream_busy(monkeypatch):
+    calls = stub_generator(monkeypatch)
+    limiter = UpstreamLimiter('dashscope', max_concurrent=1, max_queue=0)
+    limiter.acquire()
+    monkeypatch.setattr(routes.ai_image_generator, 'limiter', limiter)
+
+    client = app.test_client()
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = {'image': (io.BytesIO(f.read()), 'scene.jpg'), 'style': '清新'}
+    response = client.post('/api/recommend/jobs', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['status'] == 'done'
+    assert job['advice']
+    assert job['ai_reference_images'] == []
+    assert job['ai_error']['code'] == 'upstream_busy'
+    assert calls == []
+
+    # 调用机会被归还后，任务在后台生成并归还自己获取的调用机会
+    limiter.release()
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = {'image': (io.BytesIO(f.read()), 'scene.jpg'), 'style': '清新'}
+    job = client.post('/api/recommend/jobs', data=data, content_type='multipart/form-data').get_json()
+    client.get(job['events_url']).get_data()
+    assert client.get(job['status_url']).get_json()['ai_reference_images']
+    assert limiter.stats()['in_use'] == 0
+
+
+# 测试本地保存的生成图片支持ETag条件请求和Range请求
+def test_media(monkeypatch, tmp_path):
+    store = ImageStore(str(tmp_path))
+    monkeypatch.setattr(routes, 'image_store', store)
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = f.read()
+    name, thumbnail_name = store.save(data)
+    client = app.test_client()
+
+    response = client.get(f'/media/{name}')
+    assert response.status_code == 200
+    assert response.data == data
+    assert response.mimetype == 'image/jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+    response = client.get(f'/media/{name}', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+    response = client.get(f'/media/{name}', headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert response.data == data[:100]
+
+    assert client.get(f'/media/{thumbnail_name}').status_code == 200
+    assert client.get('/media/missing.jpg').status_code == 404
+
+
+# 测试缓存和上传目录的默认值按项目根目录解析，不依赖启动服务时的工作目录
+def test_default_paths_anchored_to_project_root():
+    from app import BASE_DIR, project_path
+    assert project_path('cache/images') == os.path.join(BASE_DIR, 'cache', 'images')
+    assert project_path('/var/cache/images') == '/var/cache/images'
+    assert project_path('') == ''
+    for key in ('UPLOAD_FOLDER', 'IMAGE_STORE_DIR', 'GENERATION_CACHE_PATH', 'SEARCH_CACHE_DIR', 'PROFILE_DIR'):
+        assert not app.config[key] or os.path.isabs(app.config[key]), key
@@ -0,0 +1,92 @@
+import threading
+import time
+from concurrent import futures
+
+from app.utils.image_analyzer import ImageAnalyzer
+from app.utils.search_cache import SearchCache
+from app.utils.style_matcher import StyleMatcher
+from warm_search_cache import iter_keyword_sets
+
+
+# 计数的搜索函数，用于判断是否真正执行了搜索
+class CountingSearch:
+    def __init__(self, results=None):
+        self.calls = 0
+        self.results = results if results is not None else [{'url': 'http://img.example.com/1.jpg'}]
+
+    def __call__(self):
+        self.calls += 1
+        return [dict(image, call=self.calls) for image in self.results]
+
+
+# 测试新鲜期内直接返回缓存结果
+def test_fresh_hit_skips_search():
+    cache = SearchCache(ttl=60)
+    search = CountingSearch()
+    key = cache.make_key('nature pose', 5)
+    first = cache.get_or_fetch(key, search)
+    first[0]['url'] = 'modified'
+    second = cache.get_or_fetch(key, search)
+    assert search.calls == 1
+    assert second[0]['url'] == 'http://img.example.com/1.jpg'
+    assert cache.stats()['hits'] == 1
+
+
+# 测试陈旧期内先返回旧结果，并且只触发一次后台刷新
+def test_stale_result_refreshes_in_background():
+    cache = SearchCache(ttl=0.05, stale_ttl=60)
+    release = threading.Event()
+    search = CountingSearch()
+
+    def slow_search():
+        release.wait(2)
+        return search()
+
+    key = cache.make_key('city', 5)
+    cache.put(key, [{'url': 'old'}])
+    time.sleep(0.1)
+    with futures.ThreadPoolExecutor(max_workers=2) as executor:
+        assert cache.get_or_fetch(key, slow_search, refresh_executor=executor) == [{'url': 'old'}]
+        assert cache.get_or_fetch(key, slow_search, refresh_executor=executor) == [{'url': 'old'}]
+        release.set()
+    assert search.calls == 1
+    assert cache.get_or_fetch(key, slow_search)[0]['call'] == 1
+    stats = cache.stats()
+    assert stats['stale_hits'] == 2
+    assert stats['refreshes'] == 1
+
+
+# 测试超过陈旧期后同步重新搜索，空结果不缓存
+def test_expired_and_empty_results():
+    cache = SearchCache(ttl=0.01, stale_ttl=0.01)
+    key = cache.make_key('beach', 5)
+    cache.put(key, [{'url': 'old'}])
+    time.sleep(0.05)
+    search = CountingSearch()
+    assert cache.get_or_fetch(key, search)[0]['call'] == 1
+
+    empty = CountingSearch(results=[])
+    other = cache.make_key('indoor', 5)
+    cache.get_or_fetch(other, empty)
+    cache.get_or_fetch(other, empty)
+    assert empty.calls == 2
+
+
+# 测试内存条目数量限制和磁盘缓存共享
+def test_size_bound_and_disk_tier(tmp_path):
+    cache = SearchCache(ttl=60, max_entries=2, cache_dir=str(tmp_path))
+    for query in ('a', 'b', 'c'):
+        cache.put(cache.make_key(query, 5), [{'url': query}])
+    assert cache.stats()['entries'] == 2
+
+    other = SearchCache(ttl=60, cache_dir=str(tmp_path))
+    search = CountingSearch()
+    assert other.get_or_fetch(other.make_key('a', 5), search) == [{'url': 'a'}]
+    assert search.calls == 0
+
+
+# 测试预热覆盖所有场景、光线、色调和风格组合
+def test_warm_up_keyword_sets():
+    keyword_sets = list(iter_keyword_sets(ImageAnalyzer(), StyleMatcher().get_available_styles()))
+    assert len(keyword_sets) == 8 * 4 * 4 * 6
+    assert len({' '.join(keywords) for keywords in keyword_sets}) == len(keyword_sets)
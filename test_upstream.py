@@ -0,0 +1,223 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.utils.upstream import (
+    CircuitBreaker, CircuitOpenError, UpstreamBusyError, UpstreamLimiter, UpstreamTimeoutError, remaining_time
+)
+
+
+# 测试等待的请求按到达顺序获得调用机会
+def test_limiter_fifo_order():
+    limiter = UpstreamLimiter('test', max_concurrent=1, max_queue=10, queue_timeout=5)
+    limiter.acquire()
+    order = []
+
+    def worker(index):
+        with limiter.slot():
+            order.append(index)
+
+    threads = []
+    for index in range(5):
+        thread = threading.Thread(target=worker, args=(index,))
+        thread.start()
+        threads.append(thread)
+        # 等待线程进入队列，保证到达顺序
+        while limiter.stats()['queued'] < index + 1:
+            time.sleep(0.001)
+
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2, 3, 4]
+    assert limiter.stats()['in_use'] == 0
+
+
+# 测试队列已满时立即失败，不等待
+def test_limiter_rejects_when_queue_full():
+    limiter = UpstreamLimiter('test', max_concurrent=1, max_queue=0, queue_timeout=5)
+    limiter.acquire()
+    started = time.monotonic()
+    with pytest.raises(UpstreamBusyError) as error:
+        limiter.acquire()
+    assert time.monotonic() - started < 0.1
+    assert error.value.to_dict()['code'] == 'upstream_busy'
+    assert limiter.stats()['rejected'] == 1
+
+
+# 测试提前获取的调用机会可以在其他线程中归还，多次归还只生效一次
+def test_limiter_reservation():
+    limiter = UpstreamLimiter('test', max_concurrent=1, max_queue=0)
+    reservation = limiter.reserve()
+    with pytest.raises(UpstreamBusyError):
+        limiter.reserve()
+
+    thread = threading.Thread(target=reservation.release)
+    thread.start()
+    thread.join()
+    reservation.release()
+    assert limiter.stats()['in_use'] == 0
+
+    with limiter.reserve():
+        assert limiter.stats()['in_use'] == 1
+    assert limiter.stats()['in_use'] == 0
+
+
+# 测试排队超时后从队列移除
+def test_limiter_queue_timeout():
+    limiter = UpstreamLimiter('test', max_concurrent=1, max_queue=4, queue_timeout=0.05)
+    limiter.acquire()
+    with pytest.raises(UpstreamBusyError):
+        limiter.acquire()
+    stats = limiter.stats()
+    assert stats['queued'] == 0
+    assert stats['timeouts'] == 1
+    # 释放后新的请求可以直接获得调用机会
+    limiter.release()
+    limiter.acquire()
+
+
+# 测试令牌桶限制请求速率，空闲时允许突发
+def test_limiter_rate():
+    limiter = UpstreamLimiter('test', max_concurrent=10, rate=20, burst=2, queue_timeout=5)
+    started = time.monotonic()
+    for _ in range(4):
+        with limiter.slot():
+            pass
+    # 前两个请求立即发出，之后每个间隔0.05秒
+    assert 0.08 < time.monotonic() - started < 0.5
+
+
+# 测试等待令牌超过最长等待时间时立即失败
+def test_limiter_rate_exceeds_timeout():
+    limiter = UpstreamLimiter('test', max_concurrent=10, rate=1, burst=1, queue_timeout=0.1)
+    limiter.acquire()
+    with pytest.raises(UpstreamBusyError):
+        limiter.acquire()
+    assert limiter.stats()['in_use'] == 1
+
+
+# 测试异步排队不占用线程，并与同步调用共用同一个队列
+def test_limiter_async():
+    limiter = UpstreamLimiter('test', max_concurrent=2, max_queue=10, queue_timeout=5)
+    active = []
+    peak = []
+
+    async def call(index):
+        async with limiter.slot_async():
+            active.append(index)
+            peak.append(len(active))
+            await asyncio.sleep(0.02)
+            active.remove(index)
+
+    async def main():
+        await asyncio.gather(*(call(index) for index in range(6)))
+
+    asyncio.run(main())
+    assert max(peak) == 2
+    stats = limiter.stats()
+    assert (stats['in_use'], stats['queued'], stats['acquired']) == (0, 0, 6)
+
+
+# 测试异步排队超时
+def test_limiter_async_timeout():
+    limiter = UpstreamLimiter('test', max_concurrent=1, max_queue=4, queue_timeout=0.05)
+    limiter.acquire()
+
+    async def main():
+        with pytest.raises(UpstreamBusyError):
+            await limiter.acquire_async()
+
+    asyncio.run(main())
+    assert limiter.stats()['queued'] == 0
+
+
+# 测试连续失败后熔断，冷却后放行一次试探请求
+def test_circuit_breaker_lifecycle():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.05)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.check()
+    assert 0 < error.value.retry_after <= 0.05
+
+    time.sleep(0.06)
+    assert breaker.state == 'half_open'
+    breaker.check()
+    breaker.before_call()
+    # 试探请求进行中，其他请求继续跳过
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.stats()['opened'] == 1
+
+
+# 测试试探请求失败时重新熔断
+def test_circuit_breaker_trial_failure():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.stats()['opened'] == 2
+
+
+# 测试没有到达上游的试探请求归还试探机会，过期的标记不影响新的试探
+def test_circuit_breaker_release_trial():
+    # 冷却时间同时决定试探请求多久后视为丢失，留出足够余量避免试探在断言前过期
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.3)
+    breaker.record_failure()
+    time.sleep(0.31)
+    trial = breaker.before_call()
+    assert trial is not None
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.release_trial(trial)
+    assert breaker.state == 'half_open'
+    new_trial = breaker.before_call()
+    # 已归还的试探机会再次归还时不影响正在进行的试探
+    breaker.release_trial(trial)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.release_trial(new_trial)
+    breaker.before_call()
+
+
+# 测试成功的请求清零连续失败次数，阈值为0时不熔断
+def test_circuit_breaker_consecutive_only():
+    breaker = CircuitBreaker('test', failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+    disabled = CircuitBreaker('test', failure_threshold=0)
+    for _ in range(10):
+        disabled.record_failure()
+    assert disabled.state == 'closed'
+
+
+# 测试截止时间已过时不再调用上游
+def test_remaining_time():
+    assert remaining_time(None) is None
+    assert 0 < remaining_time(time.monotonic() + 1) <= 1
+    with pytest.raises(UpstreamTimeoutError):
+        remaining_time(time.monotonic() - 0.01)
+
+
+# 测试排队时间不超过请求剩余的时间
+def test_limiter_wait_bounded_by_timeout():
+    limiter = UpstreamLimiter('test', max_concurrent=1, max_queue=4, queue_timeout=5)
+    limiter.acquire()
+    started = time.monotonic()
+    with pytest.raises(UpstreamBusyError):
+        limiter.acquire(timeout=0.05)
+    assert time.monotonic() - started < 1
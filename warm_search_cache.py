@@ -0,0 +1,88 @@
+"""
+预热关键词图片搜索缓存
+
+搜索关键词只由场景类型、光线、主色调和风格决定（8×4×4×6种组合），
+预先搜索所有组合并写入磁盘缓存，服务启动后直接命中缓存。
+
+用法：
+    python warm_search_cache.py
+    python warm_search_cache.py --cache-dir cache/search --workers 2 --interval 1 --limit 5
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from concurrent import futures
+
+from app.utils.image_analyzer import ImageAnalyzer
+from app.utils.image_searcher import ImageSearcher
+from app.utils.search_cache import SearchCache
+from app.utils.style_matcher import StyleMatcher
+
+# 与服务的SEARCH_CACHE_DIR默认值相同，不受运行脚本时工作目录的影响
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'search')
+
+
+def iter_keyword_sets(image_analyzer, styles):
+    """
+    列出所有场景特征和风格组合对应的搜索关键词
+    :param image_analyzer: ImageAnalyzer实例
+    :param styles: 风格列表
+    :return: 搜索关键词列表的生成器
+    """
+    combinations = itertools.product(image_analyzer.scene_categories, image_analyzer.light_categories,
+                                     image_analyzer.color_categories, styles)
+    for scene_type, light_type, dominant_color, style in combinations:
+        scene_features = {
+            'scene_type': scene_type,
+            'light_type': light_type,
+            'colors': {'dominant_color': dominant_color}
+        }
+        yield image_analyzer.generate_search_keywords(scene_features, style)
+
+
+def run(args):
+    cache = SearchCache(ttl=args.ttl, stale_ttl=args.stale_ttl, max_entries=0, cache_dir=args.cache_dir)
+    searcher = ImageSearcher(cache=cache, hedged=args.hedged)
+    keyword_sets = list(iter_keyword_sets(ImageAnalyzer(), StyleMatcher().get_available_styles()))
+    print(f'共{len(keyword_sets)}个关键词组合', file=sys.stderr)
+
+    completed = 0
+    empty = 0
+    # 限制并发和请求间隔，避免触发搜索引擎的频率限制
+    with futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        pending = set()
+        for keywords in keyword_sets:
+            if len(pending) >= args.workers:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    completed += 1
+                    empty += 0 if future.result() else 1
+            pending.add(executor.submit(searcher.search_images, keywords, args.limit))
+            if args.interval:
+                time.sleep(args.interval)
+        for future in futures.as_completed(pending):
+            completed += 1
+            empty += 0 if future.result() else 1
+
+    stats = cache.stats()
+    print(f'完成：{completed}个组合，已缓存{stats["hits"]}个，新搜索{stats["misses"]}个，无结果{empty}个',
+          file=sys.stderr)
+    return completed, empty
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='预热关键词图片搜索缓存')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='磁盘缓存目录，与服务的SEARCH_CACHE_DIR一致')
+    parser.add_argument('--ttl', type=int, default=3600, help='已缓存结果的新鲜期（秒），新鲜的结果不重新搜索')
+    parser.add_argument('--stale-ttl', type=int, default=0, help='陈旧期（秒），预热时默认重新搜索所有过期结果')
+    parser.add_argument('--limit', type=int, default=5, help='每个组合的图片数量，与服务调用时一致才能命中缓存')
+    parser.add_argument('--workers', type=int, default=2, help='并发搜索数量')
+    parser.add_argument('--interval', type=float, default=0.5, help='提交两次搜索之间的间隔（秒）')
+    parser.add_argument('--hedged', action='store_true', help='同时向所有来源发起搜索')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())